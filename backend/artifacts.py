@@ -0,0 +1,272 @@
+"""Memory-mapped model artifact store shared across Gunicorn workers.
+
+pickle.load gives every worker its own private copy of the forests. An
+artifact directory instead holds:
+
+    manifest.json                  version, library versions and sha256 of every file
+    <name>.joblib                  the sklearn object, numpy arrays memory-mapped on load
+    <name>.flat/<array>.npy        flattened forest node arrays, in both the batch
+                                   and the single-row layout (forests only)
+    <name>.preprocessor.joblib     preprocessing steps of a forest Pipeline
+
+With FOREST_ENGINE=flat the forests are served straight from the .npy memory
+maps, so every worker shares the same page-cache pages and startup does not
+deserialize any trees. sklearn's Tree copies its nodes into private memory
+on unpickling, so the 'sklearn' engine only shares the smaller arrays.
+
+Build a store from the pickles in the backend directory with:
+
+    python artifacts.py build artifacts --version 2026.10
+"""
+import argparse
+import collections
+import datetime
+import hashlib
+import json
+import os
+import pickle
+
+import joblib
+import numpy as np
+import sklearn
+from sklearn.pipeline import Pipeline
+
+from encoding import compile_encoders
+from forest_engine import FlatForest, FlatPipeline, load_engine
+
+
+FORMAT_VERSION = 1
+MANIFEST = 'manifest.json'
+
+# Artifact name -> pickle written by the training scripts and notebooks
+PICKLES = {
+    'ckd_model': 'ckd_model.pkl',
+    'future_params': 'future_params.pkl',
+    'cluster_model': 'cluster_model.pkl',
+    'scaler': 'scaler.pkl',
+    'label_encoders': 'label_encoders.pkl',
+}
+
+# Everything the backend serves, swapped as one unit
+ModelSet = collections.namedtuple(
+    'ModelSet',
+    'ckd_model param_model cluster_model scaler label_encoders encoding_tables version fingerprint',
+)
+
+
+class ArtifactError(Exception):
+    """Raised when an artifact directory is missing, incompatible or corrupted."""
+
+
+def file_digest(path, chunk_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def pickle_fingerprint(source='.'):
+    """Digest over the backend pickles, used as the model version when no store is configured."""
+    digest = hashlib.sha256()
+    for name, filename in sorted(PICKLES.items()):
+        digest.update(f'{name}:{file_digest(os.path.join(source, filename))}\n'.encode())
+    return digest.hexdigest()
+
+
+def _forest_of(model):
+    """Return the forest to flatten for a model, or None if it is not forest based."""
+    final = model[-1] if isinstance(model, Pipeline) else model
+    return final if hasattr(final, 'estimators_') and hasattr(final.estimators_[0], 'tree_') else None
+
+
+def save_artifacts(models, directory, version, metadata=None):
+    """Write models ({name: fitted object}) into an artifact directory.
+
+    metadata, if given, is stored in the manifest under 'training'.
+    """
+    os.makedirs(directory, exist_ok=True)
+    entries = {}
+    for name, model in models.items():
+        files = [f'{name}.joblib']
+        joblib.dump(model, os.path.join(directory, files[0]))
+        entry = {'type': type(model).__name__}
+
+        forest = _forest_of(model)
+        if forest is not None:
+            arrays, meta = FlatForest(forest).to_arrays()
+            os.makedirs(os.path.join(directory, f'{name}.flat'), exist_ok=True)
+            for array_name, array in arrays.items():
+                path = f'{name}.flat/{array_name}.npy'
+                np.save(os.path.join(directory, path), np.ascontiguousarray(array))
+                files.append(path)
+            entry['flat'] = meta
+            if isinstance(model, Pipeline):
+                path = f'{name}.preprocessor.joblib'
+                joblib.dump(model[:-1], os.path.join(directory, path))
+                files.append(path)
+
+        entry['files'] = {path: file_digest(os.path.join(directory, path)) for path in files}
+        entries[name] = entry
+
+    manifest = {
+        'format_version': FORMAT_VERSION,
+        'version': version,
+        'created': datetime.datetime.now().isoformat(timespec='seconds'),
+        'sklearn_version': sklearn.__version__,
+        'numpy_version': np.__version__,
+        'artifacts': entries,
+    }
+    if metadata is not None:
+        manifest['training'] = metadata
+    # Written last so a half-built directory never looks complete
+    with open(os.path.join(directory, MANIFEST), 'w') as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+class ArtifactStore:
+    """Read-only view of an artifact directory written by save_artifacts."""
+
+    def __init__(self, directory, verify=True):
+        self.directory = directory
+        self.verify = verify
+        try:
+            with open(os.path.join(directory, MANIFEST)) as f:
+                self.manifest = json.load(f)
+        except FileNotFoundError:
+            raise ArtifactError(f'No {MANIFEST} in artifact directory {directory!r}') from None
+        if self.manifest.get('format_version') != FORMAT_VERSION:
+            raise ArtifactError(
+                f"Unsupported artifact format {self.manifest.get('format_version')!r}, expected {FORMAT_VERSION}"
+            )
+
+    @property
+    def version(self):
+        return self.manifest['version']
+
+    @property
+    def fingerprint(self):
+        """Digest over every artifact checksum; changes whenever any artifact does."""
+        digest = hashlib.sha256()
+        for name in sorted(self.manifest['artifacts']):
+            for path, checksum in sorted(self.manifest['artifacts'][name]['files'].items()):
+                digest.update(f'{name}:{path}:{checksum}\n'.encode())
+        return digest.hexdigest()
+
+    def _entry(self, name):
+        try:
+            return self.manifest['artifacts'][name]
+        except KeyError:
+            raise ArtifactError(f'Artifact {name!r} not found in {self.directory!r}') from None
+
+    def _verified(self, name, path):
+        full = os.path.join(self.directory, path)
+        if file_digest(full) != self._entry(name)['files'][path]:
+            raise ArtifactError(f'Checksum mismatch for {path} in {self.directory!r}')
+        return full
+
+    def _path(self, name, path):
+        if self.verify:
+            return self._verified(name, path)
+        return os.path.join(self.directory, path)
+
+    def check(self):
+        """Verify the checksum of every file in the manifest."""
+        for name, entry in self.manifest['artifacts'].items():
+            for path in entry['files']:
+                self._verified(name, path)
+
+    def load(self, name, mmap=True):
+        """Load the sklearn object, with its numpy arrays memory-mapped read-only unless mmap is False."""
+        return joblib.load(self._path(name, f'{name}.joblib'), mmap_mode='r' if mmap else None)
+
+    def load_model(self, name, engine='sklearn'):
+        """Load a model wrapped in the requested forest engine."""
+        entry = self._entry(name)
+        if engine != 'flat' or 'flat' not in entry:
+            return load_engine(self.load(name), engine)
+
+        prefix = f'{name}.flat/'
+        arrays = {
+            path[len(prefix):-len('.npy')]: np.load(self._path(name, path), mmap_mode='r')
+            for path in entry['files'] if path.startswith(prefix)
+        }
+        forest = FlatForest.from_arrays(arrays, entry['flat'])
+        preprocessor = f'{name}.preprocessor.joblib'
+        if preprocessor in entry['files']:
+            return FlatPipeline.from_parts(joblib.load(self._path(name, preprocessor), mmap_mode='r'), forest)
+        return forest
+
+
+def _cluster_pipeline(cluster_model):
+    """cluster_model, if it takes raw lab values: a Pipeline with the preprocessing before KMeans."""
+    if not isinstance(cluster_model, Pipeline):
+        # A bare KMeans expects Yeo-Johnson + scaled values and puts raw ones all in one cluster
+        raise ArtifactError(
+            f'cluster_model is a bare {type(cluster_model).__name__}; /clustering passes raw lab values, so it '
+            f'must be the PowerTransformer -> StandardScaler -> KMeans pipeline train.py writes'
+        )
+    return cluster_model
+
+
+def load_model_set(directory=None, engine='sklearn', verify=True, source='.'):
+    """Load every served model from an artifact directory, or from the .pkl files in source.
+
+    Raises ArtifactError when the cluster model is not a Pipeline.
+    """
+    if directory:
+        store = ArtifactStore(directory, verify=verify)
+        label_encoders = store.load('label_encoders')
+        return ModelSet(
+            ckd_model=store.load_model('ckd_model', engine),
+            param_model=store.load_model('future_params', engine),
+            cluster_model=_cluster_pipeline(store.load('cluster_model')),
+            scaler=store.load('scaler'),
+            label_encoders=label_encoders,
+            encoding_tables=compile_encoders(label_encoders),
+            version=store.version,
+            fingerprint=store.fingerprint,
+        )
+    loaded = {}
+    for name, filename in PICKLES.items():
+        with open(os.path.join(source, filename), 'rb') as f:
+            loaded[name] = pickle.load(f)
+    return ModelSet(
+        ckd_model=load_engine(loaded['ckd_model'], engine),
+        param_model=load_engine(loaded['future_params'], engine),
+        cluster_model=_cluster_pipeline(loaded['cluster_model']),
+        scaler=loaded['scaler'],
+        label_encoders=loaded['label_encoders'],
+        encoding_tables=compile_encoders(loaded['label_encoders']),
+        version=None,
+        fingerprint=pickle_fingerprint(source),
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Build a memory-mappable model artifact directory.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    build = subparsers.add_parser('build', help='convert the backend pickles into an artifact directory')
+    build.add_argument('directory', help='output artifact directory')
+    build.add_argument('--version', required=True, help='version label stored in the manifest')
+    build.add_argument('--source', default='.', help='directory holding the .pkl files')
+    verify = subparsers.add_parser('verify', help='check every checksum in an artifact directory')
+    verify.add_argument('directory')
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        models = {}
+        for name, filename in PICKLES.items():
+            with open(os.path.join(args.source, filename), 'rb') as f:
+                models[name] = pickle.load(f)
+        manifest = save_artifacts(models, args.directory, args.version)
+        print(f"Wrote {len(manifest['artifacts'])} artifacts to {args.directory} (version {args.version})")
+    else:
+        store = ArtifactStore(args.directory)
+        store.check()
+        print(f'All checksums match for version {store.version}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,332 @@
+"""End-to-end HTTP benchmark of the Flask app.
+
+Starts the app in a server subprocess against a throwaway SQLite database
+(or --database, e.g. a local PostgreSQL), seeds users with test reports,
+treatment plans and selected plans, then replays a fixed mix of requests
+at a fixed concurrency. Prints throughput and p50/p95/p99 latency per
+route as JSON, tagged with the git commit, so two runs can be compared.
+
+Run from the backend directory:
+
+    python bench_http.py --users 200 --concurrency 16 --duration 30 --output before.json
+    python bench_http.py --users 200 --concurrency 16 --duration 30 --compare before.json
+
+Only use --database with a database you can throw away; the benchmark
+writes to it.
+"""
+import argparse
+import http.client
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+import numpy as np
+import pandas as pd
+
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+DATASET = os.path.join(BACKEND_DIR, '..', 'CKD_Historical', 'updated_medical_lifestyle_dataset.csv')
+PASSWORD = 'bench-password'
+
+# Relative request frequencies
+MIX = {
+    'POST /api/login': 5,
+    'POST /predict': 30,
+    'POST /clustering': 15,
+    'POST /select_treatment': 10,
+    'POST /get_selected_treatment': 15,
+    'POST /update-treatment': 10,
+    'GET /health-data': 15,
+}
+
+# Dataset column -> /predict payload key
+PAYLOAD_KEYS = {
+    'serum_creatinine': 'serumCreatinine', 'gfr': 'gfr', 'bun': 'bun', 'serum_calcium': 'serumCalcium',
+    'ana': 'ana', 'c3_c4': 'c3c4', 'hematuria': 'hematuria', 'oxalate_levels': 'oxalateLevels',
+    'urine_ph': 'urinePh', 'blood_pressure': 'bloodPressure', 'physical_activity': 'physicalActivity',
+    'diet': 'diet', 'water_intake': 'waterIntake', 'smoking': 'smoking', 'alcohol': 'alcoholConsumption',
+    'painkiller_usage': 'painkillerUsage', 'family_history': 'familyHistory', 'weight_changes': 'weightChanges',
+    'stress_level': 'stressLevel',
+}
+STATE_FIELDS = [
+    'serum_creatinine', 'gfr', 'bun', 'serum_calcium', 'ana',
+    'c3_c4', 'hematuria', 'oxalate_levels', 'urine_ph', 'blood_pressure',
+]
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=BACKEND_DIR,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def load_payloads(n, rng):
+    frame = pd.read_csv(DATASET).sample(n=n, replace=n > 4000, random_state=rng.randrange(2**31))
+    payloads = []
+    for record in frame.to_dict('records'):
+        payload = {PAYLOAD_KEYS[column]: value for column, value in record.items() if column in PAYLOAD_KEYS}
+        payload.update(gender='Female', age=50)
+        payloads.append(payload)
+    return payloads
+
+
+def seed(users, plans_per_cluster, rng):
+    """Create users with a CKD test report and a selected plan; returns (emails, tokens, plan ids)."""
+    import main
+    from werkzeug.security import generate_password_hash
+
+    run = uuid.uuid4().hex[:8]
+    payloads = load_payloads(users, rng)
+    with main.app.app_context():
+        plans = []
+        for cluster in range(7):
+            for _ in range(plans_per_cluster):
+                plans.append(main.FinalTreatmentPlan(
+                    cluster=cluster, sodium_int=round(rng.uniform(1, 3), 1), fluid_int=round(rng.uniform(1.5, 3), 1),
+                    physical_activity='Aerobic exercises thrice a week', diet='Balanced diet',
+                    alcohol_limit='Limit alcohol to occasional',
+                    serum_creatinine=rng.uniform(-1, 0), gfr=rng.uniform(0, 20), bun=rng.uniform(-10, 0),
+                    serum_calcium=rng.uniform(-0.5, 0.5), oxalate_levels=rng.uniform(0, 30),
+                    urine_ph=rng.uniform(-0.5, 0.5), blood_pressure=rng.uniform(-20, 0),
+                ))
+        main.db.session.add_all(plans)
+
+        # One hash for everyone; login still pays the full check
+        password = generate_password_hash(PASSWORD)
+        accounts = [main.UserTable(name=f'bench {i}', email=f'bench-{run}-{i}@example.com', password=password)
+                    for i in range(users)]
+        main.db.session.add_all(accounts)
+        main.db.session.flush()
+
+        features = main.build_feature_matrix(payloads)
+        reports, _ = main.ckd_reports(features)
+        for account, payload, ckd_report in zip(accounts, payloads, reports):
+            main.db.session.add(main.TestReports(
+                user_id=account.user_id, ckd_report=ckd_report, **main.test_report_fields(payload)))
+            main.db.session.add(main.FinalSelectedPlan(
+                user_id=account.user_id, plan_id=rng.choice(plans).id, sodium_int=2.0, fluid_int=2.0,
+                physical_activity='Aerobic exercises thrice a week', diet='Balanced diet',
+                alcohol_limit='Limit alcohol to occasional',
+            ))
+        main.db.session.commit()
+        emails = [account.email for account in accounts]
+        tokens = [main.generate_token(account.user_id) for account in accounts]
+        plan_ids = [plan.id for plan in plans]
+    return emails, tokens, plan_ids, payloads
+
+
+def start_server(port, env, server, workers, log_path):
+    """Start the app on port; its output goes to log_path, since a full pipe would stall it."""
+    if server == 'gunicorn':
+        command = [sys.executable, '-m', 'gunicorn', '--workers', str(workers), '--threads', '8',
+                   '--bind', f'127.0.0.1:{port}', '--log-level', 'warning', 'main:app']
+    else:
+        command = [sys.executable, '-c',
+                   'import main; from werkzeug.serving import run_simple; '
+                   f'run_simple("127.0.0.1", {port}, main.app, threaded=True)']
+    with open(log_path, 'w') as log:
+        process = subprocess.Popen(command, cwd=BACKEND_DIR, env=env, stdout=log, stderr=subprocess.STDOUT)
+    deadline = time.monotonic() + 120
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            with open(log_path) as log:
+                raise RuntimeError(f'server exited: {log.read()[-2000:]}')
+        try:
+            connection = http.client.HTTPConnection('127.0.0.1', port, timeout=1)
+            connection.request('GET', '/health-data')
+            connection.getresponse().read()
+            return process
+        except OSError:
+            time.sleep(0.2)
+    process.kill()
+    raise RuntimeError('server did not start')
+
+
+class Client:
+    """One keep-alive connection replaying random requests from the mix."""
+
+    def __init__(self, port, emails, tokens, plan_ids, payloads, seed):
+        self.port = port
+        self.emails = emails
+        self.tokens = tokens
+        self.plan_ids = plan_ids
+        self.payloads = payloads
+        self.rng = random.Random(seed)
+        self.routes = list(MIX)
+        self.weights = [MIX[route] for route in self.routes]
+        self.connection = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+
+    def request(self):
+        route = self.rng.choices(self.routes, self.weights)[0]
+        method, path = route.split(' ')
+        user = self.rng.randrange(len(self.tokens))
+        headers = {'Authorization': f'Bearer {self.tokens[user]}', 'Content-Type': 'application/json'}
+        body = None
+        if path == '/api/login':
+            body = {'email': self.emails[user], 'password': PASSWORD}
+        elif path == '/predict':
+            body = self.rng.choice(self.payloads)
+        elif path == '/select_treatment':
+            body = {'treatment_id': self.rng.choice(self.plan_ids)}
+        elif path == '/update-treatment':
+            payload = self.rng.choice(self.payloads)
+            body = {'new_state': {field: float(payload[PAYLOAD_KEYS[field]]) for field in STATE_FIELDS}}
+
+        start = time.perf_counter()
+        try:
+            self.connection.request(method, path, body=json.dumps(body) if body is not None else None,
+                                    headers=headers)
+            response = self.connection.getresponse()
+            response.read()
+            status = response.status
+        except (OSError, http.client.HTTPException):
+            self.connection.close()
+            self.connection = http.client.HTTPConnection('127.0.0.1', self.port, timeout=60)
+            status = 0
+        return route, status, time.perf_counter() - start
+
+
+def replay(port, accounts, concurrency, duration, warmup, seed):
+    emails, tokens, plan_ids, payloads = accounts
+    samples = {route: [] for route in MIX}
+    statuses = {route: {} for route in MIX}
+    lock = threading.Lock()
+    measure_from = time.monotonic() + warmup
+    stop_at = measure_from + duration
+
+    def worker(index):
+        client = Client(port, emails, tokens, plan_ids, payloads, seed * 1000 + index)
+        local = []
+        while time.monotonic() < stop_at:
+            sent_at = time.monotonic()
+            route, status, seconds = client.request()
+            if sent_at >= measure_from:
+                local.append((route, status, seconds))
+        with lock:
+            for route, status, seconds in local:
+                samples[route].append(seconds)
+                statuses[route][str(status)] = statuses[route].get(str(status), 0) + 1
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return samples, statuses
+
+
+def summarize(samples, statuses, duration):
+    routes = {}
+    for route, latencies in samples.items():
+        if not latencies:
+            continue
+        ms = np.array(latencies) * 1e3
+        errors = sum(count for status, count in statuses[route].items() if status == '0' or status.startswith('5'))
+        routes[route] = {
+            'requests': len(latencies),
+            'errors': errors,
+            'statuses': statuses[route],
+            'rps': round(len(latencies) / duration, 2),
+            'mean_ms': round(float(ms.mean()), 3),
+            'p50_ms': round(float(np.percentile(ms, 50)), 3),
+            'p95_ms': round(float(np.percentile(ms, 95)), 3),
+            'p99_ms': round(float(np.percentile(ms, 99)), 3),
+        }
+    all_ms = np.concatenate([np.array(latencies) for latencies in samples.values() if latencies]) * 1e3
+    total = {
+        'requests': int(len(all_ms)),
+        'errors': sum(route['errors'] for route in routes.values()),
+        'rps': round(len(all_ms) / duration, 2),
+        'p50_ms': round(float(np.percentile(all_ms, 50)), 3),
+        'p95_ms': round(float(np.percentile(all_ms, 95)), 3),
+        'p99_ms': round(float(np.percentile(all_ms, 99)), 3),
+    }
+    return routes, total
+
+
+def compare(result, baseline_path):
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    print(f"\n{'route':<30} {'rps':>18} {'p50 ms':>20} {'p99 ms':>20}", file=sys.stderr)
+    rows = list(result['routes'].items()) + [('total', result['total'])]
+    for route, now in rows:
+        before = baseline['total'] if route == 'total' else baseline['routes'].get(route)
+        if not before:
+            continue
+        cells = [f"{before[key]:>8.1f} -> {now[key]:>7.1f}" for key in ('rps', 'p50_ms', 'p99_ms')]
+        print(f'{route:<30} ' + ' '.join(f'{cell:>20}' for cell in cells), file=sys.stderr)
+    print(f"baseline {baseline.get('commit')} vs {result.get('commit')}", file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay mixed HTTP traffic against the app.')
+    parser.add_argument('--database', help='database URI to seed and use (default: a new SQLite file)')
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--plans-per-cluster', type=int, default=20)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--duration', type=float, default=20.0, help='measured seconds')
+    parser.add_argument('--warmup', type=float, default=3.0, help='seconds replayed before measuring')
+    parser.add_argument('--server', choices=['werkzeug', 'gunicorn'], default='werkzeug')
+    parser.add_argument('--workers', type=int, default=4, help='gunicorn worker processes')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='also write the JSON result to this file')
+    parser.add_argument('--compare', help='print the change against an earlier JSON result')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='bench-http-')
+    env = dict(os.environ)
+    env['DATABASE_URI'] = args.database or f"sqlite:///{os.path.join(workdir, 'app.db')}"
+    env.setdefault('SECRET_KEY', 'bench-secret')
+    env.setdefault('PREDICTION_CACHE_PATH', os.path.join(workdir, 'prediction_cache.sqlite3'))
+    os.environ.update(env)
+    sys.path.insert(0, BACKEND_DIR)
+    os.chdir(BACKEND_DIR)
+
+    rng = random.Random(args.seed)
+    accounts = seed(args.users, args.plans_per_cluster, rng)
+    port = free_port()
+    server = start_server(port, env, args.server, args.workers, os.path.join(workdir, 'server.log'))
+    try:
+        samples, statuses = replay(port, accounts, args.concurrency, args.duration, args.warmup, args.seed)
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+
+    routes, total = summarize(samples, statuses, args.duration)
+    result = {
+        'commit': git_commit(),
+        'config': {
+            'database': 'sqlite' if not args.database else args.database.split(':', 1)[0],
+            'server': args.server, 'workers': args.workers if args.server == 'gunicorn' else 1,
+            'users': args.users, 'plans_per_cluster': args.plans_per_cluster,
+            'concurrency': args.concurrency, 'duration': args.duration, 'seed': args.seed,
+        },
+        'routes': routes,
+        'total': total,
+    }
+    print(json.dumps(result, indent=2))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(result, f, indent=2)
+    if args.compare:
+        compare(result, args.compare)
+    return 0 if total['errors'] == 0 else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,226 @@
+"""Micro-benchmarks of the numeric inference paths, below the HTTP layer.
+
+Every case runs at batch sizes 1, 64, 4096 and the full 4000-row
+CKD_Historical/updated_ckd_dataset_with_stages.csv (4096 cycles through
+the dataset). Wall time is the median and best of --repeat timed runs,
+each looping long enough to last --min-time seconds. A separate call
+under tracemalloc records the peak bytes allocated during the call and
+the bytes still held after it, so copy and allocation regressions show
+up as well as CPU ones.
+
+Run from the backend directory:
+
+    python bench_ml.py --output before.json
+    python bench_ml.py --compare before.json
+    FOREST_ENGINE=flat python bench_ml.py --only predict
+
+With --compare, exits 1 if any case got slower, or allocates more at
+peak, by more than --tolerance.
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import timeit
+import tracemalloc
+import warnings
+
+# Must be set before main is imported; never touch the configured database
+_workdir = tempfile.mkdtemp(prefix='bench-ml-')
+os.environ['DATABASE_URI'] = f"sqlite:///{os.path.join(_workdir, 'app.db')}"
+os.environ.setdefault('SECRET_KEY', 'bench-ml')
+os.environ['PREDICTION_CACHE'] = 'off'
+
+import numpy as np  # noqa: E402
+import pandas as pd  # noqa: E402
+
+import main  # noqa: E402
+from bench_http import git_commit  # noqa: E402
+from encoding import CATEGORICAL_COLUMNS, encode_column  # noqa: E402
+from plan_cache import PLAN_FEATURES  # noqa: E402
+from plan_scoring import calculate_efficiency, score_plans  # noqa: E402
+from q_store import apply_q_update  # noqa: E402
+
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+DATASET = os.path.join(BACKEND_DIR, '..', 'CKD_Historical', 'updated_ckd_dataset_with_stages.csv')
+# (label, rows); None is the whole dataset
+SIZES = [('1', 1), ('64', 64), ('4096', 4096), ('full', None)]
+STATE_FIELDS = main.FEATURE_COLUMNS[:len(main.MEDICAL_FIELDS)]
+
+
+class Batch:
+    """Every input the cases need, prepared once per batch size outside the timed code."""
+
+    def __init__(self, dataset, n, rng):
+        raw = dataset.iloc[np.resize(np.arange(len(dataset)), n)].reset_index(drop=True)
+        self.rows = n
+        self.raw = raw
+        self.categories = {column: raw[column].tolist() for column in CATEGORICAL_COLUMNS}
+
+        features = raw[main.FEATURE_COLUMNS].copy()
+        for column in CATEGORICAL_COLUMNS:
+            features[column] = encode_column(main.models.encoding_tables, column, self.categories[column])
+        self.features = features.to_numpy(dtype=np.float64)
+        self.standardized = main.models.scaler.transform(self.features)
+        self.param_frame = raw[main.FEATURE_COLUMNS + ['months']]
+        self.cluster_input = raw[PLAN_FEATURES].to_numpy(dtype=np.float64)
+
+        # Each row against the next, as /update-treatment compares the old and new report
+        states = raw[STATE_FIELDS].to_dict('records')
+        self.transitions = [
+            (old, main.calculate_difference(old, new)) for old, new in zip(states, states[1:] + states[:1])
+        ]
+        self.efficiency_pairs = [
+            (dict(zip(PLAN_FEATURES, values)), main.NORMAL_RANGES)
+            for values in self.cluster_input.tolist()
+        ]
+        # Rows as plan changes for the median patient
+        self.patient = dataset[PLAN_FEATURES].median().to_numpy()
+        self.plan_deltas = self.cluster_input - self.patient
+        self.q_events = [
+            (rng.sample(main.actions, rng.randint(1, len(main.actions))), difference['gfr'])
+            for _, difference in self.transitions
+        ]
+
+
+def encode_label_encoders(batch):
+    for column in CATEGORICAL_COLUMNS:
+        main.models.label_encoders[column].transform(batch.raw[column])
+
+
+def encode_tables(batch):
+    for column in CATEGORICAL_COLUMNS:
+        encode_column(main.models.encoding_tables, column, batch.categories[column])
+
+
+def efficiency_loop(batch):
+    for modified, reference in batch.efficiency_pairs:
+        calculate_efficiency(modified, reference)
+
+
+def adjustment_loop(batch):
+    for old_state, difference in batch.transitions:
+        main.dynamic_adjustment(old_state, difference)
+
+
+def q_update_loop(batch):
+    q_table = dict.fromkeys(main.actions, 0.0)
+    for selected_actions, reward in batch.q_events:
+        apply_q_update(q_table, selected_actions, reward, main.learning_rate, main.discount_factor)
+
+
+CASES = {
+    'encode.label_encoders': encode_label_encoders,
+    'encode.tables': encode_tables,
+    'scaler.transform': lambda batch: main.models.scaler.transform(batch.features),
+    'ckd.predict': lambda batch: main.models.ckd_model.predict(batch.standardized),
+    'param.predict': lambda batch: main.models.param_model.predict(batch.param_frame),
+    'cluster.predict': lambda batch: main.models.cluster_model.predict(batch.cluster_input),
+    'calculate_efficiency': efficiency_loop,
+    'score_plans': lambda batch: score_plans(batch.patient, batch.plan_deltas),
+    'dynamic_adjustment': adjustment_loop,
+    'q_update': q_update_loop,
+}
+
+
+def time_call(fn, min_time, repeat):
+    """(median, best) seconds per call."""
+    timer = timeit.Timer(fn)
+    number = 1
+    while timer.timeit(number) < min_time:
+        number *= 2
+    runs = [total / number for total in timer.repeat(repeat, number)]
+    return statistics.median(runs), min(runs)
+
+
+def trace_call(fn):
+    """(peak, retained) bytes allocated by one call."""
+    tracemalloc.start()
+    try:
+        before, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        result = fn()
+        after, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    del result
+    return peak - before, after - before
+
+
+def compare(results, baseline_path, tolerance):
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    before = {(row['case'], row['batch']): row for row in baseline['results']}
+    regressions = 0
+    print(f"\n{'case':<24} {'batch':>6} {'median us':>24} {'peak KiB':>24}", file=sys.stderr)
+    for row in results:
+        old = before.get((row['case'], row['batch']))
+        if not old:
+            continue
+        slower = row['median_s'] > old['median_s'] * (1 + tolerance)
+        bigger = row['peak_bytes'] > old['peak_bytes'] * (1 + tolerance) + 1024
+        regressions += slower or bigger
+        print(f"{row['case']:<24} {row['batch']:>6} "
+              f"{old['median_s'] * 1e6:>10.1f} -> {row['median_s'] * 1e6:>10.1f}{'!' if slower else ' '} "
+              f"{old['peak_bytes'] / 1024:>10.1f} -> {row['peak_bytes'] / 1024:>10.1f}{'!' if bigger else ' '}",
+              file=sys.stderr)
+    print(f"baseline {baseline.get('commit')} vs {git_commit()}: {regressions} regression(s)", file=sys.stderr)
+    return regressions
+
+
+def run():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--only', help='run only the cases whose name contains this')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--min-time', type=float, default=0.05, help='seconds per timed run')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='also write the JSON result to this file')
+    parser.add_argument('--compare', help='print the change against an earlier JSON result')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='allowed slowdown or growth for --compare')
+    args = parser.parse_args()
+    # The models were fitted on named frames; the serving path passes arrays, as here
+    warnings.filterwarnings('ignore', category=UserWarning)
+
+    dataset = pd.read_csv(DATASET)
+    rng = random.Random(args.seed)
+    cases = {name: fn for name, fn in CASES.items() if not args.only or args.only in name}
+
+    results = []
+    print(f"{'case':<24} {'batch':>6} {'median us':>12} {'best us':>12} {'us/row':>10} {'peak KiB':>10} "
+          f"{'held KiB':>10}", file=sys.stderr)
+    for label, n in SIZES:
+        batch = Batch(dataset, n or len(dataset), rng)
+        for name, fn in cases.items():
+            call = lambda fn=fn: fn(batch)  # noqa: E731
+            call()
+            median, best = time_call(call, args.min_time, args.repeat)
+            peak, retained = trace_call(call)
+            results.append({
+                'case': name, 'batch': label, 'rows': batch.rows,
+                'median_s': median, 'best_s': best, 'per_row_us': median / batch.rows * 1e6,
+                'peak_bytes': peak, 'retained_bytes': retained,
+            })
+            print(f'{name:<24} {label:>6} {median * 1e6:>12.1f} {best * 1e6:>12.1f} '
+                  f'{median / batch.rows * 1e6:>10.2f} {peak / 1024:>10.1f} {retained / 1024:>10.1f}',
+                  file=sys.stderr)
+
+    result = {
+        'commit': git_commit(),
+        'config': {'forest_engine': main.FOREST_ENGINE, 'repeat': args.repeat, 'min_time': args.min_time,
+                   'numpy': np.__version__, 'dataset_rows': len(dataset)},
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(result, f, indent=2)
+    if args.compare:
+        return 1 if compare(results, args.compare, args.tolerance) else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(run())
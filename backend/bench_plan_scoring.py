@@ -0,0 +1,75 @@
+"""Benchmark vectorized plan scoring against the per-plan loop.
+
+Run from the backend directory:
+
+    python bench_plan_scoring.py [--top-k 3]
+
+Random plans are generated at 10, 1k and 100k plans per cluster, and
+both implementations are timed. That they rank plans identically is
+checked by tests/test_plan_scoring.py, which reuses loop_scores.
+"""
+import argparse
+import sys
+import time
+
+import numpy as np
+
+from plan_cache import PLAN_FEATURES
+from plan_scoring import apply_treatment, calculate_efficiency, oxalate, rank_plans, score_plans
+
+
+SIZES = (10, 1_000, 100_000)
+
+# A patient with elevated values, in PLAN_FEATURES order
+PATIENT = [3.8, 25.0, 140.0, 8.3, 4.8, 4.9, 130.0]
+
+
+def random_plans(n, rng):
+    low = np.array([-1.0, 0.0, -10.0, -0.5, 0.0, -0.5, -20.0])
+    high = np.array([0.0, 20.0, 0.0, 0.5, 30.0, 0.5, 0.0])
+    return rng.uniform(low, high, size=(n, len(PLAN_FEATURES)))
+
+
+def loop_scores(patient, deltas):
+    """The original /clustering loop: one dict copy and Python pass per plan."""
+    patient_data = dict(zip(PLAN_FEATURES, patient))
+    response = []
+    for i, row in enumerate(deltas.tolist()):
+        treatment = dict(zip(PLAN_FEATURES, row))
+        treatment['oxalate_levels'] = oxalate(treatment['oxalate_levels'], patient_data['oxalate_levels'])
+        modified_data = apply_treatment(patient_data, treatment)
+        response.append({'index': i, 'efficiency': round(calculate_efficiency(modified_data, patient_data), 2)})
+    return sorted(response, key=lambda x: x['efficiency'], reverse=True)
+
+
+def best_of(fn, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--top-k', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    rng = np.random.default_rng(args.seed)
+
+    print(f"{'plans':>8} {'loop ms':>10} {'vector ms':>10} {'top-k ms':>10} {'speedup':>8}")
+    for n in SIZES:
+        deltas = random_plans(n, rng)
+        repeat = 3 if n >= 100_000 else 20
+
+        loop_time, _ = best_of(lambda: loop_scores(PATIENT, deltas), repeat)
+        vector_time, _ = best_of(lambda: rank_plans(score_plans(PATIENT, deltas)), repeat)
+        top_time, _ = best_of(lambda: rank_plans(score_plans(PATIENT, deltas), args.top_k), repeat)
+        print(f"{n:>8} {loop_time * 1e3:>10.3f} {vector_time * 1e3:>10.3f} {top_time * 1e3:>10.3f} "
+              f"{loop_time / top_time:>7.1f}x")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,107 @@
+"""Coalesce concurrent single-row model calls into one matrix call.
+
+Request threads submit their rows; the first thread to find no open batch
+becomes its leader. The leader waits until the batch holds max_batch rows
+or max_wait seconds have passed, runs the function once on the stacked
+rows, and hands each waiting thread its own slice of the results. No
+extra thread is involved, so nothing has to be restarted after a fork.
+
+A leader that finds no other call in flight runs at once, so an idle
+server never pays the window. Calls that already carry max_batch rows or
+more skip the coalescer, as do all calls when max_wait is 0; they are
+counted in bypassed rather than calls.
+"""
+import threading
+
+import numpy as np
+
+
+class _Batch:
+    __slots__ = ('parts', 'rows', 'full', 'done', 'results', 'error')
+
+    def __init__(self):
+        self.parts = []
+        self.rows = 0
+        self.full = threading.Event()
+        self.done = threading.Event()
+        self.results = None
+        self.error = None
+
+
+class Coalescer:
+    """Batch concurrent fn(matrix) calls; fn must return one result per row, in order."""
+
+    def __init__(self, fn, max_batch=64, max_wait=0.002):
+        self.fn = fn
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.calls = 0
+        self.batches = 0
+        self.rows = 0
+        self.bypassed = 0
+        self._open = None
+        self._inflight = 0
+        self._lock = threading.Lock()
+
+    def submit(self, rows):
+        """Return fn's results for rows (an N x d array), batched with concurrent callers."""
+        rows = np.asarray(rows)
+        if self.max_wait <= 0 or len(rows) >= self.max_batch:
+            with self._lock:
+                self.bypassed += 1
+            return list(self.fn(rows))
+
+        with self._lock:
+            self.calls += 1
+            self._inflight += 1
+            batch = self._open
+            leader = batch is None
+            if leader:
+                batch = self._open = _Batch()
+                alone = self._inflight == 1
+            offset = batch.rows
+            batch.parts.append(rows)
+            batch.rows += len(rows)
+            if batch.rows >= self.max_batch:
+                self._open = None
+                batch.full.set()
+
+        try:
+            if leader:
+                if not alone:
+                    batch.full.wait(self.max_wait)
+                self._run(batch)
+            else:
+                batch.done.wait()
+        finally:
+            with self._lock:
+                self._inflight -= 1
+
+        if batch.error is not None:
+            raise batch.error
+        return batch.results[offset:offset + len(rows)]
+
+    def _run(self, batch):
+        with self._lock:
+            # Close the batch; later arrivals start a new one
+            if self._open is batch:
+                self._open = None
+            parts = list(batch.parts)
+            self.batches += 1
+            self.rows += batch.rows
+        try:
+            matrix = parts[0] if len(parts) == 1 else np.vstack(parts)
+            batch.results = list(self.fn(matrix))
+        except Exception as e:
+            batch.error = e
+        finally:
+            batch.done.set()
+
+    def stats(self):
+        return {
+            'calls': self.calls,
+            'batches': self.batches,
+            'rows': self.rows,
+            'bypassed': self.bypassed,
+            'mean_batch_rows': round(self.rows / self.batches, 2) if self.batches else 0.0,
+        }
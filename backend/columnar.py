@@ -0,0 +1,232 @@
+"""Columnar, memory-mapped copies of the CKD_Historical CSV datasets.
+
+A dataset directory holds one .npy file per column plus dataset.json:
+
+    dataset.json          row count, source sha256, and each column's dtype and categories
+    <column>.npy          numeric values, or int16 category codes for text columns
+
+Text columns are stored pre-encoded. Their codes are indexes into the
+sorted categories, the same codes a LabelEncoder fitted on the column
+gives, so training neither parses text nor refits encoders.
+ColumnarDataset memory-maps the files read-only. Projecting columns or
+slicing a row range only touches those pages.
+
+The conversion streams the CSV in --chunk-rows chunks into preallocated
+memory maps, so it needs memory for one chunk, not the whole file.
+
+Run from the backend directory:
+
+    python columnar.py convert ../CKD_Historical/updated_ckd_dataset_with_stages.csv datasets/stages
+    python columnar.py info datasets/stages
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+from sklearn.preprocessing import LabelEncoder
+
+from artifacts import file_digest
+
+
+FORMAT_VERSION = 1
+MANIFEST = 'dataset.json'
+CODE_DTYPE = np.int16
+
+
+def count_rows(path, block_size=1 << 24):
+    """Data rows of a CSV with a header line, counted without parsing it."""
+    lines = 0
+    last = b'\n'
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            lines += block.count(b'\n')
+            last = block[-1:]
+    if last != b'\n':
+        lines += 1
+    return max(lines - 1, 0)
+
+
+def infer_dtypes(path, sample_rows):
+    """{column: numpy dtype, or None for text} from the first sample_rows rows."""
+    sample = pd.read_csv(path, nrows=sample_rows)
+    return {
+        column: np.dtype(sample[column].dtype) if pd.api.types.is_numeric_dtype(sample[column]) else None
+        for column in sample.columns
+    }
+
+
+def convert(path, directory, chunk_rows=1_000_000):
+    """Write the CSV at path as a columnar dataset directory; returns its manifest."""
+    rows = count_rows(path)
+    dtypes = infer_dtypes(path, min(chunk_rows, 10_000))
+    os.makedirs(directory, exist_ok=True)
+
+    arrays = {
+        column: np.lib.format.open_memmap(
+            os.path.join(directory, f'{column}.npy'), mode='w+', dtype=dtype or CODE_DTYPE, shape=(rows,),
+        )
+        for column, dtype in dtypes.items()
+    }
+    # Codes are assigned in order of appearance while streaming, then renumbered into sorted order
+    seen = {column: {} for column, dtype in dtypes.items() if dtype is None}
+    read_dtypes = {column: (dtype if dtype is not None else str) for column, dtype in dtypes.items()}
+
+    offset = 0
+    for chunk in pd.read_csv(path, chunksize=chunk_rows, dtype=read_dtypes, keep_default_na=False, na_values=['']):
+        end = offset + len(chunk)
+        if end > rows:
+            raise ValueError(f'{path} has more rows than the {rows} counted')
+        for column, array in arrays.items():
+            if column in seen:
+                codes = seen[column]
+                inverse, values = pd.factorize(chunk[column].fillna(''))
+                for value in values:
+                    codes.setdefault(value, len(codes))
+                if len(codes) > np.iinfo(CODE_DTYPE).max:
+                    raise ValueError(f'{column} has more than {np.iinfo(CODE_DTYPE).max} categories')
+                array[offset:end] = np.array([codes[value] for value in values], dtype=CODE_DTYPE)[inverse]
+            else:
+                array[offset:end] = chunk[column].to_numpy(dtype=array.dtype)
+        offset = end
+    if offset != rows:
+        raise ValueError(f'{path} has {offset} rows, but {rows} were counted')
+
+    columns = {}
+    for column, array in arrays.items():
+        entry = {'dtype': array.dtype.str}
+        if column in seen:
+            categories = sorted(seen[column])
+            order = np.empty(len(categories), dtype=CODE_DTYPE)
+            for code, value in enumerate(categories):
+                order[seen[column][value]] = code
+            array[:] = order[array]
+            entry['categories'] = categories
+        array.flush()
+        columns[column] = entry
+    del arrays
+
+    manifest = {
+        'format_version': FORMAT_VERSION,
+        'source': os.path.basename(path),
+        'source_sha256': file_digest(path),
+        'rows': rows,
+        'columns': columns,
+    }
+    # Written last so a half-converted directory never looks complete
+    with open(os.path.join(directory, MANIFEST), 'w') as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+def is_dataset(path):
+    return os.path.isfile(os.path.join(path, MANIFEST))
+
+
+class ColumnarDataset:
+    """Read-only, memory-mapped view of a directory written by convert()."""
+
+    def __init__(self, directory):
+        self.directory = directory
+        try:
+            with open(os.path.join(directory, MANIFEST)) as f:
+                self.manifest = json.load(f)
+        except FileNotFoundError:
+            raise ValueError(f'No {MANIFEST} in dataset directory {directory!r}') from None
+        if self.manifest.get('format_version') != FORMAT_VERSION:
+            raise ValueError(f"Unsupported dataset format {self.manifest.get('format_version')!r}")
+        self._arrays = {}
+
+    @property
+    def rows(self):
+        return self.manifest['rows']
+
+    @property
+    def columns(self):
+        return list(self.manifest['columns'])
+
+    @property
+    def sha256(self):
+        """Digest of the source CSV."""
+        return self.manifest['source_sha256']
+
+    def categories(self, column):
+        """Sorted categories of a text column, or None for a numeric one."""
+        return self._entry(column).get('categories')
+
+    def _entry(self, column):
+        try:
+            return self.manifest['columns'][column]
+        except KeyError:
+            raise KeyError(f'Column {column!r} not in dataset {self.directory!r}') from None
+
+    def column(self, column, start=None, stop=None):
+        """Memory-mapped values (or category codes) of rows [start, stop)."""
+        array = self._arrays.get(column)
+        if array is None:
+            self._entry(column)
+            array = self._arrays[column] = np.load(os.path.join(self.directory, f'{column}.npy'), mmap_mode='r')
+        return array[start:stop]
+
+    def matrix(self, columns, start=None, stop=None, dtype=np.float64):
+        """Rows [start, stop) of columns as one 2-D array, text columns as their codes."""
+        start, stop, _ = slice(start, stop).indices(self.rows)
+        out = np.empty((stop - start, len(columns)), dtype=dtype)
+        for i, column in enumerate(columns):
+            out[:, i] = self.column(column, start, stop)
+        return out
+
+    def frame(self, columns=None, start=None, stop=None, decode=False):
+        """Rows [start, stop) as a DataFrame; decode maps category codes back to their text."""
+        data = {}
+        for column in columns or self.columns:
+            values = self.column(column, start, stop)
+            categories = self.categories(column)
+            if decode and categories is not None:
+                values = np.array(categories, dtype=object)[values]
+            data[column] = np.asarray(values)
+        return pd.DataFrame(data)
+
+    def label_encoders(self, columns):
+        """LabelEncoders for text columns, equal to ones fitted on the source CSV."""
+        encoders = {}
+        for column in columns:
+            categories = self.categories(column)
+            if categories is None:
+                raise ValueError(f'Column {column!r} is numeric')
+            encoder = LabelEncoder()
+            encoder.classes_ = np.array(categories, dtype=object)
+            encoders[column] = encoder
+        return encoders
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Convert CSV datasets into memory-mappable column files.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    convert_parser = subparsers.add_parser('convert', help='write a CSV as a columnar dataset directory')
+    convert_parser.add_argument('csv')
+    convert_parser.add_argument('directory')
+    convert_parser.add_argument('--chunk-rows', type=int, default=1_000_000, help='rows parsed at a time')
+    info_parser = subparsers.add_parser('info', help='describe a columnar dataset')
+    info_parser.add_argument('directory')
+    args = parser.parse_args()
+
+    if args.command == 'convert':
+        start = time.perf_counter()
+        manifest = convert(args.csv, args.directory, args.chunk_rows)
+        print(f"Wrote {manifest['rows']} rows x {len(manifest['columns'])} columns to {args.directory} "
+              f"in {time.perf_counter() - start:.1f}s")
+    else:
+        dataset = ColumnarDataset(args.directory)
+        print(f"{dataset.manifest['source']}: {dataset.rows} rows, sha256 {dataset.sha256[:16]}")
+        for column, entry in dataset.manifest['columns'].items():
+            categories = entry.get('categories')
+            print(f"  {column:<24} {'categories: ' + ', '.join(categories) if categories else entry['dtype']}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
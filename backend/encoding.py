@@ -0,0 +1,75 @@
+"""Categorical encoding shared by the Flask backend and the CKD_Historical training scripts.
+
+The fitted sklearn LabelEncoders are only needed at training time. At serving
+time they are compiled into plain dict lookup tables, which avoids sklearn's
+per-call validation and searchsorted overhead for single values.
+"""
+import numpy as np
+from sklearn.preprocessing import LabelEncoder
+
+
+# Categorical columns in the order they appear in the training datasets
+CATEGORICAL_COLUMNS = [
+    'physical_activity', 'diet', 'smoking', 'alcohol',
+    'painkiller_usage', 'family_history', 'weight_changes', 'stress_level',
+]
+
+
+class UnknownCategoryError(ValueError):
+    """Raised when a value was not seen when the encoder for its column was fitted."""
+
+    def __init__(self, column, value, known):
+        self.column = column
+        self.value = value
+        self.known = sorted(known)
+        super().__init__(
+            f"Unknown value {value!r} for {column}; expected one of: {', '.join(self.known)}"
+        )
+
+
+def fit_encoders(dataset, columns=CATEGORICAL_COLUMNS):
+    """Fit one LabelEncoder per column and encode the DataFrame in place."""
+    label_encoders = {}
+    for col in columns:
+        label_encoders[col] = LabelEncoder()
+        dataset[col] = label_encoders[col].fit_transform(dataset[col])
+    return label_encoders
+
+
+def compile_encoders(label_encoders):
+    """Compile fitted LabelEncoders into {column: {category: code}} tables.
+
+    LabelEncoder codes are the index of the category in the sorted classes_,
+    so the tables give the same codes as LabelEncoder.transform.
+    """
+    return {
+        column: {category: code for code, category in enumerate(encoder.classes_.tolist())}
+        for column, encoder in label_encoders.items()
+    }
+
+
+def encode_value(tables, column, value):
+    """Encode a single categorical value."""
+    table = tables[column]
+    try:
+        return table[value]
+    except (KeyError, TypeError):
+        raise UnknownCategoryError(column, value, table) from None
+
+
+def encode_column(tables, column, values):
+    """Encode a sequence of categorical values into a float array."""
+    table = tables[column]
+    encoded = np.empty(len(values), dtype=float)
+    for i, value in enumerate(values):
+        try:
+            encoded[i] = table[value]
+        except (KeyError, TypeError):
+            raise UnknownCategoryError(column, value, table) from None
+    return encoded
+
+
+def decode_column(tables, column, codes):
+    """Map integer codes back to their category strings."""
+    categories = np.array(list(tables[column]), dtype=object)
+    return categories[np.asarray(codes, dtype=int)]
@@ -0,0 +1,311 @@
+"""Flattened-array inference for the RandomForest models.
+
+sklearn's forest predict pays input validation, joblib dispatch and one
+Python call per tree on every call, which dominates single-row latency.
+FlatForest copies the nodes of every tree into contiguous NumPy arrays once
+at load time and walks all trees together with array indexing. It repeats
+sklearn's float32 input cast and tree-by-tree accumulation order, so
+predictions are bit-identical to the wrapped estimator.
+
+A single row, the /predict case, walks interleaved node arrays where the
+two children of node n sit at 2n and 2n + 1, so a level needs no
+np.where, and stops once every tree has reached a leaf. The
+preprocessing of a forest Pipeline is compiled into lookup tables and
+scaling arrays too when it is a ColumnTransformer of OneHotEncoder and
+StandardScaler steps, like the future_params model.
+
+Single-row p50 on one core of the development machine, 100 trees each,
+against 8.6ms and 20ms for sklearn:
+
+    ckd_model       70-110us   28 levels deep
+    future_params   ~450us     180-210us in the 40-level trees, ~260us to
+                               read and encode the 20-column DataFrame row
+
+Each level costs about 5us of numpy call overhead, so the 40-level
+regressor misses a 100us budget even before its DataFrame is read.
+"""
+import numpy as np
+import pandas as pd
+import sklearn
+from sklearn.compose import ColumnTransformer
+from sklearn.pipeline import Pipeline
+from sklearn.preprocessing import OneHotEncoder, StandardScaler
+
+
+ENGINES = ('sklearn', 'flat')
+
+# Before 1.4 classifier trees stored class counts and predict_proba normalized them
+_NORMALIZE_COUNTS = tuple(int(part) for part in sklearn.__version__.split('.')[:2]) < (1, 4)
+
+
+class FlatForest:
+    """A fitted RandomForestClassifier or RandomForestRegressor as flat node arrays."""
+
+    # Node arrays saved by to_arrays(); classes_ is added for classifiers
+    ARRAYS = ('roots', 'feature', 'threshold', 'left', 'right', 'value')
+    # The single-row walk's interleaved arrays, saved too so workers map them instead of building copies
+    SINGLE_ROW_ARRAYS = ('single_roots', 'single_feature', 'single_threshold', 'single_children', 'single_is_leaf')
+
+    def __init__(self, forest):
+        trees = [estimator.tree_ for estimator in forest.estimators_]
+        self.is_classifier = hasattr(forest, 'classes_')
+        self.classes_ = getattr(forest, 'classes_', None)
+        self.n_features_in_ = forest.n_features_in_
+        self.n_estimators = len(trees)
+        self.max_depth = max(tree.max_depth for tree in trees)
+
+        counts = np.array([tree.node_count for tree in trees])
+        offsets = np.concatenate([[0], np.cumsum(counts)[:-1]])
+        n_nodes = int(counts.sum())
+
+        self.roots = offsets.astype(np.intp)
+        self.feature = np.zeros(n_nodes, dtype=np.intp)
+        self.threshold = np.full(n_nodes, np.inf)
+        self.left = np.empty(n_nodes, dtype=np.intp)
+        self.right = np.empty(n_nodes, dtype=np.intp)
+        self.value = np.empty((n_nodes, self._n_values(forest)), dtype=np.float64)
+
+        for tree, offset, count in zip(trees, offsets, counts):
+            nodes = slice(offset, offset + count)
+            is_leaf = tree.children_left == -1
+            own = np.arange(offset, offset + count)
+            # Leaves always go "left" to themselves, so every tree can be walked max_depth steps
+            self.feature[nodes] = np.where(is_leaf, 0, tree.feature)
+            self.threshold[nodes] = np.where(is_leaf, np.inf, tree.threshold)
+            self.left[nodes] = np.where(is_leaf, own, tree.children_left + offset)
+            self.right[nodes] = np.where(is_leaf, own, tree.children_right + offset)
+            self.value[nodes] = self._leaf_values(tree)
+        self._single = None
+
+    @classmethod
+    def from_arrays(cls, arrays, meta):
+        """Rebuild from to_arrays() output; the arrays may be read-only memory maps."""
+        flat = cls.__new__(cls)
+        # Plain ndarray views of the maps: no copy, and no np.memmap wrapping on every index
+        arrays = {name: np.asarray(array) for name, array in arrays.items()}
+        for name in cls.ARRAYS:
+            setattr(flat, name, arrays[name])
+        flat.is_classifier = meta['is_classifier']
+        flat.classes_ = arrays.get('classes_')
+        flat.n_features_in_ = meta['n_features_in']
+        flat.n_estimators = meta['n_estimators']
+        flat.max_depth = meta['max_depth']
+        # Bundles written before the single-row arrays were saved build them on first use
+        saved = all(name in arrays for name in cls.SINGLE_ROW_ARRAYS)
+        flat._single = tuple(arrays[name] for name in cls.SINGLE_ROW_ARRAYS) if saved else None
+        return flat
+
+    def to_arrays(self):
+        """Return (arrays, meta) describing this forest without any sklearn objects."""
+        arrays = {name: getattr(self, name) for name in self.ARRAYS}
+        arrays.update(zip(self.SINGLE_ROW_ARRAYS, self._single_row_arrays()))
+        if self.is_classifier:
+            arrays['classes_'] = self.classes_
+        meta = {
+            'is_classifier': self.is_classifier,
+            'n_features_in': int(self.n_features_in_),
+            'n_estimators': self.n_estimators,
+            'max_depth': int(self.max_depth),
+        }
+        return arrays, meta
+
+    def _n_values(self, forest):
+        if self.is_classifier:
+            return len(self.classes_)
+        return forest.n_outputs_
+
+    def _leaf_values(self, tree):
+        """Per-node output exactly as the sklearn tree's predict/predict_proba returns it."""
+        if not self.is_classifier:
+            return tree.value[:, :, 0]
+        proba = tree.value[:, 0, :len(self.classes_)]
+        if _NORMALIZE_COUNTS:
+            normalizer = proba.sum(axis=1)[:, np.newaxis]
+            normalizer[normalizer == 0.0] = 1.0
+            proba = proba / normalizer
+        return proba
+
+    def _single_row_arrays(self):
+        """(roots, feature, threshold, children, is_leaf) indexed by 2 * node.
+
+        children[2n + 1] is the left child of node n and children[2n] the
+        right one, so x <= threshold indexes the child directly. Built on
+        first use, unless from_arrays() was given them from a bundle.
+        """
+        if self._single is None:
+            own = np.arange(len(self.left))
+            children = np.empty(2 * len(self.left), dtype=np.intp)
+            children[0::2] = 2 * self.right
+            children[1::2] = 2 * self.left
+            self._single = (
+                2 * self.roots,
+                np.repeat(self.feature, 2),
+                np.repeat(self.threshold, 2),
+                children,
+                np.repeat(self.left == own, 2),
+            )
+        return self._single
+
+    def apply(self, X):
+        """Return the leaf index reached in every tree, shape (n_samples, n_estimators)."""
+        X = np.asarray(X, dtype=np.float32)
+        if len(X) == 1:
+            roots, feature, threshold, children, is_leaf = self._single_row_arrays()
+            # float32 -> float64 is exact, and a same-dtype compare is cheaper than a mixed one
+            x, node = X[0].astype(np.float64), roots
+            for depth in range(1, self.max_depth + 1):
+                node = children[node + (x[feature[node]] <= threshold[node])]
+                # Leaves lead to themselves, so stopping early changes nothing
+                if depth % 4 == 0 and is_leaf[node].all():
+                    break
+            return (node // 2)[np.newaxis, :]
+
+        rows = np.arange(len(X))[:, np.newaxis]
+        node = np.broadcast_to(self.roots, (len(X), self.n_estimators))
+        for _ in range(self.max_depth):
+            go_left = X[rows, self.feature[node]] <= self.threshold[node]
+            node = np.where(go_left, self.left[node], self.right[node])
+        return node
+
+    def _mean_value(self, X):
+        # cumsum adds trees strictly in order, matching sklearn's accumulation
+        total = np.cumsum(self.value[self.apply(X)], axis=1)[:, -1]
+        total /= self.n_estimators
+        return total
+
+    def predict_proba(self, X):
+        return self._mean_value(X)
+
+    def predict(self, X):
+        if self.is_classifier:
+            return self.classes_.take(np.argmax(self._mean_value(X), axis=1), axis=0)
+        y_hat = self._mean_value(X)
+        return y_hat[:, 0] if y_hat.shape[1] == 1 else y_hat
+
+
+class FlatColumnTransformer:
+    """A fitted ColumnTransformer of dense OneHotEncoder and StandardScaler steps as lookup tables and arrays.
+
+    Takes DataFrames only and gives the same float64 matrix as
+    ColumnTransformer.transform: one-hot columns are set from a
+    category -> output column dict and scaled columns are (x - mean_) / scale_,
+    sklearn's own two operations.
+    """
+
+    def __init__(self, transformer):
+        self.feature_names = list(transformer.feature_names_in_)
+        self.n_features_out = sum(
+            indices.stop - indices.start for indices in transformer.output_indices_.values()
+        )
+        # (input position, {category: output column}) per one-hot column
+        self.categories = []
+        numeric_in, numeric_out, mean, scale = [], [], [], []
+        for name, step, columns in transformer.transformers_:
+            if step == 'drop':
+                continue
+            start = transformer.output_indices_[name].start
+            positions = [self.feature_names.index(column) for column in columns]
+            if isinstance(step, OneHotEncoder):
+                for position, categories in zip(positions, step.categories_):
+                    self.categories.append((position, {category: start + i for i, category in enumerate(categories)}))
+                    start += len(categories)
+            else:
+                numeric_in.extend(positions)
+                numeric_out.extend(range(start, start + len(columns)))
+                mean.extend(step.mean_ if step.with_mean else np.zeros(len(columns)))
+                scale.extend(step.scale_ if step.with_std else np.ones(len(columns)))
+        self.numeric_in = np.array(numeric_in, dtype=np.intp)
+        self.numeric_out = np.array(numeric_out, dtype=np.intp)
+        self.mean = np.array(mean, dtype=np.float64)
+        self.scale = np.array(scale, dtype=np.float64)
+
+    @staticmethod
+    def supports(transformer):
+        """Whether transformer is a ColumnTransformer this class reproduces exactly."""
+        if not isinstance(transformer, ColumnTransformer) or transformer.sparse_output_:
+            return False
+        if transformer.remainder != 'drop' or not hasattr(transformer, 'feature_names_in_'):
+            return False
+        for name, step, columns in transformer.transformers_:
+            if step == 'drop':
+                continue
+            if not isinstance(columns, list) or not all(isinstance(column, str) for column in columns):
+                return False
+            if isinstance(step, OneHotEncoder):
+                # A sparse encoder output is fine: sparse_output_ False means it is densified
+                if (step.drop_idx_ is not None or step._infrequent_enabled
+                        or step.handle_unknown != 'error' or np.dtype(step.dtype) != np.float64):
+                    return False
+                if not all(isinstance(category, str) for categories in step.categories_ for category in categories):
+                    return False
+            elif type(step) is not StandardScaler:
+                return False
+        return True
+
+    def transform(self, X):
+        if list(X.columns) != self.feature_names:
+            X = X[self.feature_names]
+        values = X.to_numpy()
+        out = np.zeros((len(values), self.n_features_out))
+        rows = np.arange(len(values))
+        for position, lookup in self.categories:
+            try:
+                out[rows, [lookup[value] for value in values[:, position]]] = 1.0
+            except KeyError as e:
+                raise ValueError(
+                    f'Found unknown category {e.args[0]!r} in column {self.feature_names[position]!r}'
+                ) from None
+        out[:, self.numeric_out] = (values[:, self.numeric_in].astype(np.float64) - self.mean) / self.scale
+        return out
+
+
+def compile_preprocessor(preprocessor):
+    """A FlatColumnTransformer for a Pipeline of one supported ColumnTransformer, else None."""
+    if isinstance(preprocessor, Pipeline) and len(preprocessor.steps) == 1:
+        preprocessor = preprocessor[0]
+    if FlatColumnTransformer.supports(preprocessor):
+        return FlatColumnTransformer(preprocessor)
+    return None
+
+
+class FlatPipeline:
+    """A fitted Pipeline whose final step is a forest.
+
+    The preprocessing runs through FlatColumnTransformer when
+    compile_preprocessor supports it and X is a DataFrame, and through the
+    sklearn steps otherwise.
+    """
+
+    def __init__(self, pipeline):
+        self.preprocessor = pipeline[:-1]
+        self.compiled = compile_preprocessor(self.preprocessor)
+        self.forest = FlatForest(pipeline[-1])
+        self.feature_names_in_ = getattr(pipeline, 'feature_names_in_', None)
+
+    @classmethod
+    def from_parts(cls, preprocessor, forest):
+        flat = cls.__new__(cls)
+        flat.preprocessor = preprocessor
+        flat.compiled = compile_preprocessor(preprocessor)
+        flat.forest = forest
+        flat.feature_names_in_ = getattr(preprocessor, 'feature_names_in_', None)
+        return flat
+
+    def transform(self, X):
+        if self.compiled is not None and isinstance(X, pd.DataFrame):
+            return self.compiled.transform(X)
+        return self.preprocessor.transform(X)
+
+    def predict(self, X):
+        return self.forest.predict(self.transform(X))
+
+
+def load_engine(model, engine='sklearn'):
+    """Wrap a fitted forest (or forest Pipeline) in the requested inference engine."""
+    if engine not in ENGINES:
+        raise ValueError(f"Unknown forest engine {engine!r}; expected one of: {', '.join(ENGINES)}")
+    if engine == 'sklearn':
+        return model
+    if isinstance(model, Pipeline):
+        return FlatPipeline(model)
+    return FlatForest(model)
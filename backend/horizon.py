@@ -0,0 +1,55 @@
+"""Vectorized CKD risk horizon for patients currently predicted CKD-free.
+
+param_model is the future-parameters pipeline trained in
+CKD_Historical/CKD Historical pred.ipynb: it takes the raw 19 patient
+features plus a `months` offset and forecasts the 10 medical values that
+many months ahead. Every (patient, month) pair is stacked into one frame,
+so a whole horizon costs one forecast call and one classifier call.
+"""
+import numpy as np
+import pandas as pd
+
+from encoding import decode_column
+
+
+FORECAST_MONTHS = 12
+
+
+def horizon_frame(features, feature_columns, categorical_columns, tables, months):
+    """Repeat each encoded patient row once per month offset as a raw param_model frame."""
+    n_patients, n_months = len(features), len(months)
+    frame = pd.DataFrame(np.repeat(features, n_months, axis=0), columns=feature_columns)
+    for column in categorical_columns:
+        frame[column] = decode_column(tables, column, frame[column].to_numpy())
+    frame['months'] = np.tile(months, n_patients)
+    return frame
+
+
+def forecast_horizon(features, months, *, param_model, classifier, scaler,
+                     feature_columns, categorical_columns, tables, n_medical):
+    """Forecast and score every month offset for every patient.
+
+    Returns (forecast, stages): forecast is K x M x n_medical future lab values
+    and stages is the K x M predicted CKD stage for each month.
+    """
+    n_patients, n_months = len(features), len(months)
+    frame = horizon_frame(features, feature_columns, categorical_columns, tables, months)
+    forecast = np.asarray(param_model.predict(frame), dtype=float)
+
+    # Future labs with the patient's unchanged lifestyle columns, scored in one call
+    lifestyle = np.repeat(features[:, n_medical:], n_months, axis=0)
+    standardized = scaler.transform(np.hstack([forecast, lifestyle]))
+    stages = classifier.predict(standardized)
+
+    return (
+        forecast.reshape(n_patients, n_months, -1),
+        stages.reshape(n_patients, n_months),
+    )
+
+
+def first_risk_month(stages, months):
+    """Return the first month with a non-zero stage, or None if every month is CKD-free."""
+    at_risk = np.flatnonzero(stages != 0)
+    if len(at_risk) == 0:
+        return None
+    return int(months[at_risk[0]])
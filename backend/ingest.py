@@ -0,0 +1,270 @@
+"""Streaming bulk ingest of lab reports in the TestReports column layout.
+
+CSV or NDJSON input is read in chunks of chunk_rows records, so memory
+stays bounded whatever the file size. Each chunk is:
+- validated and encoded column by column
+- scored as one matrix
+- written with bulk INSERTs of batch_size rows, or with COPY on
+  PostgreSQL through psycopg2
+
+Bad rows are reported with their line number and skipped; the rest of
+the file is still loaded. Each chunk commits on its own.
+
+Used by POST /reports/ingest and from the backend directory:
+
+    python ingest.py reports.csv --user-id 12
+    python ingest.py reports.ndjson --format ndjson --chunk-rows 5000
+"""
+import argparse
+import csv
+import io
+import json
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import insert
+
+
+MEDICAL_COLUMNS = [
+    'serum_creatinine', 'gfr', 'bun', 'serum_calcium', 'ana',
+    'c3_c4', 'hematuria', 'oxalate_levels', 'urine_ph', 'blood_pressure',
+]
+BOOLEAN_COLUMNS = ['ana', 'hematuria']
+# Boolean spellings of exports, matched case-insensitively; numbers go through as-is
+BOOLEAN_VALUES = {'true': 1, 't': 1, 'yes': 1, 'y': 1, 'false': 0, 'f': 0, 'no': 0, 'n': 0}
+# Optional columns and the defaults /predict uses for them
+DEFAULTS = {
+    'gender': 'Male',
+    'age': 0,
+    'physical_activity': 'weekly',
+    'diet': 'balanced',
+    'family_history': 'no',
+    'water_intake': 2.0,
+    'smoking': 'no',
+    'alcohol_consumption': 'occasionally',
+    'painkiller_usage': 'no',
+    'weight_changes': 'stable',
+    'stress_level': 'moderate',
+}
+REPORT_COLUMNS = MEDICAL_COLUMNS + list(DEFAULTS)
+# Model features after the medical columns: (report column, label encoder or None for numeric)
+LIFESTYLE_FEATURES = [
+    ('physical_activity', 'physical_activity'),
+    ('diet', 'diet'),
+    ('water_intake', None),
+    ('smoking', 'smoking'),
+    ('alcohol_consumption', 'alcohol'),
+    ('painkiller_usage', 'painkiller_usage'),
+    ('family_history', 'family_history'),
+    ('weight_changes', 'weight_changes'),
+    ('stress_level', 'stress_level'),
+]
+FORMATS = ('csv', 'ndjson')
+
+
+def iter_records(stream, fmt):
+    """Yield (line number, record dict or error message) from a text stream."""
+    if fmt == 'csv':
+        reader = csv.DictReader(stream)
+        for record in reader:
+            yield reader.line_num, record
+    elif fmt == 'ndjson':
+        for line_no, line in enumerate(stream, start=1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError as e:
+                yield line_no, f'invalid JSON: {e}'
+                continue
+            yield line_no, record if isinstance(record, dict) else 'expected a JSON object'
+    else:
+        raise ValueError(f'Unknown format {fmt!r}, expected one of {FORMATS}')
+
+
+def iter_chunks(stream, fmt, chunk_rows):
+    chunk = []
+    for item in iter_records(stream, fmt):
+        chunk.append(item)
+        if len(chunk) >= chunk_rows:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def boolean_codes(value):
+    if isinstance(value, bool):
+        return int(value)
+    if isinstance(value, str):
+        return BOOLEAN_VALUES.get(value.strip().lower(), value)
+    return value
+
+
+def prepare_chunk(records, tables):
+    """Validate and encode one chunk of record dicts.
+
+    Returns (rows, features, errors): the valid rows as a DataFrame of
+    REPORT_COLUMNS, their N x 19 feature matrix, and a (position, message)
+    pair for each invalid record.
+    """
+    frame = pd.DataFrame.from_records(records).reindex(columns=REPORT_COLUMNS)
+    frame = frame.replace('', np.nan)
+    errors = np.full(len(frame), None, dtype=object)
+
+    def flag(mask, message):
+        mask = np.asarray(mask) & pd.isna(errors)
+        errors[mask] = [message(i) for i in np.flatnonzero(mask)]
+
+    for column in BOOLEAN_COLUMNS:
+        frame[column] = frame[column].map(boolean_codes)
+    for column in MEDICAL_COLUMNS:
+        values = pd.to_numeric(frame[column], errors='coerce')
+        flag(frame[column].isna(), lambda i, column=column: f'missing {column}')
+        flag(values.isna(), lambda i, column=column: f'invalid {column}: {frame[column].iat[i]!r}')
+        frame[column] = values
+
+    for column, default in DEFAULTS.items():
+        frame[column] = frame[column].fillna(default)
+    for column in ('age', 'water_intake'):
+        values = pd.to_numeric(frame[column], errors='coerce')
+        flag(values.isna(), lambda i, column=column: f'invalid {column}: {frame[column].iat[i]!r}')
+        frame[column] = values
+
+    features = np.empty((len(frame), len(MEDICAL_COLUMNS) + len(LIFESTYLE_FEATURES)))
+    features[:, :len(MEDICAL_COLUMNS)] = frame[MEDICAL_COLUMNS].to_numpy(dtype=np.float64, na_value=np.nan)
+    for offset, (column, encoder) in enumerate(LIFESTYLE_FEATURES, start=len(MEDICAL_COLUMNS)):
+        if encoder is None:
+            codes = frame[column]
+        else:
+            codes = frame[column].map(tables[encoder])
+            flag(codes.isna(), lambda i, column=column: f'unknown {column}: {frame[column].iat[i]!r}')
+        features[:, offset] = codes.to_numpy(dtype=np.float64, na_value=np.nan)
+
+    valid = pd.isna(errors)
+    rows = frame[valid].reset_index(drop=True)
+    rows['age'] = rows['age'].astype(int)
+    for column in BOOLEAN_COLUMNS:
+        rows[column] = rows[column] != 0
+    return rows, features[valid], [(int(i), errors[i]) for i in np.flatnonzero(~valid)]
+
+
+def copy_rows(connection, table, rows):
+    """Load rows with PostgreSQL COPY; returns False when the driver cannot."""
+    if connection.dialect.name != 'postgresql' or connection.dialect.driver != 'psycopg2':
+        return False
+    raw = connection.connection.dbapi_connection
+    buffer = io.StringIO()
+    rows.to_csv(buffer, index=False, header=False)
+    buffer.seek(0)
+    columns = ', '.join(rows.columns)
+    with raw.cursor() as cursor:
+        cursor.copy_expert(f'COPY {table.name} ({columns}) FROM STDIN WITH (FORMAT csv)', buffer)
+    return True
+
+
+class Ingester:
+    """Stream records into the report table, scoring each chunk as one batch."""
+
+    def __init__(self, db, report_model, tables, score, chunk_rows=1000, batch_size=500,
+                 use_copy=True, max_errors=1000):
+        self.db = db
+        self.report_model = report_model
+        self.tables = tables
+        self.score = score
+        self.chunk_rows = chunk_rows
+        self.batch_size = batch_size
+        self.use_copy = use_copy
+        self.max_errors = max_errors
+
+    def run(self, stream, fmt, user_id=None, progress=None):
+        """Ingest every record of stream; returns a summary with per-line errors.
+
+        Records carry their own user_id column unless user_id is given.
+        progress, if set, is called with the running summary after each chunk.
+        """
+        summary = {'rows': 0, 'inserted': 0, 'failed': 0, 'chunks': 0, 'errors': [], 'errors_truncated': False}
+        for chunk in iter_chunks(stream, fmt, self.chunk_rows):
+            summary['rows'] += len(chunk)
+            summary['chunks'] += 1
+            line_numbers = [line_no for line_no, _ in chunk]
+
+            errors = [(i, record) for i, (_, record) in enumerate(chunk) if isinstance(record, str)]
+            parsed = [(i, record) for i, (_, record) in enumerate(chunk) if not isinstance(record, str)]
+            positions = [i for i, _ in parsed]
+            records = [record for _, record in parsed]
+
+            if records:
+                rows, features, invalid = prepare_chunk(records, self.tables)
+                errors += [(positions[i], message) for i, message in invalid]
+                valid = sorted(set(range(len(records))) - {i for i, _ in invalid})
+                owners = pd.to_numeric(pd.Series(
+                    [user_id if user_id is not None else records[i].get('user_id') for i in valid], dtype=object,
+                ), errors='coerce')
+                missing_owner = owners.isna().to_numpy()
+                errors += [(positions[valid[i]], 'missing user_id') for i in np.flatnonzero(missing_owner)]
+                rows = rows[~missing_owner].reset_index(drop=True)
+                rows.insert(0, 'user_id', owners[~missing_owner].astype(np.int64).to_numpy())
+                features = features[~missing_owner]
+
+                if len(rows):
+                    try:
+                        rows['ckd_report'] = self.score(features)
+                        self._write(rows)
+                        summary['inserted'] += len(rows)
+                    except Exception as e:
+                        self.db.session.rollback()
+                        kept = [positions[valid[i]] for i in np.flatnonzero(~missing_owner)]
+                        errors += [(i, f'chunk not saved: {e}') for i in kept]
+
+            summary['failed'] += len(errors)
+            for i, message in sorted(errors):
+                if len(summary['errors']) >= self.max_errors:
+                    summary['errors_truncated'] = True
+                    break
+                summary['errors'].append({'line': line_numbers[i], 'error': message})
+            if progress is not None:
+                progress(summary)
+        return summary
+
+    def _write(self, rows):
+        session = self.db.session
+        table = self.report_model.__table__
+        if not (self.use_copy and copy_rows(session.connection(), table, rows)):
+            records = rows.astype(object).where(rows.notna(), None).to_dict('records')
+            for start in range(0, len(records), self.batch_size):
+                session.execute(insert(table), records[start:start + self.batch_size])
+        session.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Bulk load lab reports from CSV or NDJSON.')
+    parser.add_argument('path', help="input file, or '-' for stdin")
+    parser.add_argument('--format', choices=FORMATS, help='default: from the file extension')
+    parser.add_argument('--user-id', type=int, help='owner of every report; default: the user_id column')
+    parser.add_argument('--chunk-rows', type=int, default=1000)
+    parser.add_argument('--batch-size', type=int, default=500)
+    parser.add_argument('--no-copy', action='store_true', help='use INSERT even on PostgreSQL')
+    args = parser.parse_args()
+
+    fmt = args.format or ('ndjson' if args.path.endswith(('.ndjson', '.jsonl')) else 'csv')
+    from main import app, db, make_ingester
+
+    def progress(summary):
+        print(f"{summary['rows']} rows read, {summary['inserted']} inserted, {summary['failed']} failed",
+              file=sys.stderr)
+
+    start = time.perf_counter()
+    stream = sys.stdin if args.path == '-' else open(args.path, newline='', encoding='utf-8')
+    with stream, app.app_context():
+        ingester = make_ingester(chunk_rows=args.chunk_rows, batch_size=args.batch_size, use_copy=not args.no_copy)
+        summary = ingester.run(stream, fmt, user_id=args.user_id, progress=progress)
+    print(json.dumps(summary, indent=2))
+    print(f'Done in {time.perf_counter() - start:.1f}s', file=sys.stderr)
+    return 0 if summary['failed'] == 0 else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,225 @@
+"""Database-backed queue for asynchronous /predict jobs.
+
+POST /predict?async=1 validates the payload, stores a PredictionJob row and
+returns its id. Worker processes claim queued jobs and run the same
+prediction pipeline as /predict. They save the test report and the job
+result in one transaction, so a job either completed fully or can be run
+again from scratch.
+
+Idempotency:
+- A POST with an Idempotency-Key header always maps to the same job for
+  that user; reusing the key with a different payload is an error.
+- Without the header, an identical payload maps to the job that is still
+  queued or running.
+- A worker that dies mid-job leaves its lease to expire, and another
+  worker retries the job, up to JOB_MAX_ATTEMPTS times.
+- A worker only records its outcome while it still holds the claim, so a
+  slow worker whose lease was taken over cannot save a second report.
+
+Run the workers from the backend directory:
+
+    python jobs.py worker --processes 4
+    python jobs.py worker --once          # drain the queue and exit
+"""
+import argparse
+import datetime
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import time
+import uuid
+
+from sqlalchemy import exc, or_, select, update
+
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+
+class PermanentJobError(Exception):
+    """A job that will fail the same way on every attempt."""
+
+
+class IdempotencyKeyReused(Exception):
+    """An Idempotency-Key already used by the same user for a different payload."""
+
+
+def payload_digest(data, with_trajectory):
+    canonical = json.dumps({'payload': data, 'trajectory': with_trajectory}, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+class JobQueue:
+    """Enqueue, claim and complete PredictionJob rows."""
+
+    def __init__(self, db, job_model, lease_seconds=60.0, max_attempts=3):
+        self.db = db
+        self.job_model = job_model
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+
+    def enqueue(self, user_id, data, with_trajectory, idempotency_key=None):
+        """Return (job, created); an existing job is returned for a repeated request.
+
+        Raises IdempotencyKeyReused when idempotency_key belongs to a job
+        with another payload.
+        """
+        job_model = self.job_model
+        digest = payload_digest(data, with_trajectory)
+        existing = self._existing(user_id, digest, idempotency_key)
+        if existing is not None:
+            return existing, False
+
+        job = job_model(
+            job_id=uuid.uuid4().hex, user_id=user_id, idempotency_key=idempotency_key,
+            payload_digest=digest, payload=json.dumps(data), with_trajectory=with_trajectory,
+            status=QUEUED, attempts=0, created_at=datetime.datetime.now(),
+        )
+        self.db.session.add(job)
+        try:
+            self.db.session.commit()
+        except exc.IntegrityError:
+            # A concurrent retry with the same key committed first
+            self.db.session.rollback()
+            return self._existing(user_id, digest, idempotency_key), False
+        return job, True
+
+    def _existing(self, user_id, digest, idempotency_key):
+        job_model = self.job_model
+        query = job_model.query.filter_by(user_id=user_id)
+        if idempotency_key is not None:
+            job = query.filter_by(idempotency_key=idempotency_key).first()
+            if job is not None and job.payload_digest != digest:
+                raise IdempotencyKeyReused(f'Idempotency-Key {idempotency_key!r} was used for a different payload')
+            return job
+        return (
+            query.filter(job_model.payload_digest == digest, job_model.status.in_([QUEUED, RUNNING]))
+            .order_by(job_model.created_at.desc())
+            .first()
+        )
+
+    def get(self, job_id, user_id):
+        return self.job_model.query.filter_by(job_id=job_id, user_id=user_id).first()
+
+    def claim(self, worker):
+        """Claim the oldest queued job, or a running job whose lease expired; returns None if idle."""
+        job_model = self.job_model
+        session = self.db.session
+        now = datetime.datetime.now()
+        candidates = session.execute(
+            select(job_model.job_id, job_model.status, job_model.attempts)
+            .where(or_(
+                job_model.status == QUEUED,
+                (job_model.status == RUNNING) & (job_model.lease_expires < now),
+            ))
+            .order_by(job_model.created_at)
+            .limit(8)
+        ).all()
+        for job_id, status, attempts in candidates:
+            # Compare-and-set: only one worker moves the row from the state it read
+            claimed = session.execute(
+                update(job_model)
+                .where(job_model.job_id == job_id, job_model.status == status, job_model.attempts == attempts)
+                .values(
+                    status=RUNNING, attempts=attempts + 1, worker=worker, started_at=now,
+                    lease_expires=now + datetime.timedelta(seconds=self.lease_seconds),
+                )
+            ).rowcount
+            session.commit()
+            if claimed == 1:
+                return session.get(job_model, job_id, populate_existing=True)
+        return None
+
+    def run(self, job, predict):
+        """Run a claimed job through predict(user_id, data, with_trajectory) and record the outcome.
+
+        predict stages its database writes without committing; they are
+        committed together with the job's result, and only if this worker
+        still holds the claim. Otherwise they are rolled back.
+        """
+        job_model = self.job_model
+        session = self.db.session
+        job_id, worker, attempts = job.job_id, job.worker, job.attempts
+        # Matches only while the claim made by claim() is still ours
+        claimed = (job_model.job_id == job_id, job_model.status == RUNNING,
+                   job_model.worker == worker, job_model.attempts == attempts)
+        try:
+            if attempts > self.max_attempts:
+                raise PermanentJobError(f'gave up after {self.max_attempts} attempts')
+            body = predict(job.user_id, json.loads(job.payload), job.with_trajectory)
+            done = session.execute(
+                update(job_model)
+                .where(*claimed)
+                .values(status=DONE, result=json.dumps(body), error=None, finished_at=datetime.datetime.now())
+            ).rowcount
+            if done != 1:
+                session.rollback()
+                logging.warning(f"Prediction job {job_id} was claimed by another worker; discarded this attempt")
+                return
+            session.commit()
+        except Exception as e:
+            session.rollback()
+            logging.error(f"Prediction job {job_id} failed: {str(e)}")
+            permanent = isinstance(e, (PermanentJobError, ValueError)) or attempts >= self.max_attempts
+            session.execute(
+                update(job_model)
+                .where(*claimed)
+                .values(status=FAILED if permanent else QUEUED, error=str(e),
+                        finished_at=datetime.datetime.now() if permanent else None)
+            )
+            session.commit()
+
+
+def describe(job):
+    """The JSON body GET /jobs/<id> returns for a job."""
+    body = {'job_id': job.job_id, 'status': job.status, 'attempts': job.attempts}
+    if job.status == DONE:
+        body.update(json.loads(job.result))
+    elif job.error:
+        body['error'] = job.error
+    return body
+
+
+def work(once=False, poll_interval=0.5):
+    """Claim and run jobs until stopped, or until the queue is empty with once."""
+    from main import app, job_queue, predict_report
+
+    worker = f'{os.uname().nodename}:{os.getpid()}'
+    with app.app_context():
+        while True:
+            job = job_queue.claim(worker)
+            if job is None:
+                if once:
+                    return
+                time.sleep(poll_interval)
+                continue
+            job_queue.run(job, predict_report)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run asynchronous /predict jobs.')
+    sub = parser.add_subparsers(dest='command', required=True)
+    worker = sub.add_parser('worker', help='run worker processes')
+    worker.add_argument('--processes', type=int, default=1)
+    worker.add_argument('--once', action='store_true', help='exit when no job is left')
+    worker.add_argument('--poll-interval', type=float, default=0.5)
+    args = parser.parse_args()
+
+    if args.processes == 1:
+        work(args.once, args.poll_interval)
+        return
+    # Each process imports main itself, so no database connection crosses a fork
+    context = multiprocessing.get_context('spawn')
+    processes = [context.Process(target=work, args=(args.once, args.poll_interval)) for _ in range(args.processes)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,4 +1,4 @@
-from flask import Flask, jsonify, request
+from flask import Flask, g, jsonify, request
 from flask_cors import CORS
 from flask_sqlalchemy import SQLAlchemy
 from functools import wraps
@@ -7,12 +7,27 @@ from werkzeug.security import generate_password_hash, check_password_hash
 import jwt
 import datetime
 from dotenv import load_dotenv
+import io
 import os
-import pickle
 import logging
 import random
 import numpy as np
 
+from artifacts import load_model_set
+from coalescer import Coalescer
+from encoding import CATEGORICAL_COLUMNS, UnknownCategoryError, encode_column
+from horizon import FORECAST_MONTHS, first_risk_month, forecast_horizon
+from ingest import FORMATS, Ingester
+from jobs import IdempotencyKeyReused, JobQueue, describe
+from metrics import Metrics
+from model_watch import ModelWatcher
+from patient_index import PatientIndex
+from plan_cache import PLAN_FEATURES, PlanCache
+from plan_scoring import rank_plans, score_plans
+from prediction_cache import create_cache
+from q_replay import load_artifact
+from q_store import ACTIONS, DISCOUNT_FACTOR, EPSILON, LEARNING_RATE, Q_THRESHOLD, QStore
+from token_cache import TokenCache
 
 # Set up the logging configuration
 logging.basicConfig(level=logging.DEBUG, format='%(levelname)s: %(message)s')
@@ -25,19 +40,91 @@ load_dotenv()
 # Access the SECRET_KEY
 SECRET_KEY = os.getenv('SECRET_KEY')
 DATABASE_URI = os.getenv('DATABASE_URI')
+# 'sklearn' or 'flat' (flattened-array RandomForest inference, see forest_engine.py)
+FOREST_ENGINE = os.getenv('FOREST_ENGINE', 'sklearn')
+# Directory written by `python artifacts.py build`; the .pkl files are used when unset
+ARTIFACT_DIR = os.getenv('ARTIFACT_DIR')
+ARTIFACT_VERIFY = os.getenv('ARTIFACT_VERIFY', '1') == '1'
+# Seconds between checks for a new bundle behind ARTIFACT_DIR (see model_watch.py); 0 disables hot swapping
+MODEL_RELOAD_INTERVAL = float(os.getenv('MODEL_RELOAD_INTERVAL', '30'))
+# Directory (or symlink) written by `python patient_index.py build`; /similar-patients is off when unset
+PATIENT_INDEX_DIR = os.getenv('PATIENT_INDEX_DIR')
+# 'memory', 'sqlite' (shared by the workers on a node) or 'off'
+PREDICTION_CACHE = os.getenv('PREDICTION_CACHE', 'memory')
+PREDICTION_CACHE_SIZE = int(os.getenv('PREDICTION_CACHE_SIZE', '10000'))
+PREDICTION_CACHE_TTL = float(os.getenv('PREDICTION_CACHE_TTL', '3600'))
+PREDICTION_CACHE_PATH = os.getenv('PREDICTION_CACHE_PATH', 'prediction_cache.sqlite3')
+# Concurrent model calls are merged for up to this many milliseconds or rows; 0 disables it
+COALESCE_WINDOW_MS = float(os.getenv('COALESCE_WINDOW_MS', '2'))
+COALESCE_MAX_BATCH = int(os.getenv('COALESCE_MAX_BATCH', '64'))
+# Seconds between checks of plan_cache_version for plan changes made by other workers
+PLAN_CACHE_CHECK_INTERVAL = float(os.getenv('PLAN_CACHE_CHECK_INTERVAL', '5'))
+# Seconds between Q-table reloads from the database, and between background flushes
+Q_REFRESH_INTERVAL = float(os.getenv('Q_REFRESH_INTERVAL', '1'))
+Q_FLUSH_INTERVAL = float(os.getenv('Q_FLUSH_INTERVAL', '0.2'))
+# Q-table trained offline by q_replay.py, used to seed a database that has not learned anything yet
+Q_TABLE_ARTIFACT = os.getenv('Q_TABLE_ARTIFACT')
+# Asynchronous /predict jobs: seconds before a silent worker's job is retried, and retries per job
+JOB_LEASE_SECONDS = float(os.getenv('JOB_LEASE_SECONDS', '60'))
+JOB_MAX_ATTEMPTS = int(os.getenv('JOB_MAX_ATTEMPTS', '3'))
+# Bulk report ingest: records scored per chunk, and rows per INSERT statement
+INGEST_CHUNK_ROWS = int(os.getenv('INGEST_CHUNK_ROWS', '1000'))
+INGEST_BATCH_SIZE = int(os.getenv('INGEST_BATCH_SIZE', '500'))
+# Verified JWT payloads kept per process so repeat calls skip the signature check; 0 disables the cache
+AUTH_CACHE_SIZE = int(os.getenv('AUTH_CACHE_SIZE', '10000'))
+# Seconds before a token revoked by /api/logout in one worker is refused by the others
+AUTH_REVOCATION_CHECK_INTERVAL = float(os.getenv('AUTH_REVOCATION_CHECK_INTERVAL', '1'))
+# Per-stage latency histograms served on /metrics; 0 turns the timing hooks into no-ops
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', '1') == '1'
 
 app = Flask(__name__)
+metrics = Metrics(enabled=METRICS_ENABLED)
 CORS(app, resources={r"/*": {"origins": "http://localhost:5173"}},supports_credentials=True)
 
 app.config['SQLALCHEMY_DATABASE_URI'] = DATABASE_URI
 app.config['SECRET_KEY'] = SECRET_KEY
 db = SQLAlchemy(app)
 
-ckd_new_model = pickle.load(open('ckd_model.pkl','rb'))
-param_model = pickle.load(open('future_params.pkl', 'rb'))
-cluster_model = pickle.load(open('cluster_model.pkl', 'rb'))
-scaler = pickle.load(open('scaler.pkl', 'rb'))
-label_encoders = pickle.load(open('label_encoders.pkl', 'rb'))
+models = load_model_set(ARTIFACT_DIR, FOREST_ENGINE, verify=ARTIFACT_VERIFY)
+if ARTIFACT_DIR:
+    logging.info(f"Loaded model artifacts version {models.version} from {ARTIFACT_DIR}")
+
+prediction_cache = create_cache(
+    PREDICTION_CACHE, models.fingerprint,
+    max_size=PREDICTION_CACHE_SIZE, ttl=PREDICTION_CACHE_TTL, path=PREDICTION_CACHE_PATH,
+)
+
+
+def swap_models(new_models):
+    """Serve new_models from the next model call on; called by the model watcher."""
+    global models
+    models = new_models
+    if prediction_cache is not None:
+        prediction_cache.set_model_version(new_models.fingerprint)
+    logging.info(f"Swapped in model artifacts version {new_models.version}")
+
+
+model_watcher = None
+if ARTIFACT_DIR and MODEL_RELOAD_INTERVAL > 0:
+    model_watcher = ModelWatcher(
+        ARTIFACT_DIR, lambda path: load_model_set(path, FOREST_ENGINE, verify=ARTIFACT_VERIFY), swap_models,
+        interval=MODEL_RELOAD_INTERVAL,
+    )
+
+patient_index = PatientIndex(PATIENT_INDEX_DIR) if PATIENT_INDEX_DIR else None
+
+
+def swap_patient_index(new_index):
+    """Serve new_index from the next /similar-patients call on; called by the index watcher."""
+    global patient_index
+    patient_index = new_index
+    logging.info(f"Swapped in patient index built {new_index.manifest['built']} ({len(new_index)} patients)")
+
+
+patient_index_watcher = None
+if PATIENT_INDEX_DIR and MODEL_RELOAD_INTERVAL > 0:
+    patient_index_watcher = ModelWatcher(PATIENT_INDEX_DIR, PatientIndex, swap_patient_index,
+                                         interval=MODEL_RELOAD_INTERVAL)
 
 
 class UserTable(db.Model):
@@ -53,6 +140,7 @@ class UserTable(db.Model):
 class TestReports(db.Model):
     
      __tablename__ = 'test_report'
+     __table_args__ = (db.Index('ix_test_report_user_latest', 'user_id', db.text('report_id DESC')),)
      report_id = db.Column(db.Integer, primary_key=True, autoincrement=True)
      user_id = db.Column(db.Integer, db.ForeignKey('users_table.user_id'), nullable=False)
      serum_creatinine = db.Column(db.Float, nullable=False)
@@ -77,6 +165,8 @@ class TestReports(db.Model):
      stress_level = db.Column(db.String(20), nullable=False)
      weight_changes = db.Column(db.String(20), nullable=False)
      ckd_report = db.Column(db.String(255), nullable=True)
+     # Clinician-confirmed CKD stage; the only label refresh.py trains the classifier on
+     confirmed_stage = db.Column(db.Integer, nullable=True)
      
 class FinalTreatmentPlan(db.Model):
     __tablename__ = 'final_treatment_plans'
@@ -86,7 +176,7 @@ class FinalTreatmentPlan(db.Model):
     physical_activity = db.Column(db.String, nullable=True)
     diet = db.Column(db.String, nullable=True)
     alcohol_limit = db.Column(db.String, nullable=True)
-    cluster = db.Column(db.Integer, nullable=True)
+    cluster = db.Column(db.Integer, nullable=True, index=True)
     serum_creatinine = db.Column(db.Float, nullable=True)
     gfr = db.Column(db.Float, nullable=True)
     bun = db.Column(db.Float, nullable=True)
@@ -105,15 +195,78 @@ class FinalSelectedPlan(db.Model):
     physical_activity = db.Column(db.String, nullable=True)
     diet = db.Column(db.String, nullable=True)
     alcohol_limit = db.Column(db.String, nullable=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('users_table.user_id'), nullable=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users_table.user_id'), nullable=True, index=True)
     plan_id = db.Column(db.Integer, db.ForeignKey('final_treatment_plans.id'), nullable=True)
 
+class PlanRankIndex(db.Model):
+    __tablename__ = 'plan_rank_index'
+    cluster = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    k = db.Column(db.Integer, nullable=False)
+    plans_digest = db.Column(db.String(64), nullable=False)
+    # plan_cache_version the index was published at; any plan change after it disables the index
+    plans_version = db.Column(db.Integer, nullable=True)
+    candidate_ids = db.Column(db.Text, nullable=False)
+    envelope_low = db.Column(db.Text, nullable=False)
+    envelope_high = db.Column(db.Text, nullable=False)
+    built_at = db.Column(db.DateTime, nullable=True)
+
+class QValue(db.Model):
+    __tablename__ = 'q_values'
+    action = db.Column(db.String(50), primary_key=True)
+    q_value = db.Column(db.Float, nullable=False, default=0.0)
+
+class QTableState(db.Model):
+    __tablename__ = 'q_table_state'
+    id = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+class PredictionJob(db.Model):
+    __tablename__ = 'prediction_job'
+    __table_args__ = (db.UniqueConstraint('user_id', 'idempotency_key'),)
+    job_id = db.Column(db.String(32), primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users_table.user_id'), nullable=False)
+    idempotency_key = db.Column(db.String(255), nullable=True)
+    payload_digest = db.Column(db.String(64), nullable=False, index=True)
+    payload = db.Column(db.Text, nullable=False)
+    with_trajectory = db.Column(db.Boolean, nullable=False, default=False)
+    status = db.Column(db.String(20), nullable=False, index=True)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    worker = db.Column(db.String(255), nullable=True)
+    result = db.Column(db.Text, nullable=True)
+    error = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, nullable=False)
+    started_at = db.Column(db.DateTime, nullable=True)
+    lease_expires = db.Column(db.DateTime, nullable=True)
+    finished_at = db.Column(db.DateTime, nullable=True)
+
+class RevokedToken(db.Model):
+    __tablename__ = 'revoked_token'
+    # Ids are never reused, so workers can read only the revocations past the last one they saw
+    __table_args__ = {'sqlite_autoincrement': True}
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    digest = db.Column(db.String(64), nullable=False, unique=True)
+    expires_at = db.Column(db.Float, nullable=False, index=True)
+
+class PlanCacheVersion(db.Model):
+    __tablename__ = 'plan_cache_version'
+    id = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
 
 
     
     
 with app.app_context():
     db.create_all()
+    if not db.session.get(PlanCacheVersion, 1):
+        db.session.add(PlanCacheVersion(id=1, version=0))
+        db.session.commit()
+
+plan_cache = PlanCache(db, FinalTreatmentPlan, PlanCacheVersion,
+                       check_interval=PLAN_CACHE_CHECK_INTERVAL, index_model=PlanRankIndex)
+with app.app_context():
+    token_cache = TokenCache(AUTH_CACHE_SIZE, db.engine, RevokedToken.__table__,
+                             check_interval=AUTH_REVOCATION_CHECK_INTERVAL)
+job_queue = JobQueue(db, PredictionJob, lease_seconds=JOB_LEASE_SECONDS, max_attempts=JOB_MAX_ATTEMPTS)
     
 NORMAL_RANGES = {
     "serum_creatinine": 1.0,
@@ -125,34 +278,32 @@ NORMAL_RANGES = {
     "blood_pressure": 120,
 }
 
-# Q-learning parameters and actions
-actions = [
-    "adjust_sodium_limit",
-    "adjust_fluid_intake",
-    "modify_physical_activity",
-    "update_diet",
-    "restrict_alcohol"
-]
-q_table = {action: 0.0 for action in actions}
-learning_rate = 0.1
-discount_factor = 0.9
-epsilon = 0.2
-q_threshold = 0.5
+with app.app_context():
+    q_store = QStore(
+        db.engine, QValue.__table__, QTableState.__table__, ACTIONS, LEARNING_RATE, DISCOUNT_FACTOR,
+        refresh_interval=Q_REFRESH_INTERVAL, flush_interval=Q_FLUSH_INTERVAL,
+    )
+    if Q_TABLE_ARTIFACT:
+        try:
+            # Version 0 means no update has been stored; only one worker wins the load
+            q_store.load(load_artifact(Q_TABLE_ARTIFACT, ACTIONS), if_version=0)
+        except (OSError, ValueError, KeyError) as e:
+            logging.error(f"Error loading Q-table artifact {Q_TABLE_ARTIFACT}: {str(e)}")
 
 # Helper functions for Q-learning
 def calculate_difference(old_state, new_state):
     return {key: new_state[key] - old_state[key] for key in old_state}
 
 def select_actions(difference):
+    q_table = q_store.snapshot()
     selected_actions = [
-        action for action in actions if random.uniform(0, 1) < epsilon or q_table[action] > q_threshold
+        action for action in ACTIONS if random.uniform(0, 1) < EPSILON or q_table[action] > Q_THRESHOLD
     ]
-    return selected_actions if selected_actions else [random.choice(actions)]
+    return selected_actions if selected_actions else [random.choice(ACTIONS)]
 
 def update_q_table(selected_actions, reward):
-    reward_per_action = reward / len(selected_actions)
-    for action in selected_actions:
-        q_table[action] += learning_rate * (reward_per_action + discount_factor * max(q_table.values()) - q_table[action])
+    # Applied locally now, written to the shared table by the background flusher
+    q_store.record(selected_actions, reward)
 
 # --- New recommendation functions with 5 options each ---
 
@@ -208,36 +359,221 @@ def dynamic_adjustment(old_state, difference):
         "alcohol_limit_change": determine_alcohol_limit(old_state),
     }
 
-def oxalate(plan, patient):
-    value = patient - (plan/100 * patient)
-    return value
-
-def apply_treatment(patient_data, treatment):
-    modified_data = patient_data.copy()
-    for param, change in treatment.items():
-        if param in modified_data:
-            if isinstance(change, (float, int)):
-                modified_data[param] += change
-    return modified_data
-
-def calculate_efficiency(modified_data, normal_ranges):
-    efficiency = 0
-    total_deviation = 0
-    count = 0  # Track the number of valid normal_values
-
-    for param, normal_value in normal_ranges.items():
-        if param in modified_data and normal_value != 0:  # Avoid division by zero
-            
-            deviation = abs(modified_data[param] - normal_value) / normal_value * 100
-            # print(normal_value)
-            total_deviation += deviation
-            count += 1  # Count only valid values
-    
-    if count == 0:  # Avoid division by zero in efficiency calculation
-        return 0  
-    
-    efficiency = (total_deviation / count)  # Use count instead of fixed 7
-    return efficiency
+# /predict payload keys in the column order the scaler and classifier were fitted with
+MEDICAL_FIELDS = [
+    'serumCreatinine', 'gfr', 'bun', 'serumCalcium', 'ana',
+    'c3c4', 'hematuria', 'oxalateLevels', 'urinePh', 'bloodPressure',
+]
+
+# (payload key, label encoder, default); water intake is the one numeric lifestyle column
+LIFESTYLE_FIELDS = [
+    ('physicalActivity', 'physical_activity', 'weekly'),
+    ('diet', 'diet', 'balanced'),
+    ('waterIntake', None, 2.0),
+    ('smoking', 'smoking', 'no'),
+    ('alcoholConsumption', 'alcohol', 'occasionally'),
+    ('painkillerUsage', 'painkiller_usage', 'no'),
+    ('familyHistory', 'family_history', 'no'),
+    ('weightChanges', 'weight_changes', 'stable'),
+    ('stressLevel', 'stress_level', 'moderate'),
+]
+
+# Training column names for the same 19 features
+FEATURE_COLUMNS = [
+    'serum_creatinine', 'gfr', 'bun', 'serum_calcium', 'ana',
+    'c3_c4', 'hematuria', 'oxalate_levels', 'urine_ph', 'blood_pressure',
+    'physical_activity', 'diet', 'water_intake', 'smoking', 'alcohol',
+    'painkiller_usage', 'family_history', 'weight_changes', 'stress_level',
+]
+
+NO_CKD_REPORT = 'No risk of CKD detected within the next 12 months.'
+
+
+def build_feature_matrix(reports):
+    """Encode a list of /predict payloads into one N x 19 feature matrix.
+
+    Categorical columns are encoded through the compiled lookup tables.
+    Raises ValueError on non-numeric lab values and UnknownCategoryError
+    on categories the encoders were not fitted with.
+    """
+    medical = np.array(
+        [[float(report.get(key, 0.0)) for key in MEDICAL_FIELDS] for report in reports],
+        dtype=float,
+    ).reshape(len(reports), len(MEDICAL_FIELDS))
+
+    lifestyle = np.empty((len(reports), len(LIFESTYLE_FIELDS)), dtype=float)
+    for col, (key, encoder, default) in enumerate(LIFESTYLE_FIELDS):
+        values = [report.get(key, default) for report in reports]
+        if encoder is None:
+            lifestyle[:, col] = np.array(values, dtype=float)
+        else:
+            lifestyle[:, col] = encode_column(models.encoding_tables, encoder, values)
+
+    return np.hstack([medical, lifestyle])
+
+
+def ckd_reports(features, with_trajectory=False):
+    """Score an N x 19 feature matrix and return one ckd_report string per row.
+
+    Rows predicted CKD-free go through the risk horizon together. Returns
+    (reports, trajectories); trajectories holds the monthly forecast for
+    CKD-free rows when with_trajectory is set and None otherwise.
+    """
+    # One read of the shared reference, so a hot swap never mixes two model versions in a call
+    current = models
+    t = metrics.clock()
+    standardized = current.scaler.transform(features)
+    t = metrics.lap('model.scale', t)
+    predictions = current.ckd_model.predict(standardized)
+    t = metrics.lap('model.classify', t)
+
+    reports = [
+        NO_CKD_REPORT if ckd_prediction == 0 else f'Patient has CKD. Stage: {ckd_prediction}'
+        for ckd_prediction in predictions
+    ]
+    trajectories = [None] * len(reports)
+
+    ckd_free = np.flatnonzero(predictions == 0)
+    if len(ckd_free) == 0:
+        return reports, trajectories
+
+    months = np.arange(1, FORECAST_MONTHS)
+    forecast, stages = forecast_horizon(
+        features[ckd_free], months,
+        param_model=current.param_model,
+        classifier=current.ckd_model,
+        scaler=current.scaler,
+        feature_columns=FEATURE_COLUMNS,
+        categorical_columns=CATEGORICAL_COLUMNS,
+        tables=current.encoding_tables,
+        n_medical=len(MEDICAL_FIELDS),
+    )
+    metrics.lap('model.forecast', t)
+    for row, i in enumerate(ckd_free):
+        month = first_risk_month(stages[row], months)
+        if month is not None:
+            reports[i] = f'At risk of CKD in {month} month(s).'
+        if with_trajectory:
+            trajectories[i] = [
+                {'month': int(m), 'stage': int(stage),
+                 **dict(zip(FEATURE_COLUMNS[:len(MEDICAL_FIELDS)], np.round(values, 4).tolist()))}
+                for m, stage, values in zip(months, stages[row], forecast[row])
+            ]
+    return reports, trajectories
+
+
+# One coalescer per variant, so plain requests never wait on trajectory forecasts
+ckd_batchers = {
+    variant: Coalescer(
+        lambda rows, variant=variant: list(zip(*ckd_reports(rows, variant))),
+        max_batch=COALESCE_MAX_BATCH, max_wait=COALESCE_WINDOW_MS / 1000,
+    )
+    for variant in (False, True)
+}
+cluster_batcher = Coalescer(lambda rows: models.cluster_model.predict(rows), max_batch=COALESCE_MAX_BATCH, max_wait=COALESCE_WINDOW_MS / 1000)
+
+
+def coalesced_ckd_reports(features, with_trajectory=False):
+    """ckd_reports() batched with concurrent requests."""
+    results = ckd_batchers[with_trajectory].submit(features)
+    return [result[0] for result in results], [result[1] for result in results]
+
+
+def cached_ckd_reports(features, with_trajectory=False):
+    """ckd_reports() behind the prediction cache; only uncached rows are scored."""
+    if prediction_cache is None:
+        return coalesced_ckd_reports(features, with_trajectory)
+
+    variant = 'trajectory' if with_trajectory else ''
+    keys = [prediction_cache.key(row, variant) for row in features]
+    reports = [None] * len(keys)
+    trajectories = [None] * len(keys)
+    missing = []
+    for i, key in enumerate(keys):
+        cached = prediction_cache.get(key)
+        if cached is None:
+            missing.append(i)
+        else:
+            reports[i], trajectories[i] = cached['result'], cached['trajectory']
+
+    if missing:
+        fresh_reports, fresh_trajectories = coalesced_ckd_reports(features[missing], with_trajectory)
+        for i, ckd_report, trajectory in zip(missing, fresh_reports, fresh_trajectories):
+            reports[i], trajectories[i] = ckd_report, trajectory
+            prediction_cache.set(keys[i], {'result': ckd_report, 'trajectory': trajectory})
+    return reports, trajectories
+
+
+def predict_report(user_id, data, with_trajectory=False, features=None):
+    """Score one /predict payload and stage the user's test report; the caller commits.
+
+    Returns the /predict response body. Used by /predict and by the
+    asynchronous job workers; features skips re-encoding an already
+    validated payload.
+    """
+    fields = test_report_fields(data)
+    if features is None:
+        features = build_feature_matrix([data])
+    reports, trajectories = cached_ckd_reports(features, with_trajectory)
+    ckd_report = reports[0]
+
+    test_report = (
+        db.session.query(TestReports).filter(TestReports.report_id == latest_report_id(user_id)).first()
+    )
+    if test_report:
+        # Update the user's latest report
+        for column, value in fields.items():
+            setattr(test_report, column, value)
+        test_report.ckd_report = ckd_report
+    else:
+        # Create a new test report
+        test_report = TestReports(user_id=user_id, ckd_report=ckd_report, **fields)
+    db.session.add(test_report)
+
+    body = {'result': ckd_report}
+    if with_trajectory:
+        body['trajectory'] = trajectories[0]
+    return body
+
+
+def latest_report_id(user_id):
+    """Subquery for the id of the user's latest test report, served by ix_test_report_user_latest."""
+    return db.select(db.func.max(TestReports.report_id)).where(TestReports.user_id == user_id).scalar_subquery()
+
+
+def make_ingester(**options):
+    """Bulk report ingester scoring chunks with ckd_reports(); options override the INGEST_* settings."""
+    options.setdefault('chunk_rows', INGEST_CHUNK_ROWS)
+    options.setdefault('batch_size', INGEST_BATCH_SIZE)
+    return Ingester(db, TestReports, models.encoding_tables, lambda features: ckd_reports(features)[0], **options)
+
+
+def test_report_fields(data):
+    """Map a /predict payload onto TestReports column values."""
+    return {
+        'serum_creatinine': float(data.get('serumCreatinine', 0.0)),
+        'gfr': float(data.get('gfr', 0.0)),
+        'bun': float(data.get('bun', 0.0)),
+        'serum_calcium': float(data.get('serumCalcium', 0.0)),
+        'ana': float(data.get('ana', 0.0)),
+        'c3_c4': float(data.get('c3c4', 0.0)),
+        'hematuria': float(data.get('hematuria', 0.0)),
+        'oxalate_levels': float(data.get('oxalateLevels', 0.0)),
+        'urine_ph': float(data.get('urinePh', 0.0)),
+        'blood_pressure': float(data.get('bloodPressure', 0.0)),
+        'gender': data.get('gender', 'Male'),
+        'age': data.get('age', 0),
+        'physical_activity': data.get('physicalActivity', 'weekly'),
+        'diet': data.get('diet', 'balanced'),
+        'family_history': data.get('familyHistory', 'no'),
+        'water_intake': float(data.get('waterIntake', 2.0)),
+        'smoking': data.get('smoking', 'no'),
+        'alcohol_consumption': data.get('alcoholConsumption', 'occasionally'),
+        'painkiller_usage': data.get('painkillerUsage', 'no'),
+        'weight_changes': data.get('weightChanges', 'stable'),
+        'stress_level': data.get('stressLevel', 'moderate'),
+    }
+
 
 def individual_efficiency(orignal, changes):
     positive = abs(changes)
@@ -277,16 +613,25 @@ def token_required(f):
         if not token:
             return jsonify({'error': 'Token is missing! Please log in first.'}), 401
 
-        try:
-            # Decode the token
-            data = jwt.decode(token, SECRET_KEY, algorithms=['HS256'])
-            user_id = data['user_id']
-            
-
-        except jwt.ExpiredSignatureError:
-            return jsonify({'error': 'Token has expired! Please log in again.'}), 401
-        except jwt.InvalidTokenError:
-            return jsonify({'error': 'Invalid token!'}), 401
+        t = metrics.clock()
+        key = token_cache.key(token)
+        data = token_cache.get(key)
+        if data is not None:
+            metrics.lap('auth.cached', t)
+        else:
+            if token_cache.is_revoked(key):
+                return jsonify({'error': 'Token has been revoked! Please log in again.'}), 401
+            try:
+                # Decode the token
+                data = jwt.decode(token, SECRET_KEY, algorithms=['HS256'])
+            except jwt.ExpiredSignatureError:
+                return jsonify({'error': 'Token has expired! Please log in again.'}), 401
+            except jwt.InvalidTokenError:
+                return jsonify({'error': 'Invalid token!'}), 401
+            token_cache.set(key, data)
+            metrics.lap('auth.decode', t)
+        user_id = data['user_id']
+        g.auth_token = token
 
         # Pass the `user_id` to the wrapped function
         return f(user_id, *args, **kwargs)
@@ -324,20 +669,38 @@ def login():
     # If login fails
     return jsonify({'message': 'Invalid email or password!'}), 401
 
+@app.route('/api/logout', methods=['POST'])
+@token_required
+def logout(user_id):
+    try:
+        token_cache.revoke(g.auth_token)
+        return jsonify({'message': 'Logged out successfully!'}), 200
+    except Exception as e:
+        logging.error(f"Error revoking token: {str(e)}")
+        metrics.count_error(request.endpoint)
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/clustering', methods=['POST'])
 @token_required
 def cluster(user_id):
     try:
         # Parse request data        
-        user = db.session.get(UserTable, user_id)
-        if not user:
+        # User and latest test report in one query
+        t = metrics.clock()
+        row = (
+            db.session.query(UserTable, TestReports)
+            .outerjoin(TestReports, TestReports.report_id == latest_report_id(user_id))
+            .filter(UserTable.user_id == user_id)
+            .first()
+        )
+        if not row:
             return jsonify({'error': 'User not found'}), 404
-        
-        test_report = db.session.query(TestReports).filter_by(user_id=user_id).order_by(TestReports.report_id.desc()).first()
+        user, test_report = row
+        t = metrics.lap('clustering.query', t)
         if not test_report:
             return jsonify({"error": "Test report not found for the user."}), 404
         
-        if test_report.ckd_report == 'No risk of CKD detected within the next 12 months.':
+        if test_report.ckd_report == NO_CKD_REPORT:
             return jsonify({"message": "No treatment required as no CKD risk detected."}), 200
 
         # Extract required medical features for clustering
@@ -351,44 +714,95 @@ def cluster(user_id):
         # Ensure all features are present
         if None in medical_features:
             return jsonify({"error": "Missing required medical features for clustering."}), 400
+        # Read before the commit below expires test_report
+        patient = [getattr(test_report, name) for name in PLAN_FEATURES]
         
         # Perform clustering
-        cluster_label = cluster_model.predict([medical_features])[0]
+        cluster_label = cluster_batcher.submit([medical_features])[0]
+        t = metrics.lap('clustering.cluster', t)
         
         cluster_int = int(cluster_label)
         user.cluster_no = cluster_int
         db.session.commit()
+        t = metrics.lap('clustering.commit', t)
         
         # Retrieve treatment plans for the predicted cluster
-        treatment_plans = FinalTreatmentPlan.query.filter_by(cluster=cluster_int).all()
+        treatment_plans = plan_cache.plans_for(cluster_int)
+        t = metrics.lap('clustering.plans', t)
         if not treatment_plans:
-            return jsonify({"message": "No treatment plans found for the predicted cluster.","cluster": cluster}), 404
+            return jsonify({"message": "No treatment plans found for the predicted cluster.","cluster": cluster_int}), 404
         
-        patient_data = {
-            "serum_creatinine": test_report.serum_creatinine,
-            "gfr": test_report.gfr,
-            "bun": test_report.bun,
-            "serum_calcium": test_report.serum_calcium,
-            "oxalate_levels": test_report.oxalate_levels,
-            "urine_ph": test_report.urine_ph,
-            "blood_pressure": test_report.blood_pressure
-        }
-        
-
-        response = []
-        for plan in treatment_plans:
-            treatment = {
-                "serum_creatinine": plan.serum_creatinine,
-                "gfr": plan.gfr,
-                "bun": plan.bun,
-                "serum_calcium": plan.serum_calcium,
-                "oxalate_levels": oxalate(plan.oxalate_levels, test_report.oxalate_levels),
-                "urine_ph": plan.urine_ph,
-                "blood_pressure": plan.blood_pressure
+        top_k = request.args.get('top_k', type=int)
+        # Score only the precomputed candidates when the ranking index covers this patient
+        rows = treatment_plans.candidate_rows(patient, top_k) if top_k is not None else None
+        if rows is None:
+            efficiency = score_plans(patient, treatment_plans.deltas)
+            indices, efficiencies = rank_plans(efficiency, top_k)
+        else:
+            efficiency = score_plans(patient, treatment_plans.deltas[rows])
+            positions, efficiencies = rank_plans(efficiency, top_k)
+            indices = [int(rows[position]) for position in positions]
+        metrics.lap('clustering.score', t)
+
+        response = [
+            {
+                "id": int(treatment_plans.ids[i]),
+                "sodium_intake": f"Allowed to intake maximum {treatment_plans.sodium_int[i]} grams of sodium per day",
+                "fluid_intake": f"Supposed to have minimum {treatment_plans.fluid_int[i]} litres of fluid per day",
+                "physical_activity": treatment_plans.physical_activity[i],
+                "diet": treatment_plans.diet[i],
+                "alcohol_limit": treatment_plans.alcohol_limit[i],
+                "efficiency": plan_efficiency
             }
-            modified_data = apply_treatment(patient_data, treatment)
-            efficiency = calculate_efficiency(modified_data, patient_data)
+            for i, plan_efficiency in zip(indices, efficiencies)
+        ]
+
+        return jsonify({"treatment_plans": response}), 200
+    
+    except Exception as e:
+        logging.error(f"Error in clustering: {str(e)}")
+        metrics.count_error(request.endpoint)
+        return jsonify({"error": str(e)}), 500
+    
+    
 
+# Neighbours returned by /similar-patients by default, and at most
+SIMILAR_PATIENTS_K = 5
+SIMILAR_PATIENTS_MAX_K = 50
+
+@app.route('/similar-patients', methods=['POST'])
+@token_required
+def similar_patients(user_id):
+    try:
+        # One read of the shared reference, so a hot swap never changes the index mid-request
+        index = patient_index
+        if index is None:
+            return jsonify({"error": "Similar-patient index is not configured."}), 503
+        k = request.args.get('k', SIMILAR_PATIENTS_K, type=int)
+        if not 1 <= k <= SIMILAR_PATIENTS_MAX_K:
+            return jsonify({"error": f"k must be between 1 and {SIMILAR_PATIENTS_MAX_K}."}), 400
+
+        t = metrics.clock()
+        test_report = db.session.query(TestReports).filter(TestReports.report_id == latest_report_id(user_id)).first()
+        if not test_report:
+            return jsonify({"error": "Test report not found for the user."}), 404
+        patient = [getattr(test_report, name) for name in PLAN_FEATURES]
+        if None in patient:
+            return jsonify({"error": "Missing required medical features for clustering."}), 400
+        t = metrics.lap('similar_patients.query', t)
+
+        neighbors = [index.describe(row, distance) for row, distance in index.query(patient, k, exclude_user=user_id)]
+        t = metrics.lap('similar_patients.search', t)
+
+        # Each plan the neighbours selected, with how their gfr moved since their first report
+        outcomes = {}
+        for neighbor in neighbors:
+            if neighbor.get('plan_id') is not None:
+                outcomes.setdefault(neighbor['plan_id'], []).append(neighbor['gfr_change'])
+        plans = db.session.query(FinalTreatmentPlan).filter(FinalTreatmentPlan.id.in_(outcomes)).all() if outcomes else []
+        response = []
+        for plan in plans:
+            changes = [change for change in outcomes[plan.id] if change is not None]
             response.append({
                 "id": plan.id,
                 "sodium_intake": f"Allowed to intake maximum {plan.sodium_int} grams of sodium per day",
@@ -396,18 +810,21 @@ def cluster(user_id):
                 "physical_activity": plan.physical_activity,
                 "diet": plan.diet,
                 "alcohol_limit": plan.alcohol_limit,
-                "efficiency": round(efficiency, 2)
+                "patients": len(outcomes[plan.id]),
+                "improved": sum(change > 0 for change in changes),
+                "mean_gfr_change": round(sum(changes) / len(changes), 4) if changes else None,
             })
+        # Plans that raised gfr the most first; plans without a follow-up report last
+        response.sort(key=lambda plan: (plan["mean_gfr_change"] is None, -(plan["mean_gfr_change"] or 0.0)))
+        metrics.lap('similar_patients.plans', t)
 
+        return jsonify({"neighbors": neighbors, "plans": response}), 200
 
-        response = sorted(response, key=lambda x: x["efficiency"], reverse=True)
-
-        return jsonify({"treatment_plans": response}), 200
-    
     except Exception as e:
+        logging.error(f"Error finding similar patients: {str(e)}")
+        metrics.count_error(request.endpoint)
         return jsonify({"error": str(e)}), 500
-    
-    
+
 
 @app.route('/predict', methods=['POST', 'OPTIONS'])
 @token_required
@@ -415,181 +832,221 @@ def predict(user_id):
 
     try:
         # Parse JSON data
+        t = metrics.clock()
         data = request.json
         if not data:
             return jsonify({'error': 'No data provided'}), 400
+        t = metrics.lap('predict.parse', t)
         
         user = db.session.get(UserTable, user_id)
         if not user:
             return jsonify({'error': 'User not found'}), 404
+        t = metrics.lap('predict.load_user', t)
 
         # Extract and validate inputs
         try:
-            serum_creatinine = float(data.get('serumCreatinine', 0.0))
-            gfr = float(data.get('gfr', 0.0))
-            bun = float(data.get('bun', 0.0))
-            serum_calcium = float(data.get('serumCalcium', 0.0))
-            ana = float(data.get('ana', 0.0))
-            c3c4 = float(data.get('c3c4', 0.0))
-            hematuria = float(data.get('hematuria', 0.0))
-            oxalate_levels = float(data.get('oxalateLevels', 0.0))
-            urine_ph = float(data.get('urinePh', 0.0))
-            blood_pressure = float(data.get('bloodPressure', 0.0))
-
-
-            physical_activity = label_encoders['physical_activity'].transform([data.get('physicalActivity', 'weekly')])[0]
-            age = data.get('age', 0)
-            gender = data.get('gender', 'Male')
-            diet = label_encoders['diet'].transform([data.get('diet', 'balanced')])[0]
-            water_intake = float(data.get('waterIntake', 2.0))
-            smoking = label_encoders['smoking'].transform([data.get('smoking', 'no')])[0]
-            alcohol_consumption = label_encoders['alcohol'].transform([data.get('alcoholConsumption', 'occasionally')])[0]
-            painkiller_usage = label_encoders['painkiller_usage'].transform([data.get('painkillerUsage', 'no')])[0]
-            family_history = label_encoders['family_history'].transform([data.get('familyHistory', 'no')])[0]
-            weight_changes = label_encoders['family_history'].transform([data.get('familyHistory', 'no')])[0]
-            stress_level = label_encoders['stress_level'].transform([data.get('stressLevel', 'moderate')])[0]
-            
-            physical_activity_db = data.get('physicalActivity','weekly')
-            diet_db = data.get('diet', 'balanced')
-            smoking_db = data.get('smoking', 'no')
-            alcohol_consumption_db = data.get('alcoholConsumption', 'occasionally')
-            painkiller_usage_db = data.get('painkillerUsage', 'no')
-            family_history_db = data.get('familyHistory', 'no')
-            weight_changes_db = data.get('weightChanges', 'stable')
-            stress_level_db = data.get('stressLevel', 'moderate')
-            
+            test_report_fields(data)
+            features = build_feature_matrix([data])
+        except UnknownCategoryError as e:
+            return jsonify({'error': 'Unknown category', 'field': e.column, 'details': str(e)}), 400
         except ValueError as e:
             return jsonify({'error': 'Invalid input format', 'details': str(e)}), 400
 
-        # Map lifestyle inputs to numerical values
-        lifestyle_features = [
-           physical_activity, diet, water_intake, smoking, alcohol_consumption, 
-           painkiller_usage, family_history, weight_changes, stress_level
-        ]
-        
-
-        
-        future_serum_creatinine = float(data.get('serumCreatinine', 0.0))
-        future_gfr = float(data.get('gfr', 0.0))
-        future_bun = float(data.get('bun', 0.0))
-        future_serum_calcium = float(data.get('serumCalcium', 0.0))
-        future_ana = bool(data.get('ana', 0.0))
-        future_c3c4 = float(data.get('c3c4', 0.0))
-        future_hematuria = bool(data.get('hematuria', 0.0))
-        future_oxalate_levels = float(data.get('oxalateLevels', 0.0))
-        future_urine_ph = float(data.get('urinePh', 0.0))
-        future_blood_pressure = float(data.get('bloodPressure', 0.0))
-
-        # Medical feature inputs
-        medical_features = [
-            serum_creatinine, gfr, bun, serum_calcium, ana, c3c4,
-            hematuria, oxalate_levels, urine_ph, blood_pressure
-        ]
-
-        combined_features = np.hstack([medical_features ,lifestyle_features]).reshape(1, -1)
-        
-        print("Shape of combined_features:", combined_features.shape)
-        print("Combined features:", combined_features)
-        
-        standardized_features = scaler.transform(combined_features)
-        number_of_months = 12
-        
-        future_features = [
-            future_serum_creatinine, future_gfr, future_bun, future_serum_calcium, future_ana, future_c3c4,
-            future_hematuria, future_oxalate_levels, future_urine_ph, future_blood_pressure  
-        ]
-        combined_future = np.hstack([future_features , lifestyle_features])
-        combined_future = combined_future.reshape(1, -1)
-        standardized_future = scaler.transform(combined_future)
-
-        # Predict CKD progression
-        ckd_report = 'No risk of CKD detected within the next 12 months.'
-        ckd_prediction = ckd_new_model.predict(standardized_features)[0]
-        if ckd_prediction != 0:
-            ckd_report = f'Patient has CKD. Stage: {ckd_prediction}'     
-        else:
-            for month in range(1, number_of_months):
-                future_features = param_model.predict([np.array(future_features) + month])[0]
-                ckd_prediction = ckd_new_model.predict(standardized_future)[0]
-                if ckd_prediction != 0:
-                    ckd_report = f'At risk of CKD in {month} month(s).'
-                    break
-
-                
-
-
-        # Fetch test report
-        test_report = db.session.get(TestReports, user_id)
-        if test_report:
-            # Update existing report
-            test_report.serum_creatinine = serum_creatinine
-            test_report.gfr = gfr
-            test_report.bun = bun
-            test_report.serum_calcium = serum_calcium
-            test_report.ana = ana
-            test_report.c3_c4 = c3c4
-            test_report.hematuria = hematuria
-            test_report.oxalate_levels = oxalate_levels
-            test_report.urine_ph = urine_ph
-            test_report.blood_pressure = blood_pressure
-            test_report.gender = gender
-            test_report.age = age
-            test_report.physical_activity = physical_activity_db
-            test_report.diet = diet_db
-            test_report.family_history = family_history_db
-            test_report.water_intake = water_intake
-            test_report.smoking = smoking_db
-            test_report.alcohol_consumption = alcohol_consumption_db
-            test_report.painkiller_usage = painkiller_usage_db
-            test_report.weight_changes = weight_changes_db
-            test_report.stress_level = stress_level_db
-            test_report.ckd_report = ckd_report
-            
-        else:
-            # Create a new test report
-            test_report = TestReports(
-                user_id=user_id,
-                serum_creatinine=serum_creatinine,
-                gfr=gfr,
-                bun=bun,
-                serum_calcium=serum_calcium,
-                ana=ana,
-                c3_c4=c3c4,
-                hematuria=hematuria,
-                oxalate_levels=oxalate_levels,
-                urine_ph=urine_ph,
-                blood_pressure=blood_pressure,
-                gender=gender,
-                age=age,
-                physical_activity=physical_activity_db,
-                diet=diet_db,
-                family_history=family_history_db,
-                water_intake=water_intake,
-                smoking=smoking_db,
-                alcohol_consumption=alcohol_consumption_db,
-                painkiller_usage=painkiller_usage_db,
-                weight_changes = weight_changes_db,
-                stress_level=stress_level_db,
-                ckd_report=ckd_report
-            )
-            db.session.add(test_report)
-
+        with_trajectory = request.args.get('trajectory') == '1'
+        if request.args.get('async') == '1':
+            try:
+                job, created = job_queue.enqueue(user_id, data, with_trajectory, request.headers.get('Idempotency-Key'))
+            except IdempotencyKeyReused as e:
+                return jsonify({'error': 'Idempotency-Key reused', 'details': str(e)}), 422
+            response = jsonify(describe(job))
+            response.headers['Location'] = f'/jobs/{job.job_id}'
+            response.headers.add("Access-Control-Allow-Origin", "http://localhost:5173")
+            return response, 202 if created else 200
+
+        t = metrics.lap('predict.encode', t)
+
+        # Predict CKD progression and save the test report
+        body = predict_report(user_id, data, with_trajectory, features)
+        t = metrics.lap('predict.score', t)
         try:
-            db.session.add(test_report)
             db.session.commit()
         except Exception as e:
             db.session.rollback()
             return jsonify({'error': 'Failed to save the test report', 'details': str(e)}), 500
+        metrics.lap('predict.commit', t)
 
         # Return response
-        response = jsonify({'result': ckd_report})
+        response = jsonify(body)
         response.headers.add("Access-Control-Allow-Origin", "http://localhost:5173")
         return response
 
     except Exception as e:
-        print("Error occurred:", str(e))  # For debugging
+        logging.error(f"Error in prediction: {str(e)}")
+        metrics.count_error(request.endpoint)
+        return jsonify({'error': 'Internal Server Error', 'details': str(e)}), 500
+
+@app.route('/predict/batch', methods=['POST', 'OPTIONS'])
+@token_required
+def predict_batch(user_id):
+    try:
+        data = request.json
+        reports = data.get('reports') if isinstance(data, dict) else None
+        if not reports or not isinstance(reports, list):
+            return jsonify({'error': 'No reports provided'}), 400
+
+        user = db.session.get(UserTable, user_id)
+        if not user:
+            return jsonify({'error': 'User not found'}), 404
+
+        # Validate every row up front so a bad row does not half-score the batch
+        rows = []
+        for index, report in enumerate(reports):
+            try:
+                rows.append(test_report_fields(report))
+            except (ValueError, TypeError, AttributeError) as e:
+                return jsonify({'error': 'Invalid input format', 'index': index, 'details': str(e)}), 400
+
+        try:
+            features = build_feature_matrix(reports)
+        except UnknownCategoryError as e:
+            return jsonify({'error': 'Unknown category', 'field': e.column, 'details': str(e)}), 400
+        except ValueError as e:
+            return jsonify({'error': 'Invalid input format', 'details': str(e)}), 400
+
+        with_trajectory = request.args.get('trajectory') == '1'
+        results, trajectories = cached_ckd_reports(features, with_trajectory)
+
+        try:
+            db.session.add_all([
+                TestReports(user_id=user_id, ckd_report=ckd_report, **fields)
+                for fields, ckd_report in zip(rows, results)
+            ])
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            return jsonify({'error': 'Failed to save the test reports', 'details': str(e)}), 500
+
+        response = []
+        for index, ckd_report in enumerate(results):
+            row = {'index': index, 'result': ckd_report}
+            if with_trajectory:
+                row['trajectory'] = trajectories[index]
+            response.append(row)
+        return jsonify({'results': response}), 200
+
+    except Exception as e:
+        logging.error(f"Error in batch prediction: {str(e)}")
+        metrics.count_error(request.endpoint)
+        return jsonify({'error': 'Internal Server Error', 'details': str(e)}), 500
+
+@app.route('/reports/ingest', methods=['POST'])
+@token_required
+def ingest_reports(user_id):
+    try:
+        user = db.session.get(UserTable, user_id)
+        if not user:
+            return jsonify({'error': 'User not found'}), 404
+
+        fmt = request.args.get('format')
+        if fmt is None:
+            fmt = 'ndjson' if 'ndjson' in (request.mimetype or '') else 'csv'
+        if fmt not in FORMATS:
+            return jsonify({'error': 'Unsupported format', 'details': f'expected one of {list(FORMATS)}'}), 400
+
+        # Read the body as a stream so large uploads are never held in memory
+        stream = io.TextIOWrapper(request.stream, encoding='utf-8', newline='')
+        summary = make_ingester().run(stream, fmt, user_id=user_id)
+        return jsonify(summary), 200
+
+    except Exception as e:
+        db.session.rollback()
+        logging.error(f"Error ingesting reports: {str(e)}")
+        metrics.count_error(request.endpoint)
         return jsonify({'error': 'Internal Server Error', 'details': str(e)}), 500
 
+@app.route('/jobs/<job_id>', methods=['GET'])
+@token_required
+def get_job(user_id, job_id):
+    job = job_queue.get(job_id, user_id)
+    if not job:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(describe(job)), 200
+
+@app.before_request
+def start_request_timer():
+    g.request_started = metrics.clock()
+    if model_watcher is not None:
+        model_watcher.ensure_started()
+    if patient_index_watcher is not None:
+        patient_index_watcher.ensure_started()
+
+@app.after_request
+def record_request_time(response):
+    if 'request_started' in g:
+        metrics.observe_request(request.endpoint or 'unmatched', metrics.clock() - g.request_started)
+    return response
+
+def runtime_counters():
+    """Counters of the in-process caches, coalescers and Q-table store, for /metrics."""
+    families = []
+    if prediction_cache is not None:
+        stats = prediction_cache.stats()
+        families.append(('prediction_cache_requests_total', 'counter', 'Prediction cache lookups by outcome.',
+                         [((('outcome', 'hit'),), stats['hits']), ((('outcome', 'miss'),), stats['misses'])]))
+        families.append(('prediction_cache_evictions_total', 'counter', 'Prediction cache evictions.',
+                         [((), stats['evictions'])]))
+    stats = token_cache.stats()
+    families.append(('auth_token_cache_requests_total', 'counter', 'Verified-token cache lookups by outcome.',
+                     [((('outcome', 'hit'),), stats['hits']), ((('outcome', 'miss'),), stats['misses'])]))
+    families.append(('auth_token_cache_evictions_total', 'counter', 'Verified tokens evicted from the cache.',
+                     [((), stats['evictions'])]))
+    families.append(('auth_token_revocations_total', 'counter', 'Tokens revoked through this worker.',
+                     [((), stats['revocations'])]))
+    batchers = {'predict': ckd_batchers[False], 'predict_trajectory': ckd_batchers[True], 'clustering': cluster_batcher}
+    for name, help_text in (('calls', 'Model calls submitted to a coalescer.'),
+                            ('batches', 'Matrix calls run by a coalescer.'),
+                            ('rows', 'Rows scored through a coalescer.'),
+                            ('bypassed', 'Model calls run directly, skipping a coalescer.')):
+        families.append((f'coalescer_{name}_total', 'counter', help_text,
+                         [((('model', model),), getattr(batcher, name)) for model, batcher in batchers.items()]))
+    families.append(('q_store_flushes_total', 'counter', 'Q-table batches written to the database.',
+                     [((), q_store.flushes)]))
+    families.append(('q_store_conflicts_total', 'counter', 'Q-table writes retried after a version race.',
+                     [((), q_store.conflicts)]))
+    families.append(('plan_cache_loads_total', 'counter', 'Treatment plan cache reloads.',
+                     [((), plan_cache.loads)]))
+    if patient_index_watcher is not None:
+        families.append(('patient_index_swaps_total', 'counter', 'Similar-patient indexes hot-swapped in.',
+                         [((), patient_index_watcher.swaps)]))
+    if model_watcher is not None:
+        families.append(('model_swaps_total', 'counter', 'Artifact bundles hot-swapped in.',
+                         [((), model_watcher.swaps)]))
+        families.append(('model_swap_failures_total', 'counter', 'Artifact bundles that failed to load.',
+                         [((), model_watcher.failures)]))
+    return families
+
+metrics.register(runtime_counters)
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    if not metrics.enabled:
+        return jsonify({'error': 'Metrics are disabled'}), 404
+    return metrics.render(), 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
+
+@app.route('/cache/stats', methods=['GET'])
+def cache_stats():
+    if prediction_cache is None:
+        return jsonify({'backend': 'off'}), 200
+    return jsonify(prediction_cache.stats()), 200
+
+@app.route('/coalescer/stats', methods=['GET'])
+def coalescer_stats():
+    return jsonify({
+        'predict': ckd_batchers[False].stats(),
+        'predict_trajectory': ckd_batchers[True].stats(),
+        'clustering': cluster_batcher.stats(),
+    }), 200
+
 @app.route('/select_treatment', methods=['POST'])
 @token_required
 def select_treatment(user_id):
@@ -605,7 +1062,7 @@ def select_treatment(user_id):
         treatment_id = data.get("treatment_id")
         if not treatment_id:
             return jsonify({"error": "No treatment ID provided"}), 400
-        print("working")
+        logging.debug(f"User {user_id} selecting treatment plan {treatment_id}")
         
         # Fetch the selected treatment plan from FinalTreatmentPlan
         selected_treatment = db.session.query(FinalTreatmentPlan).filter_by(id=treatment_id).first()
@@ -644,6 +1101,8 @@ def select_treatment(user_id):
 
     except Exception as e:
         db.session.rollback()  # Rollback in case of an error
+        logging.error(f"Error selecting treatment: {str(e)}")
+        metrics.count_error(request.endpoint)
         return jsonify({"error": str(e)}), 500
 
 
@@ -651,19 +1110,23 @@ def select_treatment(user_id):
 @app.route('/get_selected_treatment', methods=['POST'])
 @token_required
 def get_selected_treatment(user_id):
-    # Fetch the treatment plan directly from FinalSelectedPlan using user_id
-    plan = db.session.query(FinalSelectedPlan).filter_by(user_id=user_id).first()
-    id = plan.plan_id
-    
-    report = db.session.query(TestReports).filter_by(user_id=user_id).first()
-    
-    orignal_plan = db.session.query(FinalTreatmentPlan).filter_by(id=id).first()
-    
+    # Selected plan, the plan it came from and the latest test report in one query
+    row = (
+        db.session.query(FinalSelectedPlan, FinalTreatmentPlan, TestReports)
+        .outerjoin(FinalTreatmentPlan, FinalTreatmentPlan.id == FinalSelectedPlan.plan_id)
+        .outerjoin(TestReports, TestReports.report_id == latest_report_id(user_id))
+        .filter(FinalSelectedPlan.user_id == user_id)
+        .first()
+    )
+    if not row:
+        return jsonify({"error": "No treatment plan found"}), 404
+    plan, orignal_plan, report = row
+
     if not orignal_plan:
         return jsonify({"error": "No orignal plan found"}), 404
-    
-    if not plan:
-        return jsonify({"error": "No treatment plan found"}), 404
+
+    if not report:
+        return jsonify({"error": "No test report found for the user"}), 404
     
     gfr = individual_efficiency(report.gfr, orignal_plan.gfr)
     serum_creatinine = individual_efficiency(report.serum_creatinine, orignal_plan.serum_creatinine)
@@ -697,10 +1160,18 @@ def get_selected_treatment(user_id):
 @token_required
 def update_treatment(user_id):
     try:
-        # Fetch the latest test report for the user
-        latest_report = db.session.query(TestReports).filter_by(user_id=user_id).order_by(TestReports.report_id.desc()).first()
-        if not latest_report:
+        # Fetch the latest test report and the current treatment plan together
+        t = metrics.clock()
+        row = (
+            db.session.query(TestReports, FinalSelectedPlan)
+            .outerjoin(FinalSelectedPlan, FinalSelectedPlan.user_id == TestReports.user_id)
+            .filter(TestReports.report_id == latest_report_id(user_id))
+            .first()
+        )
+        if not row:
             return jsonify({"error": "No test report found for the user"}), 404
+        latest_report, selected_plan = row
+        t = metrics.lap('update_treatment.query', t)
 
         # Build the old_state dictionary from test report fields
         old_state = {
@@ -716,8 +1187,6 @@ def update_treatment(user_id):
             "blood_pressure": latest_report.blood_pressure,
         }
 
-        # Retrieve the current treatment plan from the database
-        selected_plan = db.session.query(FinalSelectedPlan).filter_by(user_id=user_id).first()
         if not selected_plan:
             return jsonify({"error": "No treatment plan found for the user"}), 404
 
@@ -756,11 +1225,14 @@ def update_treatment(user_id):
             elif action == "restrict_alcohol":
                 treatment_plan["alcohol_limit"] = adjustments.get("alcohol_limit_change", treatment_plan["alcohol_limit"])
             
+        t = metrics.lap('update_treatment.select_actions', t)
+
         # Compute the reward function (example formulation)
         reward = (new_state["gfr"] - old_state["gfr"]) - 5 * (1 if new_state.get("hematuria", False) else 0)
 
         # Update the Q-table based on the selected actions and reward
         update_q_table(selected_actions, reward)
+        t = metrics.lap('update_treatment.q_update', t)
 
         # Commit the updated treatment plan to the database
         selected_plan.sodium_int = round(treatment_plan["sodium_limit"], 2)
@@ -770,15 +1242,17 @@ def update_treatment(user_id):
         selected_plan.alcohol_limit = treatment_plan["alcohol_limit"]
 
         db.session.commit()
+        metrics.lap('update_treatment.commit', t)
 
         return jsonify({
             "updated_treatment_plan": treatment_plan,
             "reward": reward,
-            "q_table": q_table
+            "q_table": q_store.snapshot()
         }), 200
 
     except Exception as e:
         logging.error(f"Error updating treatment: {str(e)}")
+        metrics.count_error(request.endpoint)
         return jsonify({"error": str(e)}), 500
 
 @app.route('/health-data', methods=['GET'])
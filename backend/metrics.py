@@ -0,0 +1,148 @@
+"""In-process latency histograms in the Prometheus text format.
+
+Routes time their stages with laps: take t = metrics.clock() once, then
+call t = metrics.lap('predict.encode', t) after each stage. A lap records
+the time since t in that stage's histogram and returns the new start,
+so one clock read serves two spans. Histograms use fixed buckets, so
+recording is a bisect plus two additions under an uncontended lock.
+
+Routes also count the requests they fail with an unexpected error, with
+metrics.count_error(request.endpoint), next to logging the error.
+
+Metrics(enabled=False) turns every call into a no-op returning 0.
+
+Each worker process keeps its own histograms, so behind Gunicorn a scrape
+of /metrics reflects the worker that answered it.
+"""
+import threading
+from bisect import bisect_left
+from time import perf_counter
+
+
+# Upper bounds in seconds, from 10us to 10s
+BUCKETS = (
+    1e-5, 2.5e-5, 5e-5, 1e-4, 2.5e-4, 5e-4, 1e-3, 2.5e-3, 5e-3,
+    0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+)
+PREFIX = 'nephrosense'
+
+
+class Histogram:
+    __slots__ = ('bounds', 'counts', 'sum', 'lock')
+
+    def __init__(self, bounds=BUCKETS):
+        self.bounds = bounds
+        # One count per bucket plus +Inf; cumulated only when rendered
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.lock = threading.Lock()
+
+    def observe(self, seconds):
+        i = bisect_left(self.bounds, seconds)
+        # acquire/release rather than `with`, which costs more than the update itself
+        lock = self.lock
+        lock.acquire()
+        self.counts[i] += 1
+        self.sum += seconds
+        lock.release()
+
+    def snapshot(self):
+        with self.lock:
+            return list(self.counts), self.sum
+
+
+def _labels(labels):
+    return ','.join(f'{key}="{value}"' for key, value in labels)
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metrics:
+    """Stage and request latency histograms plus registered counter collectors."""
+
+    def __init__(self, enabled=True, prefix=PREFIX):
+        self.enabled = enabled
+        self.prefix = prefix
+        self._stages = {}
+        self._requests = {}
+        self._errors = {}
+        self._collectors = []
+        self._lock = threading.Lock()
+
+    def clock(self):
+        return perf_counter() if self.enabled else 0.0
+
+    def lap(self, stage, start):
+        """Record the time since start under stage and return the current time."""
+        if not self.enabled:
+            return 0.0
+        now = perf_counter()
+        histogram = self._stages.get(stage)
+        if histogram is None:
+            histogram = self._histogram(self._stages, stage)
+        histogram.observe(now - start)
+        return now
+
+    def observe_request(self, endpoint, seconds):
+        if not self.enabled:
+            return
+        histogram = self._requests.get(endpoint)
+        if histogram is None:
+            histogram = self._histogram(self._requests, endpoint)
+        histogram.observe(seconds)
+
+    def count_error(self, endpoint):
+        """Count one request to endpoint that failed with an unexpected error."""
+        if not self.enabled:
+            return
+        with self._lock:
+            self._errors[endpoint] = self._errors.get(endpoint, 0) + 1
+
+    def _histogram(self, family, key):
+        with self._lock:
+            return family.setdefault(key, Histogram())
+
+    def register(self, collector):
+        """Add a callable returning [(name, type, help, [(labels, value), ...]), ...] for each scrape."""
+        self._collectors.append(collector)
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format."""
+        lines = []
+        self._render_histograms(lines, 'stage_seconds', 'Time spent in each request stage.', 'stage',
+                                self._stages)
+        self._render_histograms(lines, 'request_seconds', 'Request latency by endpoint.', 'endpoint',
+                                self._requests)
+        full_name = f'{self.prefix}_request_errors_total'
+        lines.append(f'# HELP {full_name} Requests that failed with an unexpected error, by endpoint.')
+        lines.append(f'# TYPE {full_name} counter')
+        with self._lock:
+            errors = sorted(self._errors.items())
+        for endpoint, count in errors:
+            lines.append(f'{full_name}{{endpoint="{endpoint}"}} {count}')
+        for collector in self._collectors:
+            for name, kind, help_text, samples in collector():
+                full_name = f'{self.prefix}_{name}'
+                lines.append(f'# HELP {full_name} {help_text}')
+                lines.append(f'# TYPE {full_name} {kind}')
+                for labels, value in samples:
+                    suffix = f'{{{_labels(labels)}}}' if labels else ''
+                    lines.append(f'{full_name}{suffix} {_number(value)}')
+        return '\n'.join(lines) + '\n'
+
+    def _render_histograms(self, lines, name, help_text, label, family):
+        full_name = f'{self.prefix}_{name}'
+        lines.append(f'# HELP {full_name} {help_text}')
+        lines.append(f'# TYPE {full_name} histogram')
+        for key in sorted(family):
+            histogram = family[key]
+            counts, total = histogram.snapshot()
+            cumulative = 0
+            for bound, count in zip(histogram.bounds + (float('inf'),), counts):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append(f'{full_name}_bucket{{{label}="{key}",le="{le}"}} {cumulative}')
+            lines.append(f'{full_name}_sum{{{label}="{key}"}} {repr(total)}')
+            lines.append(f'{full_name}_count{{{label}="{key}"}} {cumulative}')
@@ -0,0 +1,154 @@
+"""Schema migrations for databases created before a model change.
+
+db.create_all() creates missing tables with their indexes, but never
+alters a table that already exists. The migrations here bring an
+existing database up to the current models. Applied migrations are
+recorded in schema_migrations, so running the script again is a no-op.
+
+Run from the backend directory, with the same DATABASE_URI as the app:
+
+    python migrate.py              # apply pending migrations
+    python migrate.py --list
+    python migrate.py --rollback 001_user_indexes
+
+On PostgreSQL, indexes are built with CREATE INDEX CONCURRENTLY so the
+tables stay writable while they build.
+"""
+import argparse
+import datetime
+import os
+import sys
+
+from dotenv import load_dotenv
+from sqlalchemy import create_engine, inspect, text
+
+
+def has_column(conn, table, column):
+    inspector = inspect(conn)
+    return inspector.has_table(table) and column in {c['name'] for c in inspector.get_columns(table)}
+
+
+def add_column(table, column, column_type):
+    """ADD COLUMN, skipped when the table already has the column.
+
+    A missing table is skipped too: create_all builds it from the current
+    model, column included, when the app starts.
+    """
+    def run(conn):
+        if inspect(conn).has_table(table) and not has_column(conn, table, column):
+            conn.execute(text(f'ALTER TABLE {table} ADD COLUMN {column} {column_type}'))
+    return run
+
+
+def drop_column(table, column):
+    def run(conn):
+        if has_column(conn, table, column):
+            conn.execute(text(f'ALTER TABLE {table} DROP COLUMN {column}'))
+    return run
+
+
+# (id, upgrade statements, downgrade statements), applied in order. A
+# statement is SQL text or a function of the connection.
+MIGRATIONS = [
+    (
+        '001_user_indexes',
+        [
+            'CREATE INDEX {concurrently} IF NOT EXISTS ix_test_report_user_latest ON test_report (user_id, report_id DESC)',
+            'CREATE INDEX {concurrently} IF NOT EXISTS ix_final_selected_plan_user_id ON final_selected_plan (user_id)',
+            'CREATE INDEX {concurrently} IF NOT EXISTS ix_final_treatment_plans_cluster ON final_treatment_plans (cluster)',
+        ],
+        [
+            'DROP INDEX IF EXISTS ix_test_report_user_latest',
+            'DROP INDEX IF EXISTS ix_final_selected_plan_user_id',
+            'DROP INDEX IF EXISTS ix_final_treatment_plans_cluster',
+        ],
+    ),
+    (
+        '002_test_report_confirmed_stage',
+        [add_column('test_report', 'confirmed_stage', 'INTEGER')],
+        [drop_column('test_report', 'confirmed_stage')],
+    ),
+    (
+        '003_plan_rank_index_plans_version',
+        [add_column('plan_rank_index', 'plans_version', 'INTEGER')],
+        [drop_column('plan_rank_index', 'plans_version')],
+    ),
+]
+
+
+def ensure_table(engine):
+    with engine.begin() as conn:
+        conn.execute(text(
+            'CREATE TABLE IF NOT EXISTS schema_migrations (id VARCHAR(100) PRIMARY KEY, applied_at TIMESTAMP NOT NULL)'
+        ))
+
+
+def applied(engine):
+    with engine.connect() as conn:
+        return {row[0] for row in conn.execute(text('SELECT id FROM schema_migrations'))}
+
+
+def run_statements(engine, statements):
+    postgres = engine.dialect.name == 'postgresql'
+    # CONCURRENTLY cannot run inside a transaction block
+    options = {'isolation_level': 'AUTOCOMMIT'} if postgres else {}
+    with engine.connect().execution_options(**options) as conn:
+        for statement in statements:
+            if callable(statement):
+                statement(conn)
+                continue
+            conn.execute(text(statement.format(concurrently='CONCURRENTLY' if postgres else '')))
+        conn.commit()
+
+
+def upgrade(engine):
+    done = applied(engine)
+    pending = [migration for migration in MIGRATIONS if migration[0] not in done]
+    for migration_id, statements, _ in pending:
+        run_statements(engine, statements)
+        with engine.begin() as conn:
+            conn.execute(text('INSERT INTO schema_migrations (id, applied_at) VALUES (:id, :at)'),
+                         {'id': migration_id, 'at': datetime.datetime.now()})
+        print(f'Applied {migration_id}')
+    if not pending:
+        print('Database is up to date')
+
+
+def rollback(engine, migration_id):
+    migrations = {migration[0]: migration for migration in MIGRATIONS}
+    if migration_id not in migrations:
+        raise SystemExit(f'Unknown migration {migration_id}')
+    if migration_id not in applied(engine):
+        raise SystemExit(f'{migration_id} is not applied')
+    run_statements(engine, migrations[migration_id][2])
+    with engine.begin() as conn:
+        conn.execute(text('DELETE FROM schema_migrations WHERE id = :id'), {'id': migration_id})
+    print(f'Rolled back {migration_id}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Apply schema migrations to DATABASE_URI.')
+    parser.add_argument('--list', action='store_true', help='show every migration and whether it is applied')
+    parser.add_argument('--rollback', metavar='ID', help='undo one applied migration')
+    args = parser.parse_args()
+
+    load_dotenv()
+    database_uri = os.getenv('DATABASE_URI')
+    if not database_uri:
+        raise SystemExit('DATABASE_URI is not set')
+    engine = create_engine(database_uri)
+    ensure_table(engine)
+
+    if args.list:
+        done = applied(engine)
+        for migration_id, _, _ in MIGRATIONS:
+            print(f"{'applied' if migration_id in done else 'pending':>8}  {migration_id}")
+    elif args.rollback:
+        rollback(engine, args.rollback)
+    else:
+        upgrade(engine)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
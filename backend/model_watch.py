@@ -0,0 +1,83 @@
+"""Hot swap of the served models when a new artifact bundle is published.
+
+ARTIFACT_DIR can be a symlink to one bundle directory, e.g.
+artifacts/current -> artifacts/20261018120000. publish() repoints the
+link with a rename, which is atomic. Each worker's ModelWatcher notices
+the new target within interval seconds and loads the whole bundle off
+the request path. It then hands the result to on_swap. Requests read
+the models through one reference, so each request sees either the old
+set or the new one, never a mix.
+"""
+import logging
+import os
+import threading
+import time
+
+
+def _manifest_path(directory):
+    return os.path.join(os.path.realpath(directory), 'manifest.json')
+
+
+def bundle_state(directory):
+    """(resolved bundle directory, manifest mtime); changes whenever a different bundle is published."""
+    return os.path.realpath(directory), os.stat(_manifest_path(directory)).st_mtime_ns
+
+
+def publish(bundle, link):
+    """Atomically point link at bundle; workers watching link switch to it."""
+    partial = f'{link}.{os.getpid()}.tmp'
+    if os.path.lexists(partial):
+        os.remove(partial)
+    os.symlink(os.path.abspath(bundle), partial)
+    os.replace(partial, link)
+
+
+class ModelWatcher:
+    """Reload models from path whenever the bundle behind it changes."""
+
+    def __init__(self, path, load, on_swap, interval=30.0):
+        self.path = path
+        self.load = load
+        self.on_swap = on_swap
+        self.interval = interval
+        self.swaps = 0
+        self.failures = 0
+        self._state = bundle_state(path)
+        self._failed_state = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def ensure_started(self):
+        # Started lazily so each forked Gunicorn worker gets its own watcher
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            threading.Thread(target=self._run, name='model-watch', daemon=True).start()
+
+    def check(self):
+        """Load and swap in the bundle at path if it changed; returns True on a swap."""
+        state = bundle_state(self.path)
+        # A bundle that failed to load is not retried until another one is published
+        if state == self._state or state == self._failed_state:
+            return False
+        try:
+            models = self.load(state[0])
+        except Exception:
+            self._failed_state = state
+            self.failures += 1
+            raise
+        self.on_swap(models)
+        self._state = state
+        self.swaps += 1
+        return True
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.check()
+            except Exception as e:
+                logging.error(f"Model reload from {self.path} failed, keeping the current models: {str(e)}")
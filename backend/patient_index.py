@@ -0,0 +1,253 @@
+"""Nearest-neighbour index of past patients over the /clustering lab values.
+
+/clustering only places a patient in a KMeans cluster. This index finds
+the k past patients whose PLAN_FEATURES values are closest, after
+standardizing each feature, together with the plan each of them selected.
+Past patients are the rows of the CKD_Historical datasets plus the
+latest TestReport of every user. Only dataset rows are described with
+their lab values; another user's report is described by its selected
+plan and gfr change alone (see PatientIndex.describe), so no patient's
+record can be identified through the index.
+
+An index directory holds:
+
+    manifest.json       row count, sources, build time and the standardization
+    tree.joblib         sklearn KDTree over the standardized rows, memory-mapped on load
+    features.npy        N x 7 raw PLAN_FEATURES values
+    source.npy          0 for a dataset row, 1 for a test report
+    ref.npy             dataset row number, or report_id
+    user_id.npy         -1 for dataset rows
+    plan_id.npy         the user's selected FinalTreatmentPlan, -1 for none
+    gfr_change.npy      latest minus first report gfr; NaN with fewer than two reports
+
+Every array, the tree's included, is memory-mapped read-only, so loading
+takes milliseconds at any size and Gunicorn workers share the pages. With
+--link the new index is published like a model bundle (see model_watch.py),
+and workers serving PATIENT_INDEX_DIR=<link> switch to it.
+
+Run from the backend directory:
+
+    python patient_index.py build indexes/20261018 --link indexes/current
+    python patient_index.py info indexes/current
+"""
+import argparse
+import datetime
+import json
+import os
+import sys
+import time
+
+import joblib
+import numpy as np
+import pandas as pd
+from sklearn.neighbors import KDTree
+
+from columnar import ColumnarDataset, is_dataset
+from model_watch import publish
+from plan_cache import PLAN_FEATURES
+from plan_index import DATASET
+
+
+FORMAT_VERSION = 1
+MANIFEST = 'manifest.json'
+ARRAYS = ['features', 'source', 'ref', 'user_id', 'plan_id', 'gfr_change']
+SOURCES = ['dataset', 'report']
+LEAF_SIZE = 40
+
+
+def dataset_rows(path):
+    """PLAN_FEATURES rows of a CKD_Historical CSV or its columnar copy."""
+    if is_dataset(path):
+        return ColumnarDataset(path).matrix(PLAN_FEATURES)
+    return pd.read_csv(path, usecols=PLAN_FEATURES)[PLAN_FEATURES].to_numpy(dtype=np.float64)
+
+
+def report_rows(db, report_model, selected_model):
+    """(features, report_id, user_id, plan_id, gfr_change) of every user's latest test report."""
+    per_user = (
+        db.select(
+            report_model.user_id,
+            db.func.min(report_model.report_id).label('first_id'),
+            db.func.max(report_model.report_id).label('latest_id'),
+        )
+        .group_by(report_model.user_id)
+        .subquery()
+    )
+    latest = db.aliased(report_model)
+    first = db.aliased(report_model)
+    plans = (
+        db.select(selected_model.user_id, db.func.max(selected_model.plan_id).label('plan_id'))
+        .group_by(selected_model.user_id)
+        .subquery()
+    )
+    query = (
+        db.select(
+            *[getattr(latest, name) for name in PLAN_FEATURES],
+            latest.report_id, latest.user_id, plans.c.plan_id, first.gfr, per_user.c.first_id,
+        )
+        .join(per_user, latest.report_id == per_user.c.latest_id)
+        .join(first, first.report_id == per_user.c.first_id)
+        .outerjoin(plans, plans.c.user_id == latest.user_id)
+        .order_by(latest.report_id)
+    )
+    rows = db.session.execute(query).all()
+    n = len(PLAN_FEATURES)
+    features = np.array([row[:n] for row in rows], dtype=np.float64).reshape(len(rows), n)
+    report_id = np.array([row[n] for row in rows], dtype=np.int64)
+    user_id = np.array([row[n + 1] for row in rows], dtype=np.int64)
+    plan_id = np.array([-1 if row[n + 2] is None else row[n + 2] for row in rows], dtype=np.int64)
+    first_gfr = np.array([row[n + 3] for row in rows], dtype=np.float64)
+    first_id = np.array([row[n + 4] for row in rows], dtype=np.int64)
+    gfr_change = np.where(first_id != report_id, features[:, PLAN_FEATURES.index('gfr')] - first_gfr, np.nan)
+    return features, report_id, user_id, plan_id, gfr_change
+
+
+def write_index(directory, arrays, sources):
+    """Standardize arrays['features'], build the tree and write an index directory; returns its manifest."""
+    features = arrays['features']
+    mean = features.mean(axis=0)
+    scale = features.std(axis=0)
+    scale[scale == 0] = 1.0
+    os.makedirs(directory, exist_ok=True)
+    joblib.dump(KDTree((features - mean) / scale, leaf_size=LEAF_SIZE), os.path.join(directory, 'tree.joblib'))
+    for name in ARRAYS:
+        np.save(os.path.join(directory, f'{name}.npy'), np.ascontiguousarray(arrays[name]))
+
+    manifest = {
+        'format_version': FORMAT_VERSION,
+        'built': datetime.datetime.now().isoformat(timespec='seconds'),
+        'rows': len(features),
+        'sources': sources,
+        'mean': mean.tolist(),
+        'scale': scale.tolist(),
+    }
+    # Written last so a half-built directory never looks complete
+    with open(os.path.join(directory, MANIFEST), 'w') as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+def build(directory, datasets=(DATASET,)):
+    """Index the dataset rows and every user's latest test report into directory."""
+    from main import FinalSelectedPlan, TestReports, app, db
+
+    parts = []
+    sources = {}
+    for path in datasets:
+        features = dataset_rows(path)
+        sources[os.path.basename(os.path.normpath(path))] = len(features)
+        parts.append({
+            'features': features,
+            'source': np.zeros(len(features), dtype=np.int8),
+            'ref': np.arange(len(features), dtype=np.int64),
+            'user_id': np.full(len(features), -1, dtype=np.int64),
+            'plan_id': np.full(len(features), -1, dtype=np.int64),
+            'gfr_change': np.full(len(features), np.nan),
+        })
+    with app.app_context():
+        features, report_id, user_id, plan_id, gfr_change = report_rows(db, TestReports, FinalSelectedPlan)
+    sources['test_report'] = len(features)
+    parts.append({
+        'features': features,
+        'source': np.ones(len(features), dtype=np.int8),
+        'ref': report_id,
+        'user_id': user_id,
+        'plan_id': plan_id,
+        'gfr_change': gfr_change,
+    })
+
+    arrays = {name: np.concatenate([part[name] for part in parts]) for name in ARRAYS}
+    valid = ~np.isnan(arrays['features']).any(axis=1)
+    arrays = {name: array[valid] for name, array in arrays.items()}
+    if not len(arrays['features']):
+        raise ValueError('Nothing to index')
+    return write_index(directory, arrays, sources)
+
+
+class PatientIndex:
+    """Read-only, memory-mapped view of a directory written by write_index()."""
+
+    def __init__(self, directory):
+        self.directory = directory
+        try:
+            with open(os.path.join(directory, MANIFEST)) as f:
+                self.manifest = json.load(f)
+        except FileNotFoundError:
+            raise ValueError(f'No {MANIFEST} in patient index directory {directory!r}') from None
+        if self.manifest.get('format_version') != FORMAT_VERSION:
+            raise ValueError(f"Unsupported patient index format {self.manifest.get('format_version')!r}")
+        self.mean = np.array(self.manifest['mean'])
+        self.scale = np.array(self.manifest['scale'])
+        self.tree = joblib.load(os.path.join(directory, 'tree.joblib'), mmap_mode='r')
+        for name in ARRAYS:
+            setattr(self, name, np.load(os.path.join(directory, f'{name}.npy'), mmap_mode='r'))
+
+    def __len__(self):
+        return self.manifest['rows']
+
+    def query(self, patient, k, exclude_user=None):
+        """[(row, distance)] of the k rows nearest to patient, leaving out exclude_user's own report."""
+        point = (np.asarray(patient, dtype=np.float64) - self.mean) / self.scale
+        # One extra in case the patient's own report is among them
+        n = min(len(self), k + (exclude_user is not None))
+        distances, rows = self.tree.query(point.reshape(1, -1), k=n)
+        neighbors = [
+            (int(row), float(distance)) for row, distance in zip(rows[0], distances[0])
+            if exclude_user is None or self.user_id[row] != exclude_user
+        ]
+        return neighbors[:k]
+
+    def describe(self, row, distance):
+        """JSON-ready description of one indexed patient.
+
+        Dataset rows come with their lab values. Other users' reports only
+        give what their plan did: no ids, report ids or lab values.
+        """
+        source = SOURCES[self.source[row]]
+        if source == 'dataset':
+            return {
+                'source': source,
+                'dataset_row': int(self.ref[row]),
+                'distance': round(distance, 4),
+                'features': dict(zip(PLAN_FEATURES, np.round(self.features[row], 4).tolist())),
+            }
+        gfr_change = float(self.gfr_change[row])
+        return {
+            'source': source,
+            'distance': round(distance, 4),
+            'plan_id': int(self.plan_id[row]) if self.plan_id[row] >= 0 else None,
+            'gfr_change': None if np.isnan(gfr_change) else round(gfr_change, 4),
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Build or describe the similar-patient index.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    build_parser = subparsers.add_parser('build', help='index the datasets and the latest test reports')
+    build_parser.add_argument('directory')
+    build_parser.add_argument('--dataset', action='append', dest='datasets',
+                              help='CSV or columnar directory to index; repeatable (default: the clustering CSV)')
+    build_parser.add_argument('--link', help='symlink to repoint at the new index, e.g. indexes/current')
+    info_parser = subparsers.add_parser('info', help='describe an index directory')
+    info_parser.add_argument('directory')
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        if os.path.exists(os.path.join(args.directory, MANIFEST)):
+            parser.error(f'{args.directory} already holds an index')
+        start = time.perf_counter()
+        manifest = build(args.directory, args.datasets or [DATASET])
+        print(f"Indexed {manifest['rows']} patients into {args.directory} in {time.perf_counter() - start:.1f}s")
+        if args.link:
+            publish(args.directory, args.link)
+            print(f'{args.link} -> {args.directory}')
+    else:
+        index = PatientIndex(args.directory)
+        print(f"{len(index)} patients, built {index.manifest['built']}")
+        for source, rows in index.manifest['sources'].items():
+            print(f'  {source:<40} {rows}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
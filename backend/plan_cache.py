@@ -0,0 +1,165 @@
+"""Process-local cache of the treatment plans, grouped by cluster.
+
+Plans almost never change, so /clustering should not query and hydrate
+FinalTreatmentPlan ORM objects on every call. The cache loads every plan
+once with a plain column select and keeps each cluster as column arrays.
+
+Invalidation works at two levels:
+- A flush that inserts, updates or deletes plans marks this process's
+  cache stale, and bumps a counter row in plan_cache_version in the same
+  transaction.
+- Every worker re-reads that counter at most once per check interval
+  and reloads when it has moved.
+
+Plans loaded with raw SQL must bump the counter themselves, for example
+`UPDATE plan_cache_version SET version = version + 1`.
+"""
+import hashlib
+import json
+import threading
+import time
+
+import numpy as np
+from sqlalchemy import event, select
+
+
+# Medical columns a plan changes, in the order used by the efficiency scoring
+PLAN_FEATURES = [
+    'serum_creatinine', 'gfr', 'bun', 'serum_calcium',
+    'oxalate_levels', 'urine_ph', 'blood_pressure',
+]
+PLAN_TEXT_FIELDS = ['sodium_int', 'fluid_int', 'physical_activity', 'diet', 'alcohol_limit']
+
+
+class RankIndex:
+    """Precomputed top-k candidate rows of one cluster, valid inside a feature envelope."""
+
+    __slots__ = ('k', 'rows', 'low', 'high')
+
+    def __init__(self, k, rows, low, high):
+        self.k = k
+        self.rows = rows
+        self.low = low
+        self.high = high
+
+    def covers(self, patient, k):
+        return k <= self.k and bool(np.all((self.low <= patient) & (patient <= self.high)))
+
+
+class ClusterPlans:
+    """The treatment plans of one cluster as column arrays."""
+
+    __slots__ = ('ids', 'deltas', 'sodium_int', 'fluid_int', 'physical_activity', 'diet', 'alcohol_limit',
+                 'index')
+
+    def __init__(self, rows):
+        self.ids = np.array([row.id for row in rows], dtype=np.int64)
+        # P x 7 plan changes; NULL columns become NaN
+        self.deltas = np.array(
+            [[getattr(row, name) for name in PLAN_FEATURES] for row in rows], dtype=np.float64
+        ).reshape(len(rows), len(PLAN_FEATURES))
+        for name in PLAN_TEXT_FIELDS:
+            setattr(self, name, [getattr(row, name) for row in rows])
+        self.index = None
+
+    def __len__(self):
+        return len(self.ids)
+
+    def digest(self):
+        """Digest of the plan ids and changes, used to tell whether a ranking index is current."""
+        digest = hashlib.sha256(self.ids.tobytes())
+        digest.update(np.ascontiguousarray(self.deltas).tobytes())
+        return digest.hexdigest()
+
+    def candidate_rows(self, patient, k):
+        """Rows that can reach this patient's top-k, or None when the index does not apply."""
+        if self.index is None or not self.index.covers(np.asarray(patient, dtype=np.float64), k):
+            return None
+        return self.index.rows
+
+
+class PlanCache:
+    """Treatment plans grouped by cluster, reloaded when the version counter moves."""
+
+    def __init__(self, db, plan_model, version_model, check_interval=5.0, index_model=None):
+        self.db = db
+        self.plan_model = plan_model
+        self.index_model = index_model
+        self.version_table = version_model.__table__
+        self.check_interval = check_interval
+        self._clusters = None
+        self._version = None
+        self._stale = True
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+        self.loads = 0
+
+        event.listen(db.session, 'after_flush', self._on_flush)
+
+    def _on_flush(self, session, flush_context):
+        changed = (session.new, session.dirty, session.deleted)
+        if not any(isinstance(obj, self.plan_model) for objects in changed for obj in objects):
+            return
+        # One bump per flush, inside its transaction, so it commits or rolls back with the plans
+        session.connection().execute(
+            self.version_table.update().values(version=self.version_table.c.version + 1)
+        )
+        self._stale = True
+
+    def invalidate(self):
+        self._stale = True
+
+    def _current_version(self):
+        return self.db.session.execute(select(self.version_table.c.version)).scalar()
+
+    def load_clusters(self, version=None):
+        """Load every plan from the database, grouped by cluster.
+
+        Ranking indexes are attached when they were published at version
+        (see plan_index.py), the plan_cache_version read before the load.
+        """
+        plan = self.plan_model
+        columns = [plan.id, plan.cluster] + [getattr(plan, name) for name in PLAN_FEATURES + PLAN_TEXT_FIELDS]
+        rows = self.db.session.execute(select(*columns).order_by(plan.id)).all()
+
+        grouped = {}
+        for row in rows:
+            grouped.setdefault(row.cluster, []).append(row)
+        clusters = {cluster: ClusterPlans(cluster_rows) for cluster, cluster_rows in grouped.items()}
+        if self.index_model is not None and version is not None:
+            self._attach_indexes(clusters, version)
+        self.loads += 1
+        return clusters
+
+    def _attach_indexes(self, clusters, version):
+        """Attach each cluster's ranking index, skipping any built before a plan change or from other plans."""
+        for entry in self.db.session.execute(select(self.index_model)).scalars():
+            plans = clusters.get(entry.cluster)
+            if plans is None or entry.plans_version != version or entry.plans_digest != plans.digest():
+                continue
+            rows = np.searchsorted(plans.ids, np.array(json.loads(entry.candidate_ids), dtype=np.int64))
+            plans.index = RankIndex(
+                entry.k, np.sort(rows),
+                np.array(json.loads(entry.envelope_low), dtype=np.float64),
+                np.array(json.loads(entry.envelope_high), dtype=np.float64),
+            )
+
+    def _refresh(self):
+        now = time.monotonic()
+        if not self._stale and self._clusters is not None and now - self._checked_at < self.check_interval:
+            return
+        with self._lock:
+            if not self._stale and self._clusters is not None and now - self._checked_at < self.check_interval:
+                return
+            stale = self._stale
+            self._stale = False
+            version = self._current_version()
+            if stale or self._clusters is None or version != self._version:
+                self._clusters = self.load_clusters(version)
+                self._version = version
+            self._checked_at = now
+
+    def plans_for(self, cluster):
+        """Return the ClusterPlans for a cluster, or None if it has no plans."""
+        self._refresh()
+        return self._clusters.get(cluster)
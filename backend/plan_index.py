@@ -0,0 +1,206 @@
+"""Offline per-cluster plan ranking index.
+
+For a patient with positive lab values p, /clustering's plan efficiency is
+
+    100/7 * (sum over non-oxalate j of |d_j| / p_j  +  |1 - oxalate / 100|)
+
+which is linear in w = 1/p. Over a cluster's feature envelope (a box of
+p values), plan A beats plan B for every patient in the box iff the
+minimum of eff_A - eff_B over the box corners is positive. A plan that
+at least k other plans beat everywhere in the box can never reach the
+top-k, so only the remaining candidates are stored.
+
+Envelopes come from the cluster_model assignments of the historical
+dataset and the latest TestReports. /clustering falls back to scoring
+every plan when a patient lies outside the envelope, top_k exceeds the
+indexed k, or the cluster's plans changed after the index was built.
+
+Each build bumps plan_cache_version and stamps every entry with the new
+value, so workers reload and pick the index up. Any later plan change
+moves the counter past the stamp, and workers ignore the index until
+the next build.
+
+Run from the backend directory, with the same DATABASE_URI as the app:
+
+    python plan_index.py --k 3            # rebuild clusters whose plans changed
+    python plan_index.py --k 3 --full     # rebuild every cluster
+"""
+import argparse
+import datetime
+import json
+import os
+
+import numpy as np
+import pandas as pd
+from dotenv import load_dotenv
+from sqlalchemy import MetaData, Table, create_engine, func, select
+
+from artifacts import load_model_set
+from plan_cache import PLAN_FEATURES, PLAN_TEXT_FIELDS, ClusterPlans
+
+
+OXALATE = PLAN_FEATURES.index('oxalate_levels')
+DATASET = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'CKD_Historical',
+                       'updated_medical_lifestyle_dataset.csv')
+
+# A plan ranked after B can only be pruned by B with a clear margin, since
+# efficiencies are compared after rounding to 2 decimals and ties keep plan order
+ROUNDING_MARGIN = 0.011
+TOLERANCE = 1e-6
+
+
+def plan_terms(deltas):
+    """Split plans into per-feature coefficients of 1/p and a constant oxalate term."""
+    changes = np.where(np.isnan(deltas), 0.0, deltas)
+    coefficients = np.abs(changes)
+    coefficients[:, OXALATE] = 0.0
+    constant = np.where(np.isnan(deltas[:, OXALATE]), 0.0, np.abs(1 - changes[:, OXALATE] / 100))
+    return coefficients, constant
+
+
+def prune_candidates(deltas, low, high, k):
+    """Return the sorted plan rows that can reach the top-k anywhere in [low, high]."""
+    n = len(deltas)
+    if n <= k or np.any(low <= 0):
+        return np.arange(n)
+    # Compare a block of plans against all plans at a time, about 4M values per block
+    block = max(1, min(n, 2**22 // (n * len(PLAN_FEATURES))))
+
+    coefficients, constant = plan_terms(deltas)
+    w_low, w_high = 1.0 / high, 1.0 / low
+    scale = 100.0 / len(PLAN_FEATURES)
+    beaten_by = np.zeros(n, dtype=np.int64)
+    later = np.arange(n)
+
+    for start in range(0, n, block):
+        stop = min(start + block, n)
+        # diff[a, b] = coefficients of eff_a - eff_b for plans a in this block
+        diff = coefficients[start:stop, np.newaxis, :] - coefficients[np.newaxis, :, :]
+        worst = np.minimum(diff * w_low, diff * w_high).sum(axis=2)
+        worst += constant[start:stop, np.newaxis] - constant[np.newaxis, :]
+        worst *= scale
+        earlier = np.arange(start, stop)[:, np.newaxis] < later[np.newaxis, :]
+        beats = (worst > ROUNDING_MARGIN) | (earlier & (worst > TOLERANCE))
+        beaten_by += beats.sum(axis=0)
+
+    return np.flatnonzero(beaten_by < k)
+
+
+def cluster_envelopes(cluster_model, features):
+    """Per-cluster (low, high) bounds of the PLAN_FEATURES rows assigned to each cluster."""
+    labels = cluster_model.predict(features)
+    return {
+        int(cluster): (features[labels == cluster].min(axis=0), features[labels == cluster].max(axis=0))
+        for cluster in np.unique(labels)
+    }
+
+
+def load_plans(conn, plans):
+    """Every treatment plan as {cluster: ClusterPlans}, with the same rows and order as PlanCache."""
+    columns = [plans.c.id, plans.c.cluster] + [plans.c[name] for name in PLAN_FEATURES + PLAN_TEXT_FIELDS]
+    grouped = {}
+    for row in conn.execute(select(*columns).order_by(plans.c.id)):
+        grouped.setdefault(row.cluster, []).append(row)
+    return {cluster: ClusterPlans(rows) for cluster, rows in grouped.items()}
+
+
+def envelope_features(conn, reports, dataset=DATASET):
+    """Historical dataset rows plus each user's latest test report, in PLAN_FEATURES order."""
+    frames = [pd.read_csv(dataset, usecols=PLAN_FEATURES)[PLAN_FEATURES].to_numpy(dtype=np.float64)]
+    latest = select(func.max(reports.c.report_id)).group_by(reports.c.user_id)
+    rows = conn.execute(
+        select(*[reports.c[name] for name in PLAN_FEATURES]).where(reports.c.report_id.in_(latest))
+    ).all()
+    if rows:
+        frames.append(np.array(rows, dtype=np.float64))
+    features = np.vstack(frames)
+    return features[~np.isnan(features).any(axis=1)]
+
+
+def build_index(engine, tables, cluster_model, k, full=False, margin=0.0, dataset=DATASET):
+    """Rebuild the plan_rank_index rows of clusters whose plans changed (or all with full).
+
+    tables maps 'plans', 'reports', 'index' and 'version' to the
+    final_treatment_plans, test_report, plan_rank_index and
+    plan_cache_version tables. Returns [(cluster, plans, kept)] of the
+    rebuilt clusters.
+    """
+    plans_table, index, version = tables['plans'], tables['index'], tables['version']
+    with engine.begin() as conn:
+        clusters = load_plans(conn, plans_table)
+        envelopes = cluster_envelopes(cluster_model, envelope_features(conn, tables['reports'], dataset))
+        existing = {entry.cluster: entry for entry in conn.execute(select(index))}
+        current = conn.execute(select(version.c.version)).scalar()
+
+        rebuilt = []
+        for cluster, plans in sorted(clusters.items()):
+            if cluster not in envelopes:
+                continue
+            digest = plans.digest()
+            entry = existing.get(cluster)
+            if entry is not None and not full and entry.plans_digest == digest and entry.k == k:
+                continue
+
+            low, high = envelopes[cluster]
+            span = (high - low) * margin
+            low, high = low - span, high + span
+            rows = prune_candidates(plans.deltas, low, high, k)
+
+            values = dict(
+                k=k, plans_digest=digest, candidate_ids=json.dumps(plans.ids[rows].tolist()),
+                envelope_low=json.dumps(low.tolist()), envelope_high=json.dumps(high.tolist()),
+                built_at=datetime.datetime.now(),
+            )
+            if entry is None:
+                conn.execute(index.insert().values(cluster=cluster, **values))
+            else:
+                conn.execute(index.update().where(index.c.cluster == cluster).values(**values))
+            rebuilt.append((cluster, len(plans), len(rows)))
+
+        stale = [cluster for cluster in existing if cluster not in clusters]
+        if stale:
+            conn.execute(index.delete().where(index.c.cluster.in_(stale)))
+
+        outdated = any(entry.plans_version != current for entry in existing.values())
+        if rebuilt or stale or outdated:
+            # Make every worker's plan cache reload, and mark the index as built for the plans it now sees
+            conn.execute(version.update().values(version=version.c.version + 1))
+            published = conn.execute(select(version.c.version)).scalar()
+            conn.execute(index.update().values(plans_version=published))
+        return rebuilt
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Precompute per-cluster top-k plan candidates.')
+    parser.add_argument('--k', type=int, default=3, help='largest top_k the index serves')
+    parser.add_argument('--full', action='store_true', help='rebuild every cluster, not only changed ones')
+    parser.add_argument('--margin', type=float, default=0.0,
+                        help='widen each envelope by this fraction of its span on both sides')
+    parser.add_argument('--dataset', default=DATASET)
+    parser.add_argument('--bundle', help='artifact bundle to take the cluster model from (default: ARTIFACT_DIR, '
+                                         'else the .pkl files)')
+    args = parser.parse_args()
+
+    load_dotenv()
+    database_uri = os.getenv('DATABASE_URI')
+    if not database_uri:
+        raise SystemExit('DATABASE_URI is not set')
+    models = load_model_set(args.bundle or os.getenv('ARTIFACT_DIR'))
+    engine = create_engine(database_uri)
+    metadata = MetaData()
+    tables = {
+        name: Table(table, metadata, autoload_with=engine)
+        for name, table in (('plans', 'final_treatment_plans'), ('reports', 'test_report'),
+                            ('index', 'plan_rank_index'), ('version', 'plan_cache_version'))
+    }
+
+    rebuilt = build_index(engine, tables, models.cluster_model, args.k, full=args.full, margin=args.margin,
+                          dataset=args.dataset)
+    for cluster, total, kept in rebuilt:
+        print(f'Cluster {cluster}: kept {kept} of {total} plans')
+    if not rebuilt:
+        print('Index is up to date')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+"""Treatment plan efficiency scoring.
+
+oxalate/apply_treatment/calculate_efficiency score one plan at a time.
+score_plans computes the same efficiencies for a whole P x 7 matrix of
+plan changes using broadcasting, with the same float operations in the
+same order, so the numbers are identical. rank_plans picks the top-k
+with argpartition instead of sorting every plan.
+"""
+import numpy as np
+
+from plan_cache import PLAN_FEATURES
+
+
+OXALATE = PLAN_FEATURES.index('oxalate_levels')
+
+
+def oxalate(plan, patient):
+    value = patient - (plan/100 * patient)
+    return value
+
+def apply_treatment(patient_data, treatment):
+    modified_data = patient_data.copy()
+    for param, change in treatment.items():
+        if param in modified_data:
+            if isinstance(change, (float, int)):
+                modified_data[param] += change
+    return modified_data
+
+def calculate_efficiency(modified_data, normal_ranges):
+    efficiency = 0
+    total_deviation = 0
+    count = 0  # Track the number of valid normal_values
+
+    for param, normal_value in normal_ranges.items():
+        if param in modified_data and normal_value != 0:  # Avoid division by zero
+
+            deviation = abs(modified_data[param] - normal_value) / normal_value * 100
+            total_deviation += deviation
+            count += 1  # Count only valid values
+
+    if count == 0:  # Avoid division by zero in efficiency calculation
+        return 0
+
+    efficiency = (total_deviation / count)  # Use count instead of fixed 7
+    return efficiency
+
+
+def score_plans(patient, deltas):
+    """Efficiency of every plan for one patient.
+
+    patient holds the 7 PLAN_FEATURES values and deltas is the P x 7 plan
+    matrix from ClusterPlans. Matches apply_treatment + calculate_efficiency
+    with the patient's own values as the reference, as /clustering uses them.
+    NULL (NaN) plan columns leave the value unchanged.
+    """
+    patient = np.asarray(patient, dtype=np.float64)
+    missing = np.isnan(deltas)
+    changes = np.where(missing, 0.0, deltas)
+    # The plan's oxalate column is a percentage reduction, see oxalate()
+    changes[:, OXALATE] = patient[OXALATE] - (changes[:, OXALATE] / 100 * patient[OXALATE])
+    changes[missing[:, OXALATE], OXALATE] = 0.0
+
+    modified = patient + changes
+    total = np.zeros(len(deltas))
+    count = 0
+    # Accumulate parameter by parameter, in the same order as calculate_efficiency
+    for j in np.flatnonzero(patient != 0):
+        total += np.abs(modified[:, j] - patient[j]) / patient[j] * 100
+        count += 1
+    if count == 0:
+        return total
+    return total / count
+
+
+def rank_plans(efficiency, k=None):
+    """Return (indices, rounded efficiencies) of the top-k plans, best first.
+
+    Plans are ordered by efficiency rounded to 2 decimals, ties keeping plan
+    order, exactly like sorting the full response list. Only plans that can
+    round level with the k-th best are rounded and sorted.
+    """
+    n = len(efficiency)
+    if k is None or k >= n:
+        candidates = np.arange(n)
+    elif k <= 0:
+        return [], []
+    else:
+        kth = efficiency[np.argpartition(efficiency, n - k)[n - k]]
+        candidates = np.flatnonzero(efficiency >= kth - 0.02)
+
+    rounded = [round(value, 2) for value in efficiency[candidates].tolist()]
+    order = sorted(range(len(candidates)), key=lambda i: -rounded[i])[:k]
+    return [int(candidates[i]) for i in order], [rounded[i] for i in order]
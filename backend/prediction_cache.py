@@ -0,0 +1,212 @@
+"""Bounded TTL cache in front of the CKD prediction pipeline.
+
+Entries are keyed '<model version>:<digest>', the digest covering the
+canonicalized 19-feature vector and the model version, so a new set of
+model artifacts never serves stale results. Two backends are available:
+an in-process OrderedDict and a SQLite file that every worker on the node
+can share. The SQLite backend never writes on a hit, and prunes expired
+and surplus entries every prune_every sets rather than on each one, so
+the shared file adds no write per lookup. A worker that swaps in new models deletes only the entries of
+the version it leaves; the shared file keeps any other version's entries
+until they expire.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+
+BACKENDS = ('memory', 'sqlite', 'off')
+# Sets between two prunes of the SQLite backend; the file can hold this many extra rows per worker
+PRUNE_EVERY = 100
+
+
+class MemoryBackend:
+    """Process-local LRU dict with per-entry expiry."""
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, now):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at <= now:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, expires_at):
+        """Store a value and return how many entries were evicted."""
+        with self._lock:
+            self._entries[key] = (expires_at, value)
+            self._entries.move_to_end(key)
+            evicted = 0
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                evicted += 1
+            return evicted
+
+    def delete_prefix(self, prefix):
+        with self._lock:
+            for key in [key for key in self._entries if key.startswith(prefix)]:
+                del self._entries[key]
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class SQLiteBackend:
+    """Table in a local SQLite file shared by every worker on the node, evicted oldest stored first.
+
+    last_access is the time an entry was stored; hits leave it alone, so a
+    lookup is a read only.
+    """
+
+    def __init__(self, path, max_size, prune_every=PRUNE_EVERY):
+        self.path = path
+        self.max_size = max_size
+        self.prune_every = prune_every
+        self._sets = 0
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        with self._connection() as conn:
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS prediction_cache ('
+                ' key TEXT PRIMARY KEY, value TEXT NOT NULL,'
+                ' expires_at REAL NOT NULL, last_access REAL NOT NULL)'
+            )
+            conn.execute('CREATE INDEX IF NOT EXISTS ix_prediction_cache_last_access'
+                         ' ON prediction_cache (last_access)')
+            conn.execute('CREATE INDEX IF NOT EXISTS ix_prediction_cache_expires_at'
+                         ' ON prediction_cache (expires_at)')
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5.0)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def get(self, key, now):
+        conn = self._connection()
+        row = conn.execute(
+            'SELECT value FROM prediction_cache WHERE key = ? AND expires_at > ?', (key, now)
+        ).fetchone()
+        if row is None:
+            return None
+        return json.loads(row[0])
+
+    def set(self, key, value, expires_at):
+        """Store a value and return how many entries were evicted, which only a prune does."""
+        conn = self._connection()
+        now = time.time()
+        with self._lock:
+            self._sets += 1
+            prune = self._sets % self.prune_every == 0
+        with conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO prediction_cache (key, value, expires_at, last_access)'
+                ' VALUES (?, ?, ?, ?)', (key, json.dumps(value), expires_at, now)
+            )
+        return self.prune(now) if prune else 0
+
+    def prune(self, now):
+        """Delete expired entries, then the oldest beyond max_size; returns the number of the latter."""
+        with self._connection() as conn:
+            conn.execute('DELETE FROM prediction_cache WHERE expires_at <= ?', (now,))
+            evicted = conn.execute(
+                'DELETE FROM prediction_cache WHERE key IN ('
+                ' SELECT key FROM prediction_cache ORDER BY last_access DESC LIMIT -1 OFFSET ?)',
+                (self.max_size,)
+            ).rowcount
+        return evicted
+
+    def delete_prefix(self, prefix):
+        # A range on the primary key; prefix ends in ':' and ';' sorts right after it
+        with self._connection() as conn:
+            conn.execute('DELETE FROM prediction_cache WHERE key >= ? AND key < ?', (prefix, prefix[:-1] + ';'))
+
+    def __len__(self):
+        return self._connection().execute('SELECT COUNT(*) FROM prediction_cache').fetchone()[0]
+
+
+class PredictionCache:
+    """Cache of per-row prediction results for one model version."""
+
+    def __init__(self, backend, ttl, model_version):
+        self.backend = backend
+        self.ttl = ttl
+        self.model_version = model_version
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # += on an attribute is not atomic across request threads
+        self._lock = threading.Lock()
+
+    def key(self, features, variant=''):
+        """The model version and a digest of one canonicalized feature row, the version and a result variant."""
+        model_version = self.model_version
+        # Adding 0.0 folds -0.0 into 0.0 so equal vectors always share a key
+        row = np.ascontiguousarray(np.asarray(features, dtype=np.float64) + 0.0)
+        digest = hashlib.sha256(f'{model_version}:{variant}:'.encode())
+        digest.update(row.tobytes())
+        return f'{model_version}:{digest.hexdigest()}'
+
+    def get(self, key):
+        value = self.backend.get(key, time.time())
+        with self._lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return value
+
+    def set(self, key, value):
+        evicted = self.backend.set(key, value, time.time() + self.ttl)
+        with self._lock:
+            self.evictions += evicted
+
+    def set_model_version(self, model_version):
+        """Switch to a new model version and delete the old version's entries, which can never hit again."""
+        old_version = self.model_version
+        if model_version != old_version:
+            self.model_version = model_version
+            self.backend.delete_prefix(f'{old_version}:')
+
+    def stats(self):
+        with self._lock:
+            hits, misses, evictions = self.hits, self.misses, self.evictions
+        return {
+            'backend': type(self.backend).__name__,
+            'model_version': self.model_version,
+            'size': len(self.backend),
+            'hits': hits,
+            'misses': misses,
+            'evictions': evictions,
+        }
+
+
+def create_cache(backend, model_version, max_size=10000, ttl=3600, path='prediction_cache.sqlite3'):
+    """Build a PredictionCache for the configured backend, or None when caching is off."""
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown prediction cache backend {backend!r}; expected one of: {', '.join(BACKENDS)}")
+    if backend == 'off':
+        return None
+    if backend == 'sqlite':
+        store = SQLiteBackend(os.path.abspath(path), max_size)
+    else:
+        store = MemoryBackend(max_size)
+    return PredictionCache(store, ttl, model_version)
@@ -0,0 +1,237 @@
+"""Offline Q-learning replay over historical old/new state pairs.
+
+Replays transitions through the same selection, reward and update rules
+as /update-treatment and writes a Q-table artifact the backend can load
+(see Q_TABLE_ARTIFACT in main.py, or --install).
+
+Transition sources:
+- targets: each row of medical_lifestyle_with_targets.csv against its
+  Target_* columns
+- stages: the same patients' rows in medical_lifestyle_with_targets.csv
+  against updated_ckd_dataset_with_stages.csv (same row order)
+- reports: consecutive TestReports of each user, from the application
+  database or from a CSV export of the test_reports table (--reports-csv)
+
+The random draws, differences and rewards are computed for every
+transition at once with a seeded NumPy generator. Only the Q-update itself
+stays a loop, since every update reads the current max. Each seed is an
+independent run of --epochs shuffled passes. Seeds run in a process pool,
+and the artifact holds their mean table and the per-seed tables.
+
+Run from the backend directory; the reports source and --install use the
+same DATABASE_URI as the app:
+
+    python q_replay.py --source targets stages --seeds 8 --epochs 5 --output q_table.json
+    python q_replay.py --source reports --install
+"""
+import argparse
+import datetime
+import hashlib
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+from dotenv import load_dotenv
+from sqlalchemy import MetaData, Table, create_engine, select
+
+from q_store import ACTIONS, DISCOUNT_FACTOR, EPSILON, LEARNING_RATE, Q_THRESHOLD, QStore
+
+
+FORMAT_VERSION = 1
+HISTORICAL_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'CKD_Historical')
+TARGETS_CSV = os.path.join(HISTORICAL_DIR, 'medical_lifestyle_with_targets.csv')
+STAGES_CSV = os.path.join(HISTORICAL_DIR, 'updated_ckd_dataset_with_stages.csv')
+
+# The state fields /update-treatment reads from a TestReport, and their Target_* columns
+STATE_FIELDS = [
+    'serum_creatinine', 'gfr', 'bun', 'serum_calcium', 'ana',
+    'c3_c4', 'hematuria', 'oxalate_levels', 'urine_ph', 'blood_pressure',
+]
+TARGET_COLUMNS = [
+    'Target_Serum_Creatinine', 'Target_GFR', 'Target_BUN', 'Target_Serum_Calcium', 'Target_ANA',
+    'Target_C3_C4', 'Target_Hematuria', 'Target_Oxalate_Levels', 'Target_Urine_pH', 'Target_Blood_Pressure',
+]
+GFR = STATE_FIELDS.index('gfr')
+HEMATURIA = STATE_FIELDS.index('hematuria')
+
+
+def targets_transitions(path=TARGETS_CSV):
+    frame = pd.read_csv(path, usecols=STATE_FIELDS + TARGET_COLUMNS)
+    return frame[STATE_FIELDS].to_numpy(dtype=np.float64), frame[TARGET_COLUMNS].to_numpy(dtype=np.float64)
+
+
+def stages_transitions(old_path=TARGETS_CSV, new_path=STAGES_CSV):
+    old = pd.read_csv(old_path, usecols=STATE_FIELDS)[STATE_FIELDS].to_numpy(dtype=np.float64)
+    new = pd.read_csv(new_path, usecols=STATE_FIELDS)[STATE_FIELDS].to_numpy(dtype=np.float64)
+    if old.shape != new.shape:
+        raise ValueError(f'{old_path} and {new_path} do not have the same rows')
+    return old, new
+
+
+def report_pairs(frame):
+    """Pair each user's test reports with their next report, in report_id order."""
+    frame = frame.sort_values(['user_id', 'report_id'])
+    same_user = (frame['user_id'].to_numpy()[1:] == frame['user_id'].to_numpy()[:-1])
+    states = frame[STATE_FIELDS].to_numpy(dtype=np.float64)
+    return states[:-1][same_user], states[1:][same_user]
+
+
+def reports_transitions(csv_path=None, engine=None):
+    """Report pairs from a test_reports CSV export, else from the test_report table of engine."""
+    columns = ['report_id', 'user_id'] + STATE_FIELDS
+    if csv_path:
+        return report_pairs(pd.read_csv(csv_path, usecols=columns))
+
+    reports = Table('test_report', MetaData(), autoload_with=engine)
+    with engine.connect() as conn:
+        rows = conn.execute(select(*(reports.c[name] for name in columns))).all()
+    return report_pairs(pd.DataFrame(rows, columns=columns))
+
+
+def load_transitions(sources, reports_csv=None, engine=None):
+    """Stack the (old, new) state arrays of every source, dropping rows with missing values."""
+    loaders = {
+        'targets': targets_transitions,
+        'stages': stages_transitions,
+        'reports': lambda: reports_transitions(reports_csv, engine),
+    }
+    pairs = [loaders[source]() for source in sources]
+    old = np.vstack([pair[0] for pair in pairs])
+    new = np.vstack([pair[1] for pair in pairs])
+    complete = ~(np.isnan(old).any(axis=1) | np.isnan(new).any(axis=1))
+    return old[complete], new[complete]
+
+
+def rewards(old, new):
+    """/update-treatment's reward for every transition: GFR gain minus 5 for hematuria."""
+    difference = new - old
+    return difference[:, GFR] - 5 * (new[:, HEMATURIA] != 0)
+
+
+def replay(rewards, explore, fallback, q_values=None,
+           learning_rate=LEARNING_RATE, discount_factor=DISCOUNT_FACTOR, q_threshold=Q_THRESHOLD):
+    """Run the Q-updates in order and return the final Q-values.
+
+    explore is the N x A epsilon draw mask and fallback the action taken
+    when nothing is selected, like select_actions with random.choice.
+    """
+    q = [0.0] * len(ACTIONS) if q_values is None else list(q_values)
+    actions = range(len(ACTIONS))
+    for reward, explored, fallback_action in zip(rewards.tolist(), explore.tolist(), fallback.tolist()):
+        selected = [a for a in actions if explored[a] or q[a] > q_threshold]
+        if not selected:
+            selected = [fallback_action]
+        reward_per_action = reward / len(selected)
+        for a in selected:
+            q[a] += learning_rate * (reward_per_action + discount_factor * max(q) - q[a])
+    return q
+
+
+def run_seed(seed, rewards, epochs, epsilon=EPSILON):
+    """One independent training run: epochs shuffled passes over every transition."""
+    rng = np.random.default_rng(seed)
+    q = None
+    for _ in range(epochs):
+        order = rng.permutation(len(rewards))
+        explore = rng.random((len(rewards), len(ACTIONS))) < epsilon
+        fallback = rng.integers(0, len(ACTIONS), size=len(rewards))
+        q = replay(rewards[order], explore, fallback, q)
+    return q
+
+
+def train(rewards, seeds, epochs, workers=None):
+    """Run every seed, in a process pool when there is more than one."""
+    if len(seeds) == 1 or workers == 1:
+        return [run_seed(seed, rewards, epochs) for seed in seeds]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(run_seed, seeds, [rewards] * len(seeds), [epochs] * len(seeds)))
+
+
+def build_artifact(tables, seeds, epochs, transitions, sources, rewards):
+    tables = np.array(tables, dtype=np.float64)
+    return {
+        'format_version': FORMAT_VERSION,
+        'actions': ACTIONS,
+        'q_table': dict(zip(ACTIONS, tables.mean(axis=0).tolist())),
+        'seed_tables': [dict(zip(ACTIONS, row)) for row in tables.tolist()],
+        'hyperparameters': {
+            'learning_rate': LEARNING_RATE, 'discount_factor': DISCOUNT_FACTOR,
+            'epsilon': EPSILON, 'q_threshold': Q_THRESHOLD,
+        },
+        'seeds': list(seeds),
+        'epochs': epochs,
+        'transitions': transitions,
+        'sources': list(sources),
+        'rewards_sha256': hashlib.sha256(np.ascontiguousarray(rewards).tobytes()).hexdigest(),
+        'built_at': datetime.datetime.now().isoformat(timespec='seconds'),
+    }
+
+
+def load_artifact(path, actions=ACTIONS):
+    """Read a Q-table artifact and return its {action: value} table."""
+    with open(path) as f:
+        artifact = json.load(f)
+    if artifact.get('format_version') != FORMAT_VERSION:
+        raise ValueError(f"Unsupported Q-table artifact format: {artifact.get('format_version')}")
+    if sorted(artifact['actions']) != sorted(actions):
+        raise ValueError(f"Q-table artifact actions {artifact['actions']} do not match {list(actions)}")
+    return {action: float(artifact['q_table'][action]) for action in actions}
+
+
+def install(engine, q_table):
+    """Write q_table to the application's Q-table; workers pick it up on their next refresh."""
+    metadata = MetaData()
+    values = Table('q_values', metadata, autoload_with=engine)
+    state = Table('q_table_state', metadata, autoload_with=engine)
+    QStore(engine, values, state, ACTIONS, LEARNING_RATE, DISCOUNT_FACTOR).load(q_table)
+
+
+def database_engine():
+    load_dotenv()
+    database_uri = os.getenv('DATABASE_URI')
+    if not database_uri:
+        raise SystemExit('DATABASE_URI is not set')
+    return create_engine(database_uri)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Train the treatment Q-table by replaying historical transitions.')
+    parser.add_argument('--source', nargs='+', choices=['targets', 'stages', 'reports'], default=['targets', 'stages'])
+    parser.add_argument('--reports-csv', help='read reports from a test_reports CSV export instead of the database')
+    parser.add_argument('--seeds', type=int, default=4, help='number of independent runs')
+    parser.add_argument('--first-seed', type=int, default=0)
+    parser.add_argument('--epochs', type=int, default=1, help='shuffled passes per run')
+    parser.add_argument('--workers', type=int, default=None, help='process pool size (default: CPU count)')
+    parser.add_argument('--output', default='q_table.json')
+    parser.add_argument('--install', action='store_true', help='also write the table to the application database')
+    args = parser.parse_args()
+
+    needs_database = args.install or ('reports' in args.source and not args.reports_csv)
+    engine = database_engine() if needs_database else None
+    old, new = load_transitions(args.source, args.reports_csv, engine)
+    if not len(old):
+        parser.error('no transitions found')
+    transition_rewards = rewards(old, new)
+    seeds = list(range(args.first_seed, args.first_seed + args.seeds))
+
+    start = time.perf_counter()
+    tables = train(transition_rewards, seeds, args.epochs, args.workers)
+    elapsed = time.perf_counter() - start
+    total = len(transition_rewards) * args.epochs * len(seeds)
+    print(f'Replayed {total} transitions in {elapsed:.2f}s ({total / elapsed:,.0f}/s)')
+
+    artifact = build_artifact(tables, seeds, args.epochs, len(transition_rewards), args.source, transition_rewards)
+    with open(args.output, 'w') as f:
+        json.dump(artifact, f, indent=2)
+    print(f'Wrote {args.output}: {artifact["q_table"]}')
+
+    if args.install:
+        install(engine, artifact['q_table'])
+        print('Installed into the application database')
+
+
+if __name__ == '__main__':
+    main()
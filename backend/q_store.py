@@ -0,0 +1,217 @@
+"""Persistent Q-table shared by every worker through the application database.
+
+The Q-learning update reads the current values and their max, so it cannot
+be expressed as a plain SQL increment. Instead each worker queues its
+(selected_actions, reward) events. A background thread replays them onto
+the latest stored values inside one transaction, guarded by a version
+counter (optimistic concurrency): if another worker committed first, the
+batch is replayed again on the newer values. Every event is therefore
+applied exactly once, in a serial order, as if one process owned the table.
+
+Requests never wait on a write: record() only updates the local view and
+queues the event. Reads come from an in-process copy that the same thread
+refreshes every refresh_interval seconds, with still-pending local events
+replayed on top.
+"""
+import atexit
+import logging
+import os
+import threading
+import time
+
+from sqlalchemy import bindparam, exc, select, update
+
+
+MAX_RETRIES = 10
+
+# Actions and hyperparameters of /update-treatment, shared with q_replay.py
+ACTIONS = ['adjust_sodium_limit', 'adjust_fluid_intake', 'modify_physical_activity', 'update_diet', 'restrict_alcohol']
+LEARNING_RATE = 0.1
+DISCOUNT_FACTOR = 0.9
+EPSILON = 0.2
+Q_THRESHOLD = 0.5
+
+
+def apply_q_update(q_table, selected_actions, reward, learning_rate, discount_factor):
+    """Apply one Q-learning update in place, one action at a time."""
+    reward_per_action = reward / len(selected_actions)
+    for action in selected_actions:
+        q_table[action] += learning_rate * (reward_per_action + discount_factor * max(q_table.values()) - q_table[action])
+
+
+class _VersionConflict(Exception):
+    pass
+
+
+class QStore:
+    """Database-backed Q-table with a local read cache and asynchronous batched writes."""
+
+    def __init__(self, engine, values_table, state_table, actions, learning_rate, discount_factor,
+                 refresh_interval=1.0, flush_interval=0.2, max_batch=256):
+        self.engine = engine
+        self.values_table = values_table
+        self.state_table = state_table
+        self.actions = list(actions)
+        self.learning_rate = learning_rate
+        self.discount_factor = discount_factor
+        self.refresh_interval = refresh_interval
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+
+        self.flushes = 0
+        self.conflicts = 0
+        self._pending = []
+        self._base = {action: 0.0 for action in self.actions}
+        self._view = dict(self._base)
+        self._refreshed_at = 0.0
+        self._pid = None
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+
+        self._ensure_rows()
+        self.refresh()
+        atexit.register(self.flush)
+
+    def _ensure_rows(self):
+        with self.engine.begin() as conn:
+            stored = set(conn.execute(select(self.values_table.c.action)).scalars())
+            missing = [{'action': action, 'q_value': 0.0} for action in self.actions if action not in stored]
+            has_state = conn.execute(select(self.state_table.c.id)).first() is not None
+        try:
+            with self.engine.begin() as conn:
+                if missing:
+                    conn.execute(self.values_table.insert(), missing)
+                if not has_state:
+                    conn.execute(self.state_table.insert().values(id=1, version=0))
+        except exc.IntegrityError:
+            # Another worker created them first
+            pass
+
+    def _ensure_thread(self):
+        # Started lazily so each forked Gunicorn worker gets its own flusher
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            threading.Thread(target=self._run, name='q-store-flush', daemon=True).start()
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                if self._pending:
+                    self.flush()
+                elif time.monotonic() - self._refreshed_at >= self.refresh_interval:
+                    self.refresh()
+            except Exception as e:
+                logging.error(f"Q-table flush failed, will retry: {str(e)}")
+
+    def _replay(self, base, events):
+        view = dict(base)
+        for selected_actions, reward in events:
+            apply_q_update(view, selected_actions, reward, self.learning_rate, self.discount_factor)
+        return view
+
+    def _read_values(self, conn):
+        values = {action: 0.0 for action in self.actions}
+        values.update(conn.execute(select(self.values_table.c.action, self.values_table.c.q_value)).all())
+        return values
+
+    def refresh(self):
+        """Reload the stored values and replay still-pending local events on top."""
+        with self.engine.connect() as conn:
+            base = self._read_values(conn)
+        with self._lock:
+            self._base = base
+            self._view = self._replay(base, self._pending)
+            self._refreshed_at = time.monotonic()
+
+    def snapshot(self):
+        """Current Q-values: the last stored values plus this worker's pending updates."""
+        self._ensure_thread()
+        with self._lock:
+            return dict(self._view)
+
+    def record(self, selected_actions, reward):
+        """Apply an update to the local view and queue it for the database."""
+        self._ensure_thread()
+        with self._lock:
+            self._pending.append((list(selected_actions), reward))
+            apply_q_update(self._view, selected_actions, reward, self.learning_rate, self.discount_factor)
+            if len(self._pending) >= self.max_batch:
+                self._wake.set()
+
+    def flush(self):
+        """Write every pending event to the database; safe to call from any thread."""
+        with self._flush_lock:
+            with self._lock:
+                batch = list(self._pending)
+            if not batch:
+                return
+
+            for _ in range(MAX_RETRIES):
+                try:
+                    values = self._commit_batch(batch)
+                    break
+                except _VersionConflict:
+                    self.conflicts += 1
+            else:
+                raise RuntimeError(f'Q-table flush lost {MAX_RETRIES} version races in a row')
+
+            with self._lock:
+                del self._pending[:len(batch)]
+                self._base = values
+                self._view = self._replay(values, self._pending)
+                self._refreshed_at = time.monotonic()
+            self.flushes += 1
+
+    def load(self, values, if_version=None):
+        """Replace the stored values, e.g. with an offline-trained table.
+
+        With if_version, only replace them while the stored version still
+        equals it; returns whether the values were written.
+        """
+        values = {action: float(values[action]) for action in self.actions}
+        state = self.state_table
+        with self.engine.begin() as conn:
+            version = conn.execute(select(state.c.version).where(state.c.id == 1)).scalar_one()
+            if if_version is not None and version != if_version:
+                return False
+            try:
+                self._write_values(conn, version, values)
+            except _VersionConflict:
+                return False
+        self.refresh()
+        return True
+
+    def version(self):
+        """The stored version, bumped by every committed batch or load."""
+        with self.engine.connect() as conn:
+            return conn.execute(select(self.state_table.c.version).where(self.state_table.c.id == 1)).scalar_one()
+
+    def _write_values(self, conn, version, values):
+        state = self.state_table
+        claimed = conn.execute(
+            update(state).where(state.c.id == 1, state.c.version == version).values(version=version + 1)
+        ).rowcount
+        if claimed != 1:
+            # Raising rolls the transaction back
+            raise _VersionConflict()
+        conn.execute(
+            update(self.values_table)
+            .where(self.values_table.c.action == bindparam('b_action'))
+            .values(q_value=bindparam('b_value')),
+            [{'b_action': action, 'b_value': value} for action, value in values.items()],
+        )
+
+    def _commit_batch(self, batch):
+        state = self.state_table
+        with self.engine.begin() as conn:
+            version = conn.execute(select(state.c.version).where(state.c.id == 1)).scalar_one()
+            values = self._replay(self._read_values(conn), batch)
+            self._write_values(conn, version, values)
+        return values
@@ -0,0 +1,162 @@
+"""Bulk refresh of every user's stored cluster after a new cluster model ships.
+
+UserTable.cluster_no is only written when a user calls /clustering, so
+after a model change most stored clusters are stale. This job assigns
+every user the cluster of their latest test report:
+
+- users are read in pages of --batch-rows, keyed on user_id, with the
+  latest report per user selected in SQL
+- each page goes through cluster_model.predict in one call
+- only users whose cluster changed are written, with one executemany
+  UPDATE per page
+
+Each page is its own short query instead of one cursor held open for the
+whole run, which on SQLite would lock out the UPDATEs and on PostgreSQL
+would pin one snapshot for minutes. After each committed page the last
+user_id is saved to --checkpoint,
+together with the model fingerprint. An interrupted run resumes after that
+user, and a run with a different model starts over. Users without a test
+report keep their cluster_no.
+
+Run from the backend directory, with the same DATABASE_URI as the app:
+
+    python recluster.py                          # models from ARTIFACT_DIR, or the .pkl files
+    python recluster.py --bundle artifacts/current --batch-rows 50000
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+from dotenv import load_dotenv
+from sqlalchemy import MetaData, Table, bindparam, create_engine, func, select, update
+
+from artifacts import load_model_set
+from train import CLUSTER_COLUMNS
+
+
+def new_checkpoint(fingerprint):
+    return {'fingerprint': fingerprint, 'last_user_id': 0, 'users': 0, 'changed': 0, 'complete': False}
+
+
+def load_checkpoint(path, fingerprint):
+    """The saved progress for this model, or a fresh one."""
+    try:
+        with open(path) as f:
+            checkpoint = json.load(f)
+    except FileNotFoundError:
+        checkpoint = None
+    if not checkpoint or checkpoint.get('fingerprint') != fingerprint:
+        return new_checkpoint(fingerprint)
+    return checkpoint
+
+
+def save_checkpoint(path, checkpoint):
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    # Renamed into place so an interrupted write never leaves a truncated checkpoint
+    partial = f'{path}.{os.getpid()}.tmp'
+    with open(partial, 'w') as f:
+        json.dump(checkpoint, f)
+    os.replace(partial, path)
+
+
+def latest_reports(conn, reports, users, after_user_id, batch_rows):
+    """(user_id, cluster_no, *CLUSTER_COLUMNS) of the next batch_rows users past after_user_id, by their latest report."""
+    # Served by ix_test_report_user_latest; the scan stops after batch_rows users
+    latest = (
+        select(func.max(reports.c.report_id))
+        .where(reports.c.user_id > after_user_id)
+        .group_by(reports.c.user_id)
+        .order_by(reports.c.user_id)
+        .limit(batch_rows)
+    )
+    query = (
+        select(users.c.user_id, users.c.cluster_no, *[reports.c[column] for column in CLUSTER_COLUMNS])
+        .join(reports, reports.c.user_id == users.c.user_id)
+        .where(reports.c.report_id.in_(latest))
+        .order_by(users.c.user_id)
+    )
+    return conn.execute(query).all()
+
+
+def recluster(engine, reports, users, cluster_model, checkpoint, checkpoint_path=None, batch_rows=50000):
+    """Reassign every user past the checkpoint; updates and saves checkpoint after each page."""
+    statement = (
+        update(users)
+        .where(users.c.user_id == bindparam('target_user_id'))
+        .values(cluster_no=bindparam('new_cluster_no'))
+    )
+    while True:
+        with engine.connect() as conn:
+            page = latest_reports(conn, reports, users, checkpoint['last_user_id'], batch_rows)
+        if not page:
+            break
+        user_ids = np.array([row[0] for row in page], dtype=np.int64)
+        current = np.array([-1 if row[1] is None else row[1] for row in page], dtype=np.int64)
+        features = np.array([row[2:] for row in page], dtype=np.float64)
+
+        complete = ~np.isnan(features).any(axis=1)
+        clusters = np.full(len(page), -1, dtype=np.int64)
+        if complete.any():
+            clusters[complete] = cluster_model.predict(features[complete])
+        changed = complete & (clusters != current)
+        if changed.any():
+            with engine.begin() as conn:
+                conn.execute(statement, [
+                    {'target_user_id': int(user_id), 'new_cluster_no': int(cluster)}
+                    for user_id, cluster in zip(user_ids[changed], clusters[changed])
+                ])
+
+        checkpoint['last_user_id'] = int(user_ids[-1])
+        checkpoint['users'] += len(page)
+        checkpoint['changed'] += int(changed.sum())
+        if checkpoint_path:
+            save_checkpoint(checkpoint_path, checkpoint)
+    checkpoint['complete'] = True
+    if checkpoint_path:
+        save_checkpoint(checkpoint_path, checkpoint)
+    return checkpoint
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Refresh every user's stored cluster with the current cluster model.")
+    parser.add_argument('--bundle', help='artifact bundle to take the cluster model from (default: ARTIFACT_DIR, '
+                                         'else the .pkl files)')
+    parser.add_argument('--batch-rows', type=int, default=50000, help='users per page and UPDATE')
+    parser.add_argument('--checkpoint', default=os.path.join('.cache', 'recluster.json'))
+    parser.add_argument('--restart', action='store_true', help='ignore the checkpoint and reassign every user')
+    args = parser.parse_args()
+
+    load_dotenv()
+    database_uri = os.getenv('DATABASE_URI')
+    if not database_uri:
+        raise SystemExit('DATABASE_URI is not set')
+    models = load_model_set(args.bundle or os.getenv('ARTIFACT_DIR'))
+    engine = create_engine(database_uri)
+    metadata = MetaData()
+    reports = Table('test_report', metadata, autoload_with=engine)
+    users = Table('users_table', metadata, autoload_with=engine)
+
+    if args.restart:
+        checkpoint = new_checkpoint(models.fingerprint)
+    else:
+        checkpoint = load_checkpoint(args.checkpoint, models.fingerprint)
+    if checkpoint['complete']:
+        print(f"All users were already reassigned with model {models.version or models.fingerprint[:12]}; pass --restart to redo it")
+        return 0
+    if checkpoint['last_user_id']:
+        print(f"Resuming after user_id {checkpoint['last_user_id']} ({checkpoint['users']} users done)")
+
+    start = time.perf_counter()
+    checkpoint = recluster(engine, reports, users, models.cluster_model, checkpoint, args.checkpoint, args.batch_rows)
+    print(f"Reassigned {checkpoint['users']} users, {checkpoint['changed']} changed cluster, "
+          f"in {time.perf_counter() - start:.1f}s")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
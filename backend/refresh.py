@@ -0,0 +1,209 @@
+"""Incremental model refresh from the TestReports added since the last bundle.
+
+Reads only the test_report rows past the checkpoint (the last report_id
+folded into the current bundle) through a server-side cursor, in
+--batch-rows partitions. Then:
+- cluster_model: each partition goes through MiniBatchKMeans.partial_fit.
+  A KMeans model is first converted by feeding its centers back in,
+  weighted by its cluster sizes. The centers keep their order and random
+  reassignment is off, so cluster numbers, and the treatment plans filed
+  under them, stay valid.
+- ckd_model: only updated from reports with a clinician-confirmed stage
+  in test_report.confirmed_stage (added by migrate.py 002). The stored
+  ckd_report is the model's own prediction, so training on it would add
+  trees but no information. --add-trees trees are grown on the confirmed
+  rows with warm_start. Classes missing from them get --anchor-rows rows
+  each from the stages dataset, so the forest keeps every class. Without
+  confirmed rows the classifier is carried over unchanged, and in practice
+  a refresh is a clustering update.
+- future_params, scaler and label_encoders are carried over unchanged.
+
+The result is written as a new bundle whose manifest records the new
+checkpoint. With --link, the symlink is repointed to it atomically, and
+workers serving ARTIFACT_DIR=<link> hot-swap to it (see model_watch.py).
+Work grows with the number of new rows. Only writing the bundle grows
+with model size.
+
+Run from the backend directory, with the same DATABASE_URI as the app:
+
+    python refresh.py --link artifacts/current --add-trees 10
+"""
+import argparse
+import datetime
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+from dotenv import load_dotenv
+from sklearn.cluster import KMeans, MiniBatchKMeans
+from sklearn.pipeline import Pipeline
+from sqlalchemy import MetaData, Table, create_engine, select
+
+from artifacts import ArtifactStore, save_artifacts
+from encoding import CATEGORICAL_COLUMNS, compile_encoders, encode_column
+from ingest import MEDICAL_COLUMNS, REPORT_COLUMNS, prepare_chunk
+from model_watch import publish
+from train import CLUSTER_COLUMNS, NON_FEATURE_COLUMNS, STAGE_COLUMN, STAGES_CSV, grow_forest
+
+
+# Clinician-confirmed stage; ckd_report holds the model's own prediction and is never a label
+LABEL_COLUMN = 'confirmed_stage'
+# Columns of prepare_chunk's feature matrix that /clustering passes to the cluster model
+CLUSTER_INDEX = [MEDICAL_COLUMNS.index(column) for column in CLUSTER_COLUMNS]
+
+
+def stream_reports(engine, table, after_id, batch_rows):
+    """Yield lists of report dicts with report_id > after_id, in id order, over a server-side cursor.
+
+    Each dict has the LABEL_COLUMN value, None when the table has no such column.
+    """
+    labels = [table.c[LABEL_COLUMN]] if LABEL_COLUMN in table.c else []
+    query = (
+        select(table.c.report_id, *labels, *[table.c[column] for column in REPORT_COLUMNS])
+        .where(table.c.report_id > after_id)
+        .order_by(table.c.report_id)
+    )
+    with engine.connect().execution_options(stream_results=True, yield_per=batch_rows) as conn:
+        for partition in conn.execute(query).partitions():
+            yield [{LABEL_COLUMN: None, **row._mapping} for row in partition]
+
+
+def online_kmeans(model, seed):
+    """Split a cluster model into (preprocessing or None, MiniBatchKMeans ready for partial_fit)."""
+    preprocessor, kmeans = (model[:-1], model[-1]) if isinstance(model, Pipeline) else (None, model)
+    if isinstance(kmeans, KMeans):
+        centers = kmeans.cluster_centers_
+        sizes = np.bincount(kmeans.labels_, minlength=len(centers)) if hasattr(kmeans, 'labels_') else None
+        kmeans = MiniBatchKMeans(
+            n_clusters=len(centers), init=centers, n_init=1, reassignment_ratio=0.0, random_state=seed,
+        )
+        # Each center is its own nearest point, so this keeps the centers and sets the counts to the sizes
+        kmeans.partial_fit(centers, sample_weight=sizes)
+    return preprocessor, kmeans
+
+
+def anchor_rows(classes, per_class, tables, seed, path=STAGES_CSV):
+    """per_class encoded dataset rows for each of classes, as (features, labels)."""
+    dataset = pd.read_csv(path)
+    sample = pd.concat([
+        rows.sample(min(per_class, len(rows)), random_state=seed)
+        for rows in (dataset[dataset[STAGE_COLUMN] == stage] for stage in classes)
+    ])
+    features = sample.drop(columns=NON_FEATURE_COLUMNS)
+    for column in CATEGORICAL_COLUMNS:
+        features[column] = encode_column(tables, column, features[column].tolist())
+    return features.to_numpy(dtype=np.float64), sample[STAGE_COLUMN].to_numpy()
+
+
+def refresh(store, engine, table, add_trees=10, batch_rows=5000, anchor_per_class=5, jobs=-1, seed=42):
+    """Fold the reports past the store's checkpoint into its models.
+
+    Returns (models, summary), or (None, summary) when there is nothing new.
+    """
+    training = store.manifest.get('training', {})
+    checkpoint = training.get('refresh', {}).get('last_report_id', 0)
+    label_encoders = store.load('label_encoders')
+    scaler = store.load('scaler')
+    tables = compile_encoders(label_encoders)
+    preprocessor, kmeans = online_kmeans(store.load('cluster_model', mmap=False), seed)
+
+    summary = {'base_version': store.version, 'from_report_id': checkpoint, 'last_report_id': checkpoint,
+               'rows': 0, 'invalid_rows': 0, 'labelled_rows': 0, 'anchor_rows': 0, 'added_trees': 0}
+    features, labels = [], []
+    for records in stream_reports(engine, table, checkpoint, batch_rows):
+        summary['rows'] += len(records)
+        summary['last_report_id'] = records[-1]['report_id']
+        _, chunk, invalid = prepare_chunk(records, tables)
+        summary['invalid_rows'] += len(invalid)
+        if not len(chunk):
+            continue
+        cluster_rows = chunk[:, CLUSTER_INDEX]
+        kmeans.partial_fit(preprocessor.transform(cluster_rows) if preprocessor is not None else cluster_rows)
+
+        invalid_positions = {i for i, _ in invalid}
+        stages = [record[LABEL_COLUMN] for i, record in enumerate(records) if i not in invalid_positions]
+        labelled = np.array([stage is not None for stage in stages], dtype=bool)
+        features.append(chunk[labelled])
+        labels.append(np.array([stage for stage in stages if stage is not None], dtype=np.int64))
+
+    if not summary['rows']:
+        return None, summary
+
+    ckd_model = store.load('ckd_model', mmap=False)
+    features = np.vstack(features) if features else np.empty((0, len(scaler.mean_)))
+    labels = np.concatenate(labels) if labels else np.empty(0, dtype=np.int64)
+    # A stage the forest was never trained on cannot be added by new trees
+    known = np.isin(labels, ckd_model.classes_)
+    features, labels = features[known], labels[known]
+    summary['labelled_rows'] = int(len(labels))
+    if add_trees and len(labels):
+        missing = sorted(set(ckd_model.classes_.tolist()) - set(labels.tolist()))
+        if missing:
+            anchors, anchor_labels = anchor_rows(missing, anchor_per_class, tables, seed)
+            features, labels = np.vstack([features, anchors]), np.concatenate([labels, anchor_labels])
+            summary['anchor_rows'] = int(len(anchor_labels))
+        grow_forest(ckd_model, scaler.transform(features), labels, add_trees, jobs)
+        summary['added_trees'] = add_trees
+    summary['n_estimators'] = ckd_model.n_estimators
+
+    cluster_model = Pipeline([*preprocessor.steps, ('kmeans', kmeans)]) if preprocessor is not None else kmeans
+    models = {
+        'ckd_model': ckd_model,
+        'future_params': store.load('future_params'),
+        'cluster_model': cluster_model,
+        'scaler': scaler,
+        'label_encoders': label_encoders,
+    }
+    return models, summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Fold newly collected test reports into the current model bundle.')
+    parser.add_argument('--bundle', help='bundle to refresh (default: --link, or ARTIFACT_DIR)')
+    parser.add_argument('--link', help='symlink to repoint at the new bundle, e.g. artifacts/current')
+    parser.add_argument('--version', default=datetime.datetime.now().strftime('%Y%m%d%H%M%S'))
+    parser.add_argument('--output', help="new bundle directory (default: <version> next to the base bundle)")
+    parser.add_argument('--add-trees', type=int, default=10, help='trees to grow on the new confirmed-stage reports; 0 skips the classifier')
+    parser.add_argument('--anchor-rows', type=int, default=5, help='dataset rows per class missing from the new reports')
+    parser.add_argument('--batch-rows', type=int, default=5000, help='rows fetched per cursor partition')
+    parser.add_argument('--jobs', type=int, default=-1, help='cores for growing the trees')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    load_dotenv()
+    base = args.bundle or args.link or os.getenv('ARTIFACT_DIR')
+    if not base:
+        parser.error('pass --bundle or --link, or set ARTIFACT_DIR')
+    database_uri = os.getenv('DATABASE_URI')
+    if not database_uri:
+        raise SystemExit('DATABASE_URI is not set')
+    engine = create_engine(database_uri)
+    table = Table('test_report', MetaData(), autoload_with=engine)
+    store = ArtifactStore(os.path.realpath(base))
+
+    start = time.perf_counter()
+    models, summary = refresh(store, engine, table, args.add_trees, args.batch_rows, args.anchor_rows, args.jobs,
+                              args.seed)
+    if models is None:
+        print(f"No reports after report_id {summary['from_report_id']}; {store.version} is current")
+        return 0
+    print(f"Read {summary['rows']} new reports ({summary['invalid_rows']} invalid, "
+          f"{summary['labelled_rows']} with a confirmed stage), added {summary['added_trees']} trees "
+          f"in {time.perf_counter() - start:.2f}s")
+    if not summary['labelled_rows']:
+        print(f'No confirmed stages in test_report.{LABEL_COLUMN}; the classifier is unchanged')
+
+    output = args.output or os.path.join(os.path.dirname(store.directory), args.version)
+    metadata = dict(store.manifest.get('training', {}), refresh=summary)
+    save_artifacts(models, output, args.version, metadata=metadata)
+    print(f"Wrote bundle {args.version} to {output} (checkpoint report_id {summary['last_report_id']})")
+    if args.link:
+        publish(output, args.link)
+        print(f'{args.link} -> {output}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,60 @@
+import os
+import sys
+import threading
+
+import pytest
+
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATA_DIR = os.path.join(BACKEND_DIR, '..', 'CKD_Historical')
+
+# Column values of one TestReports row
+REPORT = dict(
+    serum_creatinine=3.8, gfr=25.0, bun=140.0, serum_calcium=8.3, ana=True, c3_c4=24.0, hematuria=True,
+    oxalate_levels=4.8, urine_ph=4.9, blood_pressure=130.0, gender='Male', age=50, physical_activity='weekly',
+    diet='balanced', family_history='no', water_intake=2.0, smoking='no', alcohol_consumption='occasionally',
+    painkiller_usage='no', stress_level='moderate', weight_changes='stable',
+    ckd_report='Patient has CKD. Stage: 4',
+)
+
+sys.path.insert(0, BACKEND_DIR)
+
+
+@pytest.fixture(scope='session')
+def main(tmp_path_factory):
+    """The app module, imported against a throwaway SQLite database and the .pkl models."""
+    os.environ['DATABASE_URI'] = f"sqlite:///{tmp_path_factory.mktemp('app') / 'app.db'}"
+    os.environ.setdefault('SECRET_KEY', 'tests-' + 'x' * 32)
+    os.environ['PREDICTION_CACHE'] = 'off'
+    os.environ.pop('ARTIFACT_DIR', None)
+    os.environ.pop('PATIENT_INDEX_DIR', None)
+    # Periodic version and revocation checks would land in arbitrary requests
+    os.environ['PLAN_CACHE_CHECK_INTERVAL'] = '3600'
+    os.environ['AUTH_REVOCATION_CHECK_INTERVAL'] = '3600'
+    # The models are loaded from the working directory
+    os.chdir(BACKEND_DIR)
+    import main
+    return main
+
+
+@pytest.fixture
+def count_queries(main):
+    """Statements sent by this thread, recorded while the fixture is active.
+
+    The Q-store's background thread shares the engine, so its flushes are
+    left out.
+    """
+    from sqlalchemy import event
+
+    with main.app.app_context():
+        engine = main.db.engine
+    thread = threading.get_ident()
+    statements = []
+
+    def count(conn, cursor, statement, parameters, context, executemany):
+        if threading.get_ident() == thread:
+            statements.append(' '.join(statement.split()))
+
+    event.listen(engine, 'before_cursor_execute', count)
+    yield statements
+    event.remove(engine, 'before_cursor_execute', count)
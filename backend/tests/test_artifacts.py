@@ -0,0 +1,39 @@
+import os
+import pickle
+import warnings
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from conftest import BACKEND_DIR
+from artifacts import PICKLES, ArtifactError, load_model_set
+from train import CLUSTER_COLUMNS, CLUSTER_CSV
+
+
+@pytest.fixture(autouse=True)
+def quiet_version_warnings():
+    with warnings.catch_warnings():
+        warnings.filterwarnings('ignore', category=UserWarning)
+        yield
+
+
+def test_legacy_cluster_model_takes_raw_lab_values():
+    cluster_model = load_model_set(source=BACKEND_DIR).cluster_model
+    raw = pd.read_csv(CLUSTER_CSV, usecols=CLUSTER_COLUMNS)[CLUSTER_COLUMNS].to_numpy(dtype=np.float64)
+    sizes = np.bincount(cluster_model.predict(raw), minlength=7)
+    # A bare KMeans on raw values put every patient in one cluster
+    assert (sizes > 0).all()
+
+
+def test_bare_kmeans_is_refused(tmp_path):
+    for name, filename in PICKLES.items():
+        os.symlink(os.path.join(BACKEND_DIR, filename), tmp_path / filename)
+    with open(os.path.join(BACKEND_DIR, PICKLES['cluster_model']), 'rb') as f:
+        kmeans = pickle.load(f)[-1]
+    os.unlink(tmp_path / PICKLES['cluster_model'])
+    with open(tmp_path / PICKLES['cluster_model'], 'wb') as f:
+        pickle.dump(kmeans, f)
+
+    with pytest.raises(ArtifactError, match='bare KMeans'):
+        load_model_set(source=str(tmp_path))
@@ -0,0 +1,98 @@
+import threading
+import time
+
+import numpy as np
+
+from coalescer import Coalescer
+
+
+def double(rows):
+    return rows[:, 0] * 2
+
+
+def test_coalesced_call_is_counted():
+    coalescer = Coalescer(double, max_batch=4, max_wait=0.001)
+    assert coalescer.submit(np.array([[1.0]])) == [2.0]
+    assert (coalescer.calls, coalescer.bypassed) == (1, 0)
+
+
+def test_large_call_is_counted_as_bypassed():
+    coalescer = Coalescer(double, max_batch=4, max_wait=0.001)
+    assert coalescer.submit(np.ones((4, 1))) == [2.0] * 4
+    stats = coalescer.stats()
+    assert (stats['calls'], stats['batches'], stats['bypassed']) == (0, 0, 1)
+
+
+def test_every_call_is_bypassed_with_coalescing_off():
+    coalescer = Coalescer(double, max_batch=4, max_wait=0)
+    coalescer.submit(np.ones((1, 1)))
+    coalescer.submit(np.ones((1, 1)))
+    assert (coalescer.calls, coalescer.bypassed) == (0, 2)
+
+
+def test_concurrent_submits_share_one_call():
+    release = threading.Event()
+    matrices = []
+
+    def blocking_double(rows):
+        matrices.append(rows)
+        if len(matrices) == 1:
+            release.wait(5)
+        return rows[:, 0] * 2
+
+    # Row counts of the callers that queue up behind the first call
+    sizes = [1, 2, 1, 3, 1]
+    coalescer = Coalescer(blocking_double, max_batch=sum(sizes), max_wait=5)
+    results = {}
+
+    def submit(caller, rows):
+        results[caller] = coalescer.submit(rows)
+
+    first = threading.Thread(target=submit, args=('first', np.array([[0.5]])))
+    first.start()
+    while not matrices:
+        time.sleep(0.001)
+    rows = {i: np.arange(size, dtype=float)[:, None] + 10 * (i + 1) for i, size in enumerate(sizes)}
+    threads = [threading.Thread(target=submit, args=(i, rows[i])) for i in rows]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    release.set()
+    first.join()
+
+    # The queued callers filled one batch while the first call was running
+    assert [len(matrix) for matrix in matrices] == [1, sum(sizes)]
+    assert results['first'] == [1.0]
+    for i in rows:
+        assert results[i] == list(rows[i][:, 0] * 2)
+    assert (coalescer.calls, coalescer.batches, coalescer.bypassed) == (len(sizes) + 1, 2, 0)
+
+
+def test_concurrent_callers_get_their_own_rows():
+    calls = []
+
+    def slow_double(rows):
+        calls.append(len(rows))
+        time.sleep(0.002)
+        return rows[:, 0] * 2
+
+    coalescer = Coalescer(slow_double, max_batch=16, max_wait=0.005)
+    mismatches = []
+
+    def caller(thread):
+        for call in range(40):
+            size = 1 + (thread + call) % 3
+            rows = np.full((size, 2), thread * 1000.0 + call)
+            if coalescer.submit(rows) != [(thread * 1000.0 + call) * 2] * size:
+                mismatches.append((thread, call))
+
+    threads = [threading.Thread(target=caller, args=(thread,)) for thread in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert mismatches == []
+    assert coalescer.calls == 8 * 40
+    assert len(calls) == coalescer.batches < coalescer.calls
@@ -0,0 +1,126 @@
+"""The flat forest engine must give sklearn's predictions bit for bit on the CKD_Historical datasets."""
+import os
+import pickle
+import warnings
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from conftest import BACKEND_DIR, DATA_DIR
+from artifacts import ArtifactStore, save_artifacts
+from encoding import CATEGORICAL_COLUMNS, compile_encoders, encode_column
+from forest_engine import FlatColumnTransformer, load_engine
+
+
+# Rows also predicted one at a time, through the single-row walk
+SINGLE_ROWS = 50
+
+
+def load_pickle(name):
+    with open(os.path.join(BACKEND_DIR, name), 'rb') as f:
+        return pickle.load(f)
+
+
+@pytest.fixture(scope='module', autouse=True)
+def quiet_feature_name_warnings():
+    with warnings.catch_warnings():
+        warnings.filterwarnings('ignore', category=UserWarning)
+        yield
+
+
+@pytest.fixture(scope='module')
+def ckd_model():
+    return load_pickle('ckd_model.pkl')
+
+
+@pytest.fixture(scope='module')
+def param_model():
+    return load_pickle('future_params.pkl')
+
+
+@pytest.fixture(scope='module')
+def X_stages():
+    scaler = load_pickle('scaler.pkl')
+    tables = compile_encoders(load_pickle('label_encoders.pkl'))
+    stages = pd.read_csv(os.path.join(DATA_DIR, 'updated_ckd_dataset_with_stages.csv'))
+    for col in CATEGORICAL_COLUMNS:
+        stages[col] = encode_column(tables, col, stages[col].tolist())
+    return scaler.transform(stages.drop(columns=['ckd_pred', 'ckd_stage', 'months', 'cluster']).to_numpy())
+
+
+@pytest.fixture(scope='module')
+def X_targets(param_model):
+    targets = pd.read_csv(os.path.join(DATA_DIR, 'medical_lifestyle_with_targets.csv'))
+    return targets[list(param_model.feature_names_in_)]
+
+
+def assert_identical(expected, actual):
+    assert expected.dtype == actual.dtype
+    assert np.array_equal(expected, actual)
+
+
+def test_ckd_model_is_identical(ckd_model, X_stages):
+    flat = load_engine(ckd_model, 'flat')
+    assert_identical(ckd_model.predict(X_stages), flat.predict(X_stages))
+    assert_identical(ckd_model.predict_proba(X_stages), flat.predict_proba(X_stages))
+
+
+def test_ckd_model_single_rows_are_identical(ckd_model, X_stages):
+    flat = load_engine(ckd_model, 'flat')
+    for i in range(SINGLE_ROWS):
+        row = X_stages[i:i + 1]
+        assert_identical(ckd_model.predict_proba(row), flat.predict_proba(row))
+
+
+def test_future_params_is_identical(param_model, X_targets):
+    flat = load_engine(param_model, 'flat')
+    assert flat.compiled is not None
+    assert_identical(param_model.predict(X_targets), flat.predict(X_targets))
+
+
+def test_future_params_single_rows_are_identical(param_model, X_targets):
+    flat = load_engine(param_model, 'flat')
+    for i in range(SINGLE_ROWS):
+        row = X_targets[i:i + 1]
+        assert_identical(param_model.predict(row), flat.predict(row))
+
+
+def test_compiled_preprocessor_matches_column_transformer(param_model, X_targets):
+    compiled = load_engine(param_model, 'flat').compiled
+    assert_identical(param_model[:-1].transform(X_targets), compiled.transform(X_targets))
+    # Columns are looked up by name, not position
+    shuffled = X_targets[list(reversed(X_targets.columns))]
+    assert_identical(param_model[:-1].transform(X_targets), compiled.transform(shuffled))
+
+
+def test_compiled_preprocessor_rejects_unknown_categories(param_model, X_targets):
+    compiled = load_engine(param_model, 'flat').compiled
+    row = X_targets[:1].copy()
+    row['diet'] = 'keto'
+    with pytest.raises(ValueError, match='keto'):
+        compiled.transform(row)
+
+
+def test_unsupported_preprocessor_is_not_compiled(ckd_model):
+    assert not FlatColumnTransformer.supports(ckd_model)
+
+
+def test_artifact_bundle_is_identical(tmp_path, ckd_model, param_model, X_stages, X_targets):
+    save_artifacts({'ckd_model': ckd_model, 'future_params': param_model}, tmp_path, 'test')
+    store = ArtifactStore(str(tmp_path))
+    assert_identical(ckd_model.predict_proba(X_stages), store.load_model('ckd_model', 'flat').predict_proba(X_stages))
+    flat = store.load_model('future_params', 'flat')
+    assert flat.compiled is not None
+    assert_identical(param_model.predict(X_targets), flat.predict(X_targets))
+
+
+def test_bundle_maps_the_single_row_arrays(tmp_path, ckd_model, X_stages):
+    save_artifacts({'ckd_model': ckd_model}, tmp_path, 'test')
+    flat = ArtifactStore(str(tmp_path)).load_model('ckd_model', 'flat')
+    # Read-only views of the mapped files, shared through the page cache instead of built per worker
+    for array in flat._single_row_arrays():
+        assert isinstance(array.base, np.memmap) and not array.flags.writeable
+    for i in range(SINGLE_ROWS):
+        row = X_stages[i:i + 1]
+        assert_identical(ckd_model.predict_proba(row), flat.predict_proba(row))
@@ -0,0 +1,125 @@
+"""Validation and chunked loading of bulk report ingest."""
+import io
+import json
+
+import pytest
+
+from ingest import Ingester, prepare_chunk
+
+# A valid record as a TestReports CSV export writes it
+RECORD = dict(
+    serum_creatinine='3.8', gfr='25', bun='140', serum_calcium='8.3', ana='1', c3_c4='24', hematuria='0',
+    oxalate_levels='4.8', urine_ph='4.9', blood_pressure='130', age='50', diet='low salt',
+)
+HEADER = ['user_id'] + list(RECORD)
+
+
+@pytest.fixture
+def tables(main):
+    return main.models.encoding_tables
+
+
+def csv_stream(records):
+    lines = [','.join(HEADER)] + [','.join(str(record.get(column, '')) for column in HEADER) for record in records]
+    return io.StringIO('\n'.join(lines) + '\n')
+
+
+@pytest.mark.parametrize('true, false', [
+    ('true', 'false'), ('True', 'False'), ('t', 'f'), ('T', 'F'), ('yes', 'no'), ('1', '0'), (True, False),
+])
+def test_boolean_spellings(tables, true, false):
+    rows, features, errors = prepare_chunk([dict(RECORD, ana=true, hematuria=false)], tables)
+    assert errors == []
+    assert (bool(rows['ana'][0]), bool(rows['hematuria'][0])) == (True, False)
+    assert (features[0, 4], features[0, 6]) == (1.0, 0.0)
+
+
+def test_bad_rows_are_reported_and_skipped(tables):
+    records = [
+        RECORD,
+        dict(RECORD, gfr=''),
+        dict(RECORD, ana='maybe'),
+        dict(RECORD, diet='keto'),
+        dict(RECORD, age='fifty'),
+        dict(RECORD, bun='140', gfr='30'),
+    ]
+    rows, features, errors = prepare_chunk(records, tables)
+    assert errors == [(1, 'missing gfr'), (2, "invalid ana: 'maybe'"), (3, "unknown diet: 'keto'"),
+                      (4, "invalid age: 'fifty'")]
+    assert list(rows['gfr']) == [25.0, 30.0]
+    assert features.shape == (2, 19)
+    # Optional columns take the /predict defaults
+    assert rows['gender'][0] == 'Male' and rows['stress_level'][0] == 'moderate'
+
+
+@pytest.fixture
+def ingest(main):
+    with main.app.app_context():
+        scored = []
+
+        def score(features):
+            scored.append(len(features))
+            return ['Patient has CKD. Stage: 4'] * len(features)
+
+        def run(stream, fmt='csv', chunk_rows=2, **options):
+            ingester = Ingester(main.db, main.TestReports, main.models.encoding_tables, score, chunk_rows=chunk_rows)
+            return ingester.run(stream, fmt, **options), scored
+        yield run
+
+
+def report_count(main):
+    return main.db.session.query(main.TestReports).count()
+
+
+def test_bad_rows_across_chunk_boundaries(main, ingest):
+    records = [
+        dict(RECORD, user_id=1),
+        dict(RECORD, user_id=1, gfr='x'),
+        dict(RECORD, user_id=1, ana='false'),
+        dict(RECORD),
+        dict(RECORD, user_id=1, hematuria='TRUE'),
+    ]
+    before = report_count(main)
+    summary, scored = ingest(csv_stream(records))
+    assert (summary['rows'], summary['chunks'], summary['inserted'], summary['failed']) == (5, 3, 3, 2)
+    # CSV line numbers count the header
+    assert summary['errors'] == [{'line': 3, 'error': "invalid gfr: 'x'"}, {'line': 5, 'error': 'missing user_id'}]
+    assert scored == [1, 1, 1]
+    assert report_count(main) == before + 3
+
+
+def test_failed_chunk_leaves_the_other_chunks(main):
+    calls = []
+
+    def score(features):
+        calls.append(len(features))
+        if len(calls) == 2:
+            raise ValueError('model unavailable')
+        return ['Patient has CKD. Stage: 4'] * len(features)
+
+    with main.app.app_context():
+        before = report_count(main)
+        ingester = Ingester(main.db, main.TestReports, main.models.encoding_tables, score, chunk_rows=2)
+        summary = ingester.run(csv_stream([dict(RECORD, user_id=1)] * 5), 'csv')
+        assert report_count(main) == before + 3
+    assert (summary['inserted'], summary['failed']) == (3, 2)
+    assert [error['line'] for error in summary['errors']] == [4, 5]
+    assert summary['errors'][0]['error'] == 'chunk not saved: model unavailable'
+
+
+def test_ndjson_with_user_id_override(main, ingest):
+    lines = [json.dumps(dict(RECORD, ana=True, hematuria=False)), '', 'not json', json.dumps([1]),
+             json.dumps(dict(RECORD, ana='f'))]
+    summary, _ = ingest(io.StringIO('\n'.join(lines) + '\n'), 'ndjson', chunk_rows=3, user_id=1)
+    assert (summary['inserted'], summary['failed']) == (2, 2)
+    assert [error['line'] for error in summary['errors']] == [3, 4]
+    assert summary['errors'][1]['error'] == 'expected a JSON object'
+    latest = main.db.session.query(main.TestReports).order_by(main.TestReports.report_id.desc()).limit(2).all()
+    assert [(report.ana, report.hematuria) for report in latest] == [(False, False), (True, False)]
+
+
+def test_error_list_is_truncated(main):
+    with main.app.app_context():
+        ingester = Ingester(main.db, main.TestReports, main.models.encoding_tables, None, max_errors=2)
+        summary = ingester.run(csv_stream([dict(RECORD, gfr='x')] * 4), 'csv', user_id=1)
+    assert (summary['failed'], len(summary['errors']), summary['errors_truncated']) == (4, 2, True)
@@ -0,0 +1,86 @@
+"""Idempotency and claim ownership of the asynchronous /predict job queue."""
+import pytest
+from sqlalchemy import update
+
+from conftest import REPORT
+from jobs import DONE, QUEUED, RUNNING, IdempotencyKeyReused
+
+
+@pytest.fixture
+def app_context(main):
+    with main.app.app_context():
+        main.PredictionJob.query.delete()
+        main.db.session.commit()
+        yield
+
+
+@pytest.fixture
+def user_id(main, app_context):
+    user = main.UserTable(name='jobs', email=f'jobs-{main.UserTable.query.count()}@example.com', password='x')
+    main.db.session.add(user)
+    main.db.session.commit()
+    return user.user_id
+
+
+def save_report(main):
+    """A predict stand-in that stages a test report, like predict_report."""
+    def predict(user_id, data, with_trajectory):
+        main.db.session.add(main.TestReports(user_id=user_id, **REPORT))
+        return {'ckd_report': REPORT['ckd_report']}
+    return predict
+
+
+def test_idempotency_key_maps_to_the_same_job(main, user_id):
+    job, created = main.job_queue.enqueue(user_id, {'gfr': 25.0}, False, 'key-1')
+    again, created_again = main.job_queue.enqueue(user_id, {'gfr': 25.0}, False, 'key-1')
+    assert created and not created_again
+    assert again.job_id == job.job_id
+
+
+def test_idempotency_key_with_another_payload_is_refused(main, user_id):
+    main.job_queue.enqueue(user_id, {'gfr': 25.0}, False, 'key-2')
+    with pytest.raises(IdempotencyKeyReused):
+        main.job_queue.enqueue(user_id, {'gfr': 30.0}, False, 'key-2')
+
+
+def test_claimed_job_completes(main, user_id):
+    job, _ = main.job_queue.enqueue(user_id, {'gfr': 25.0}, False)
+    claimed = main.job_queue.claim('worker-a')
+    assert claimed.job_id == job.job_id
+    reports = main.TestReports.query.filter_by(user_id=user_id).count()
+
+    main.job_queue.run(claimed, save_report(main))
+
+    assert main.db.session.get(main.PredictionJob, job.job_id).status == DONE
+    assert main.TestReports.query.filter_by(user_id=user_id).count() == reports + 1
+
+
+def test_job_taken_over_by_another_worker_saves_nothing(main, user_id):
+    job, _ = main.job_queue.enqueue(user_id, {'gfr': 25.0}, False)
+    stale = main.job_queue.claim('worker-a')
+    reports = main.TestReports.query.filter_by(user_id=user_id).count()
+    # worker-a's lease ran out and worker-b claimed the job again
+    with main.db.engine.begin() as conn:
+        conn.execute(
+            update(main.PredictionJob.__table__)
+            .where(main.PredictionJob.__table__.c.job_id == job.job_id)
+            .values(worker='worker-b', attempts=stale.attempts + 1)
+        )
+
+    main.job_queue.run(stale, save_report(main))
+
+    row = main.db.session.get(main.PredictionJob, job.job_id, populate_existing=True)
+    assert (row.status, row.worker) == (RUNNING, 'worker-b')
+    assert main.TestReports.query.filter_by(user_id=user_id).count() == reports
+
+
+def test_failed_attempt_is_requeued(main, user_id):
+    job, _ = main.job_queue.enqueue(user_id, {'gfr': 25.0}, False)
+    claimed = main.job_queue.claim('worker-a')
+
+    def fail(user_id, data, with_trajectory):
+        raise RuntimeError('model unavailable')
+    main.job_queue.run(claimed, fail)
+
+    row = main.db.session.get(main.PredictionJob, job.job_id, populate_existing=True)
+    assert (row.status, row.error) == (QUEUED, 'model unavailable')
@@ -0,0 +1,34 @@
+from metrics import Metrics
+
+
+def test_errors_are_counted_by_endpoint():
+    metrics = Metrics()
+    metrics.count_error('predict')
+    metrics.count_error('predict')
+    metrics.count_error('select_treatment')
+    lines = metrics.render().splitlines()
+    assert '# TYPE nephrosense_request_errors_total counter' in lines
+    assert 'nephrosense_request_errors_total{endpoint="predict"} 2' in lines
+    assert 'nephrosense_request_errors_total{endpoint="select_treatment"} 1' in lines
+
+
+def test_disabled_metrics_count_nothing():
+    metrics = Metrics(enabled=False)
+    metrics.count_error('predict')
+    assert 'endpoint="predict"' not in metrics.render()
+
+
+def test_clustering_failure_is_counted(main, monkeypatch):
+    with main.app.app_context():
+        user = main.UserTable(name='m', email='metrics-clustering@example.com', password='x')
+        main.db.session.add(user)
+        main.db.session.commit()
+        token = main.generate_token(user.user_id)
+
+    def fail(user_id):
+        raise RuntimeError('database unavailable')
+
+    monkeypatch.setattr(main, 'latest_report_id', fail)
+    response = main.app.test_client().post('/clustering', headers={'Authorization': f'Bearer {token}'})
+    assert response.status_code == 500
+    assert 'nephrosense_request_errors_total{endpoint="cluster"} 1' in main.metrics.render().splitlines()
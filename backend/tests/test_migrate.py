@@ -0,0 +1,73 @@
+import pytest
+from sqlalchemy import create_engine, inspect, text
+
+import migrate
+
+# The tables as the app created them before any migration
+BASELINE_SCHEMA = [
+    'CREATE TABLE users_table (user_id INTEGER PRIMARY KEY, name VARCHAR(100) NOT NULL)',
+    'CREATE TABLE final_treatment_plans (id INTEGER PRIMARY KEY, cluster INTEGER, gfr FLOAT)',
+    'CREATE TABLE test_report (report_id INTEGER PRIMARY KEY, user_id INTEGER NOT NULL, gfr FLOAT NOT NULL)',
+    'CREATE TABLE final_selected_plan (key INTEGER PRIMARY KEY, user_id INTEGER, plan_id INTEGER)',
+]
+
+
+@pytest.fixture
+def engine(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'migrate.db'}")
+    yield engine
+    engine.dispose()
+
+
+def baseline(engine):
+    with engine.begin() as conn:
+        for statement in BASELINE_SCHEMA:
+            conn.execute(text(statement))
+
+
+def run_migrate(engine):
+    migrate.ensure_table(engine)
+    migrate.upgrade(engine)
+    return migrate.applied(engine)
+
+
+def columns(engine, table):
+    return {column['name'] for column in inspect(engine).get_columns(table)}
+
+
+def assert_migrated(engine):
+    assert run_migrate(engine) == {migration[0] for migration in migrate.MIGRATIONS}
+    assert 'confirmed_stage' in columns(engine, 'test_report')
+    # Running again is a no-op
+    assert run_migrate(engine) == {migration[0] for migration in migrate.MIGRATIONS}
+
+
+def test_baseline_database(engine):
+    baseline(engine)
+    assert_migrated(engine)
+    assert not inspect(engine).has_table('plan_rank_index')
+    assert 'ix_test_report_user_latest' in {index['name'] for index in inspect(engine).get_indexes('test_report')}
+
+
+def test_database_created_by_the_app(main, engine):
+    main.db.metadata.create_all(engine)
+    assert_migrated(engine)
+    assert 'plans_version' in columns(engine, 'plan_rank_index')
+
+
+def test_baseline_database_after_the_app_started(main, engine):
+    baseline(engine)
+    # create_all adds the new tables, but leaves test_report without confirmed_stage
+    main.db.metadata.create_all(engine)
+    assert 'confirmed_stage' not in columns(engine, 'test_report')
+    assert_migrated(engine)
+    assert 'plans_version' in columns(engine, 'plan_rank_index')
+
+
+def test_rollback_drops_the_column(engine):
+    baseline(engine)
+    run_migrate(engine)
+    migrate.rollback(engine, '002_test_report_confirmed_stage')
+    assert 'confirmed_stage' not in columns(engine, 'test_report')
+    migrate.rollback(engine, '003_plan_rank_index_plans_version')
+    assert '003_plan_rank_index_plans_version' not in migrate.applied(engine)
@@ -0,0 +1,69 @@
+import pytest
+
+from plan_index import build_index
+
+
+@pytest.fixture
+def app_context(main):
+    with main.app.app_context():
+        yield
+
+
+@pytest.fixture
+def tables(main):
+    return {
+        'plans': main.FinalTreatmentPlan.__table__,
+        'reports': main.TestReports.__table__,
+        'index': main.PlanRankIndex.__table__,
+        'version': main.PlanCacheVersion.__table__,
+    }
+
+
+def add_plans(main, cluster, n):
+    plans = [
+        main.FinalTreatmentPlan(
+            cluster=cluster, sodium_int=2.0, fluid_int=2.0, physical_activity='walk', diet='renal',
+            alcohol_limit='none', serum_creatinine=-0.1 * i, gfr=1.0 + i, bun=-1.0 * i, serum_calcium=0.1,
+            oxalate_levels=5.0, urine_ph=0.1, blood_pressure=-1.0 * i,
+        )
+        for i in range(n)
+    ]
+    main.db.session.add_all(plans)
+    main.db.session.commit()
+    return plans
+
+
+def index_of(main, cluster):
+    return main.plan_cache.plans_for(cluster).index
+
+
+def build(main, tables, full=False):
+    rebuilt = build_index(main.db.engine, tables, main.models.cluster_model, 3, full=full)
+    # Workers see the version bump within PLAN_CACHE_CHECK_INTERVAL, which the tests set to an hour
+    main.plan_cache.invalidate()
+    return rebuilt
+
+
+def test_plan_change_disables_the_index_until_the_next_build(main, app_context, tables):
+    add_plans(main, 0, 10)
+    changed = add_plans(main, 1, 10)
+
+    build(main, tables, full=True)
+    assert index_of(main, 0) is not None and index_of(main, 1) is not None
+
+    changed[0].gfr = 50.0
+    main.db.session.commit()
+    # Cluster 0's plans are unchanged, but the index predates the new plan_cache_version
+    assert index_of(main, 0) is None and index_of(main, 1) is None
+
+    rebuilt = build(main, tables)
+    assert [cluster for cluster, _, _ in rebuilt] == [1]
+    assert index_of(main, 0) is not None and index_of(main, 1) is not None
+
+
+def test_build_without_changes_publishes_nothing(main, app_context, tables):
+    build(main, tables)
+    version = main.db.session.get(main.PlanCacheVersion, 1, populate_existing=True).version
+
+    assert build(main, tables) == []
+    assert main.db.session.get(main.PlanCacheVersion, 1, populate_existing=True).version == version
@@ -0,0 +1,38 @@
+"""Vectorized plan scoring must rank plans exactly like the original per-plan /clustering loop."""
+import numpy as np
+import pytest
+
+from bench_plan_scoring import PATIENT, loop_scores, random_plans
+from plan_scoring import rank_plans, score_plans
+
+
+def ranking(patient, deltas, k=None):
+    indices, efficiencies = rank_plans(score_plans(patient, deltas), k)
+    return list(zip(indices, efficiencies))
+
+
+def expected_ranking(patient, deltas):
+    return [(row['index'], row['efficiency']) for row in loop_scores(patient, deltas)]
+
+
+@pytest.mark.parametrize('n', [1, 10, 1_000, 20_000])
+def test_matches_the_loop(n):
+    deltas = random_plans(n, np.random.default_rng(n))
+    expected = expected_ranking(PATIENT, deltas)
+    assert ranking(PATIENT, deltas) == expected
+    for k in (1, 3, 10):
+        assert ranking(PATIENT, deltas, k) == expected[:k]
+
+
+def test_ties_keep_plan_order():
+    deltas = np.repeat(random_plans(50, np.random.default_rng(0)), 4, axis=0)
+    expected = expected_ranking(PATIENT, deltas)
+    assert ranking(PATIENT, deltas) == expected
+    assert ranking(PATIENT, deltas, 5) == expected[:5]
+
+
+def test_zero_patient_values_are_skipped():
+    patient = list(PATIENT)
+    patient[1] = 0.0
+    deltas = random_plans(100, np.random.default_rng(1))
+    assert ranking(patient, deltas, 3) == expected_ranking(patient, deltas)[:3]
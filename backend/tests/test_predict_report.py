@@ -0,0 +1,23 @@
+from conftest import REPORT
+
+
+def test_updates_the_users_latest_report(main):
+    with main.app.app_context():
+        users = [main.UserTable(name='r', email=f'predict-report-{i}@example.com', password='x') for i in range(2)]
+        main.db.session.add_all(users)
+        main.db.session.flush()
+        owner, other = (user.user_id for user in users)
+        # A report of another user with report_id == owner, which a lookup by primary key would pick
+        if main.db.session.get(main.TestReports, owner) is None:
+            main.db.session.add(main.TestReports(report_id=owner, user_id=other, **REPORT))
+        first, latest = (main.TestReports(user_id=owner, **REPORT) for _ in range(2))
+        main.db.session.add_all([first, latest])
+        main.db.session.commit()
+        unrelated_gfr = main.db.session.get(main.TestReports, owner).gfr
+
+        main.predict_report(owner, {'gfr': 31.0, 'serumCreatinine': 2.0})
+        main.db.session.commit()
+
+        assert main.db.session.get(main.TestReports, latest.report_id).gfr == 31.0
+        assert main.db.session.get(main.TestReports, first.report_id).gfr == REPORT['gfr']
+        assert main.db.session.get(main.TestReports, owner).gfr == unrelated_gfr
@@ -0,0 +1,78 @@
+import threading
+import time
+
+from prediction_cache import SQLiteBackend, create_cache
+
+
+def test_counters_are_exact_under_concurrent_lookups():
+    cache = create_cache('memory', 'v1')
+    hit = cache.key([1.0] * 19)
+    cache.set(hit, {'result': 'cached'})
+    miss = cache.key([2.0] * 19)
+
+    def lookups():
+        for _ in range(2000):
+            cache.get(hit)
+            cache.get(miss)
+    threads = [threading.Thread(target=lookups) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    stats = cache.stats()
+    assert (stats['hits'], stats['misses']) == (8000, 8000)
+
+
+def test_model_swap_keeps_other_versions_in_the_shared_file(tmp_path):
+    path = tmp_path / 'cache.sqlite3'
+    worker_a = create_cache('sqlite', 'v1', path=path)
+    worker_b = create_cache('sqlite', 'v1', path=path)
+    old = worker_a.key([1.0] * 19)
+    worker_a.set(old, {'result': 'v1'})
+    # worker_b swapped first and already cached a v2 result
+    worker_b.set_model_version('v2')
+    new = worker_b.key([1.0] * 19)
+    worker_b.set(new, {'result': 'v2'})
+
+    worker_a.set_model_version('v2')
+
+    assert worker_a.get(new) == {'result': 'v2'}
+    assert worker_a.get(old) is None
+    assert len(worker_a.backend) == 1
+
+
+def test_model_swap_drops_old_entries_in_memory():
+    cache = create_cache('memory', 'v1')
+    cache.set(cache.key([1.0] * 19), {'result': 'v1'})
+    cache.set_model_version('v2')
+    assert len(cache.backend) == 0
+
+
+def test_sqlite_hit_does_not_write(tmp_path):
+    cache = create_cache('sqlite', 'v1', path=tmp_path / 'cache.sqlite3')
+    key = cache.key([1.0] * 19)
+    cache.set(key, {'result': 'cached'})
+    conn = cache.backend._connection()
+    changes = conn.total_changes
+
+    assert cache.get(key) == {'result': 'cached'}
+    assert conn.total_changes == changes
+
+
+def test_sqlite_prunes_every_n_sets(tmp_path):
+    backend = SQLiteBackend(str(tmp_path / 'cache.sqlite3'), max_size=2, prune_every=4)
+    now = time.time()
+    assert backend.set('v1:expired', 0, now - 1) == 0
+    assert [backend.set(f'v1:{i}', i, now + 60) for i in range(3)] == [0, 0, 1]
+    # The expired entry went without counting as an eviction, then the oldest surplus entry
+    assert len(backend) == 2
+    assert [backend.get(f'v1:{i}', now) for i in range(3)] == [None, 1, 2]
+
+
+def test_sqlite_expiry_is_indexed(tmp_path):
+    backend = SQLiteBackend(str(tmp_path / 'cache.sqlite3'), max_size=10)
+    plan = backend._connection().execute(
+        'EXPLAIN QUERY PLAN DELETE FROM prediction_cache WHERE expires_at <= ?', (time.time(),)
+    ).fetchall()
+    assert 'ix_prediction_cache_expires_at' in ' '.join(str(row) for row in plan)
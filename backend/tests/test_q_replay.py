@@ -0,0 +1,66 @@
+"""Offline replay follows /update-treatment's reward and update rules."""
+import numpy as np
+import pytest
+from sqlalchemy import MetaData, Table, create_engine, insert, select
+
+import q_replay
+from conftest import REPORT
+from q_store import ACTIONS, DISCOUNT_FACTOR, LEARNING_RATE, apply_q_update
+
+
+def test_replay_matches_a_hand_computed_sequence():
+    rewards = np.array([2.0, -1.0, 10.0, 1.0])
+    explore = np.zeros((4, len(ACTIONS)), dtype=bool)
+    explore[1, [1, 2]] = True
+    fallback = np.array([0, 3, 4, 0])
+
+    q = q_replay.replay(rewards, explore, fallback)
+
+    # 1. nothing selected, fallback 0:        q0 = 0.1 * (2 + 0.9 * 0)                 = 0.2
+    # 2. explores 1 and 2, -0.5 each:          q1 = 0.1 * (-0.5 + 0.9 * 0.2)            = -0.032, q2 likewise
+    # 3. nothing above the threshold, 4:       q4 = 0.1 * (10 + 0.9 * 0.2)              = 1.018
+    # 4. q4 > 0.5 is selected:                 q4 = 1.018 + 0.1 * (1 + 0.9 * 1.018 - 1.018) = 1.10782
+    assert q == pytest.approx([0.2, -0.032, -0.032, 0.0, 1.10782], abs=1e-12)
+
+    q_table = {action: 0.0 for action in ACTIONS}
+    for selected, reward in [([0], 2.0), ([1, 2], -1.0), ([4], 10.0), ([4], 1.0)]:
+        apply_q_update(q_table, [ACTIONS[a] for a in selected], reward, LEARNING_RATE, DISCOUNT_FACTOR)
+    assert q == [q_table[action] for action in ACTIONS]
+
+
+@pytest.fixture
+def engine(main, tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'replay.db'}")
+    main.db.metadata.create_all(engine)
+    yield engine
+    engine.dispose()
+
+
+def test_rewards_from_consecutive_reports(engine):
+    reports = [
+        (1, 10, dict(gfr=20.0, hematuria=False)),
+        (2, 11, dict(gfr=30.0, hematuria=False)),
+        (3, 10, dict(gfr=25.0, hematuria=True)),
+        (4, 11, dict(gfr=28.0, hematuria=False)),
+        (5, 12, dict(gfr=40.0, hematuria=False)),
+        (6, 10, dict(gfr=27.0, hematuria=False)),
+    ]
+    with engine.begin() as conn:
+        table = Table('test_report', MetaData(), autoload_with=engine)
+        conn.execute(insert(table), [dict(REPORT, report_id=report_id, user_id=user_id, **values)
+                                     for report_id, user_id, values in reports])
+
+    old, new = q_replay.load_transitions(['reports'], engine=engine)
+
+    # User 10: 20 -> 25 with hematuria, 25 -> 27; user 11: 30 -> 28; user 12 has a single report
+    gfr = q_replay.GFR
+    assert [(o[gfr], n[gfr]) for o, n in zip(old, new)] == [(20.0, 25.0), (25.0, 27.0), (30.0, 28.0)]
+    assert q_replay.rewards(old, new).tolist() == [0.0, 2.0, -2.0]
+
+
+def test_install_writes_the_application_q_table(engine):
+    q_table = dict(zip(ACTIONS, [0.5, -1.0, 0.25, 0.0, 2.0]))
+    q_replay.install(engine, q_table)
+    with engine.connect() as conn:
+        table = Table('q_values', MetaData(), autoload_with=engine)
+        assert dict(conn.execute(select(table.c.action, table.c.q_value)).all()) == q_table
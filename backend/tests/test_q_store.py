@@ -0,0 +1,135 @@
+"""Two workers sharing one Q-table learn exactly as one serial process would."""
+import random
+import threading
+
+import pytest
+from sqlalchemy import Column, Float, Integer, MetaData, String, Table, create_engine
+
+from q_store import ACTIONS, DISCOUNT_FACTOR, LEARNING_RATE, QStore, apply_q_update
+
+metadata = MetaData()
+q_values = Table('q_values', metadata, Column('action', String(50), primary_key=True),
+                 Column('q_value', Float, nullable=False, default=0.0))
+q_table_state = Table('q_table_state', metadata, Column('id', Integer, primary_key=True),
+                      Column('version', Integer, nullable=False, default=0))
+
+
+class LoggedStore(QStore):
+    """QStore that logs each committed batch with the version it claimed."""
+
+    def __init__(self, engine, log, **options):
+        self.log = log
+        self._claimed = threading.local()
+        super().__init__(engine, q_values, q_table_state, ACTIONS, LEARNING_RATE, DISCOUNT_FACTOR, **options)
+
+    def _write_values(self, conn, version, values):
+        super()._write_values(conn, version, values)
+        self._claimed.version = version
+
+    def _commit_batch(self, batch):
+        values = super()._commit_batch(batch)
+        self.log.append((self._claimed.version, list(batch)))
+        return values
+
+
+@pytest.fixture
+def engine(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'q.db'}", connect_args={'timeout': 30})
+    metadata.create_all(engine)
+    yield engine
+    engine.dispose()
+
+
+def workers(engine, **options):
+    log = []
+    options.setdefault('flush_interval', 3600)
+    return log, LoggedStore(engine, log, **options), LoggedStore(engine, log, **options)
+
+
+def serial(events):
+    q_table = {action: 0.0 for action in ACTIONS}
+    for selected_actions, reward in events:
+        apply_q_update(q_table, selected_actions, reward, LEARNING_RATE, DISCOUNT_FACTOR)
+    return q_table
+
+
+def committed_events(log):
+    return [event for _, batch in sorted(log) for event in batch]
+
+
+def stored(store):
+    with store.engine.connect() as conn:
+        return store._read_values(conn)
+
+
+def test_interleaved_record_and_flush(engine):
+    log, a, b = workers(engine)
+    events = [(['adjust_sodium_limit'], 1.0), (['update_diet', 'restrict_alcohol'], -1.0),
+              (['adjust_fluid_intake'], 1.0), (['adjust_sodium_limit', 'update_diet'], 1.0)]
+
+    a.record(*events[0])
+    b.record(*events[1])
+    a.flush()
+    b.flush()
+    b.record(*events[2])
+    a.record(*events[3])
+    a.flush()
+    b.flush()
+
+    expected = serial([events[0], events[1], events[3], events[2]])
+    assert committed_events(log) == [events[0], events[1], events[3], events[2]]
+    assert stored(a) == expected
+    for store in (a, b):
+        store.refresh()
+    assert a.snapshot() == b.snapshot() == expected
+    assert a.version() == 4
+
+
+def test_batch_is_replayed_after_a_version_conflict(engine):
+    log, a, b = workers(engine)
+    first, second = (['adjust_sodium_limit'], 1.0), (['adjust_sodium_limit', 'update_diet'], -1.0)
+    a.record(*first)
+    b.record(*second)
+
+    read_values = b._read_values
+
+    def commit_a_first(conn):
+        # a commits between b's read and b's version claim
+        if not a.flushes:
+            a.flush()
+        return read_values(conn)
+
+    b._read_values = commit_a_first
+    b.flush()
+
+    assert (a.conflicts, b.conflicts) == (0, 1)
+    assert committed_events(log) == [first, second]
+    assert stored(b) == serial([first, second])
+    assert b.snapshot() == serial([first, second])
+
+
+def test_concurrent_workers_apply_every_event_once(engine):
+    log, a, b = workers(engine, flush_interval=0.005, max_batch=8)
+    recorded = []
+
+    def worker(store, seed):
+        rng = random.Random(seed)
+        for _ in range(60):
+            event = (rng.sample(ACTIONS, rng.randint(1, 3)), rng.choice([1.0, -1.0]))
+            recorded.append(event)
+            store.record(*event)
+            if rng.random() < 0.2:
+                store.flush()
+
+    threads = [threading.Thread(target=worker, args=(store, seed)) for seed, store in enumerate([a, b, a, b])]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    a.flush()
+    b.flush()
+
+    events = committed_events(log)
+    assert sorted(map(repr, events)) == sorted(map(repr, recorded))
+    assert [version for version, _ in sorted(log)] == list(range(len(log)))
+    assert stored(a) == serial(events)
@@ -0,0 +1,77 @@
+"""The per-user endpoints read everything they need in one query, so a lazy load or N+1 shows up here."""
+import pytest
+
+from conftest import REPORT
+
+
+NEW_STATE = {'serum_creatinine': 3.5, 'gfr': 28.0, 'bun': 120.0, 'serum_calcium': 8.6, 'ana': 1,
+             'c3_c4': 30.0, 'hematuria': 0, 'oxalate_levels': 4.0, 'urine_ph': 5.5, 'blood_pressure': 125.0}
+
+
+@pytest.fixture(scope='module')
+def user_id(main):
+    """A user with three test reports and a selected plan, among plans for every cluster."""
+    with main.app.app_context():
+        user = main.UserTable(name='q', email='query-counts@example.com', password='x')
+        main.db.session.add(user)
+        main.db.session.flush()
+        for cluster in range(7):
+            for i in range(3):
+                main.db.session.add(main.FinalTreatmentPlan(
+                    cluster=cluster, sodium_int=2.0, fluid_int=2.0, physical_activity='walk', diet='renal',
+                    alcohol_limit='none', serum_creatinine=-0.2 * i, gfr=5.0 + i, bun=-3.0, serum_calcium=0.1,
+                    oxalate_levels=10.0, urine_ph=0.2, blood_pressure=-5.0,
+                ))
+        for gfr in (20.0, 22.0, 25.0):
+            main.db.session.add(main.TestReports(user_id=user.user_id, **dict(REPORT, gfr=gfr)))
+        main.db.session.flush()
+        main.db.session.add(main.FinalSelectedPlan(
+            user_id=user.user_id, plan_id=1, sodium_int=2.0, fluid_int=2.0,
+            physical_activity='walk', diet='renal', alcohol_limit='none',
+        ))
+        main.db.session.commit()
+        return user.user_id
+
+
+@pytest.fixture
+def post(main, user_id):
+    client = main.app.test_client()
+    headers = {'Authorization': f'Bearer {main.generate_token(user_id)}'}
+
+    def send(path, **kwargs):
+        response = client.post(path, headers=headers, **kwargs)
+        assert response.status_code == 200, response.get_data(as_text=True)
+        return response
+    return send
+
+
+def selects(statements):
+    return [statement for statement in statements if statement.startswith('SELECT')]
+
+
+def test_clustering_is_one_query(post, count_queries):
+    # The first request fills the plan cache and the token cache
+    post('/clustering')
+    count_queries.clear()
+    post('/clustering')
+    assert len(count_queries) == 1, count_queries
+    assert len(selects(count_queries)) == 1
+
+
+def test_get_selected_treatment_is_one_query(post, count_queries):
+    post('/get_selected_treatment')
+    count_queries.clear()
+    post('/get_selected_treatment')
+    assert len(count_queries) == 1, count_queries
+    assert len(selects(count_queries)) == 1
+
+
+def test_update_treatment_is_one_query(post, count_queries):
+    post('/update-treatment', json={'new_state': NEW_STATE})
+    count_queries.clear()
+    post('/update-treatment', json={'new_state': NEW_STATE})
+    # One read, plus the write of the plan when the chosen action changed it
+    assert len(selects(count_queries)) == 1, count_queries
+    writes = count_queries[1:]
+    assert count_queries[0].startswith('SELECT'), count_queries
+    assert len(writes) <= 1 and all(write.startswith('UPDATE final_selected_plan') for write in writes), count_queries
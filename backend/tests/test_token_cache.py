@@ -0,0 +1,114 @@
+"""Token verification cache, /api/logout, and revocations shared across workers."""
+import time
+
+import jwt
+import pytest
+from sqlalchemy import Column, Float, Integer, MetaData, String, Table, create_engine, select
+
+from token_cache import TokenCache
+
+SECRET = 'token-cache-' + 'x' * 32
+
+
+def token(user_id, expires_in=3600):
+    return jwt.encode({'user_id': user_id, 'exp': time.time() + expires_in}, SECRET, algorithm='HS256')
+
+
+# revoked_token as a plain SQLite rowid table, which reuses the highest id once it is deleted
+ROWID_TABLE = Table('revoked_token', MetaData(), Column('id', Integer, primary_key=True),
+                    Column('digest', String(64), nullable=False, unique=True),
+                    Column('expires_at', Float, nullable=False))
+
+
+@pytest.fixture(params=['model', 'rowid'])
+def table(request, main):
+    return main.RevokedToken.__table__ if request.param == 'model' else ROWID_TABLE
+
+
+@pytest.fixture
+def engine(table, tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'tokens.db'}")
+    table.create(engine)
+    yield engine
+    engine.dispose()
+
+
+@pytest.fixture
+def workers(engine, table):
+    def make(check_interval=0.05, max_size=100):
+        return TokenCache(max_size, engine, table, check_interval=check_interval)
+    return make
+
+
+def test_revoked_token_is_refused_by_logout(main):
+    with main.app.app_context():
+        user = main.UserTable(name='t', email='token-cache-logout@example.com', password='x')
+        main.db.session.add(user)
+        main.db.session.commit()
+        user_id = user.user_id
+    client = main.app.test_client()
+    headers = {'Authorization': f'Bearer {main.generate_token(user_id)}'}
+
+    assert client.get('/jobs/missing', headers=headers).status_code == 404
+    assert client.post('/api/logout', headers=headers).status_code == 200
+    response = client.get('/jobs/missing', headers=headers)
+    assert response.status_code == 401
+    assert 'revoked' in response.get_json()['error']
+
+
+def test_other_worker_refuses_a_revoked_token_after_check_interval(workers):
+    a, b = workers(), workers()
+    revoked = token(1)
+    key = TokenCache.key(revoked)
+    b.set(key, jwt.decode(revoked, SECRET, algorithms=['HS256']))
+    assert b.get(key) is not None
+
+    a.revoke(revoked)
+    assert a.is_revoked(key) and a.get(key) is None
+    # b checks the table at most once per check_interval
+    assert b.get(key) is not None
+
+    time.sleep(0.06)
+    assert b.get(key) is None
+    assert b.is_revoked(key)
+    b.set(key, jwt.decode(revoked, SECRET, algorithms=['HS256']))
+    assert b.get(key) is None
+
+
+def test_pruning_never_hides_a_later_revocation(engine, table, workers):
+    a, b = workers(), workers()
+    # An expired revocation holds the highest id until the next revoke prunes it
+    a.revoke(token(1, expires_in=-10))
+    time.sleep(0.06)
+    b.is_revoked('')
+    later = token(2)
+    a.revoke(later)
+
+    time.sleep(0.06)
+    assert b.is_revoked(TokenCache.key(later))
+    with engine.connect() as conn:
+        assert conn.execute(select(table.c.digest)).scalars().all() == [TokenCache.key(later)]
+
+
+def test_tokens_without_exp_are_not_cached(workers):
+    cache = workers()
+    forever = jwt.encode({'user_id': 1}, SECRET, algorithm='HS256')
+    cache.set(TokenCache.key(forever), {'user_id': 1})
+    assert cache.get(TokenCache.key(forever)) is None
+    assert cache.stats()['size'] == 0
+
+    # Revoking one refuses it for good
+    cache.revoke(forever)
+    assert cache.is_revoked(TokenCache.key(forever))
+
+
+def test_least_recently_used_entry_is_evicted(workers):
+    cache = workers(max_size=2)
+    keys = [TokenCache.key(token(user_id)) for user_id in range(3)]
+    cache.set(keys[0], {'user_id': 0, 'exp': time.time() + 60})
+    cache.set(keys[1], {'user_id': 1, 'exp': time.time() + 60})
+    cache.get(keys[0])
+    cache.set(keys[2], {'user_id': 2, 'exp': time.time() + 60})
+    assert cache.get(keys[1]) is None
+    assert cache.get(keys[0]) == {'user_id': 0, 'exp': pytest.approx(time.time() + 60, abs=5)}
+    assert cache.stats()['evictions'] == 1
@@ -0,0 +1,150 @@
+"""Bounded LRU cache of verified JWT payloads, with revocations shared through the database.
+
+token_required runs an HS256 check on every request, while one page view
+sends several requests with the same token. Once a token has verified,
+its payload is kept under the sha256 of the token, so the cache never
+holds usable bearer tokens. Each entry expires at the token's exp claim,
+the moment jwt.decode would start rejecting it. Tokens without exp are
+never cached.
+
+revoke() (called by /api/logout) stores the token's digest in the
+revoked_token table, and the token is refused until its exp, even when
+it would verify again. Every worker reads revocations newer than the
+last one it has seen at most once per check_interval seconds, and drops
+those tokens from its cache. A token revoked in one worker is therefore
+refused by the others within check_interval.
+"""
+import datetime
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+import jwt
+from sqlalchemy import delete, exc, select
+
+
+class TokenCache:
+    """Verified token payloads by token digest, evicted least recently used first.
+
+    max_size 0 turns off caching; revocations are still enforced.
+    """
+
+    def __init__(self, max_size, engine, revoked_table, check_interval=1.0):
+        self.max_size = max_size
+        self.engine = engine
+        self.revoked_table = revoked_table
+        self.check_interval = check_interval
+        self._entries = OrderedDict()
+        # digest -> exp of revoked tokens, kept until they would have expired anyway
+        self._revoked = {}
+        self._last_revocation_id = 0
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.revocations = 0
+
+    @staticmethod
+    def key(token):
+        return hashlib.sha256(token.encode()).hexdigest()
+
+    def _sync(self):
+        """Pick up revocations made by other workers, at most once per check_interval."""
+        now = time.monotonic()
+        if now - self._checked_at < self.check_interval:
+            return
+        self._checked_at = now
+        table = self.revoked_table
+        with self.engine.connect() as conn:
+            rows = conn.execute(
+                select(table.c.id, table.c.digest, table.c.expires_at)
+                .where(table.c.id > self._last_revocation_id)
+                .order_by(table.c.id)
+            ).all()
+        if not rows:
+            return
+        with self._lock:
+            for revocation_id, digest, expires_at in rows:
+                self._entries.pop(digest, None)
+                self._revoked[digest] = expires_at
+            self._last_revocation_id = rows[-1][0]
+
+    def get(self, key):
+        """The cached payload for a token digest, or None when it must be verified."""
+        self._sync()
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires_at, payload = entry
+            if expires_at <= now:
+                del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return payload
+
+    def set(self, key, payload):
+        expires_at = payload.get('exp')
+        if not self.max_size or not isinstance(expires_at, (int, float)):
+            return
+        with self._lock:
+            if key in self._revoked:
+                return
+            self._entries[key] = (expires_at, payload)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def is_revoked(self, key):
+        self._sync()
+        with self._lock:
+            expires_at = self._revoked.get(key)
+            if expires_at is None:
+                return False
+            if expires_at <= time.time():
+                del self._revoked[key]
+                return False
+            return True
+
+    def revoke(self, token):
+        """Refuse token in every worker until it expires."""
+        try:
+            expires_at = jwt.decode(token, options={'verify_signature': False}).get('exp')
+        except jwt.InvalidTokenError:
+            return
+        if not isinstance(expires_at, (int, float)):
+            # Never expires, so never stops being revoked
+            expires_at = datetime.datetime.max.replace(tzinfo=datetime.timezone.utc).timestamp()
+        key = self.key(token)
+        now = time.time()
+        table = self.revoked_table
+        try:
+            with self.engine.begin() as conn:
+                # Insert before pruning: were the newest row pruned first, SQLite without
+                # AUTOINCREMENT would hand its id out again, and workers past it would miss this one
+                conn.execute(table.insert().values(digest=key, expires_at=expires_at))
+                conn.execute(delete(table).where(table.c.expires_at <= now))
+        except exc.IntegrityError:
+            # Already revoked by an earlier call
+            pass
+        with self._lock:
+            self._entries.pop(key, None)
+            self._revoked[key] = expires_at
+            self.revocations += 1
+
+    def stats(self):
+        return {
+            'size': len(self._entries),
+            'revoked': len(self._revoked),
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'revocations': self.revocations,
+        }
@@ -0,0 +1,449 @@
+"""Train every model the backend serves and write one versioned artifact bundle.
+
+Replaces CKD_Historical/ckdNew.py and the training cells of the notebooks:
+- ckd_model: RandomForestClassifier for the CKD stage, on
+  updated_ckd_dataset_with_stages.csv; scaler and label_encoders are
+  fitted with it
+- future_params: the one-hot + StandardScaler + RandomForestRegressor
+  pipeline of CKD Historical pred.ipynb, on medical_lifestyle_with_targets.csv
+- cluster_model: the Yeo-Johnson + StandardScaler + KMeans(7) of
+  Clustering.ipynb, on updated_medical_lifestyle_dataset.csv, kept as one
+  pipeline so it takes the raw lab values /clustering passes it
+
+The encoded, split and scaled classifier matrices are cached in --cache-dir
+under the dataset's sha256, so a rerun with another grid skips the CSV
+parse and encoding. --stages can also point at a columnar copy of the
+CSV (see columnar.py), which is memory-mapped with its categories
+already encoded. Every --grid combination is cross-validated with
+--folds folds; the (combination, fold) fits run in a process pool. The best
+combination by mean accuracy is refit with its trees built on --jobs cores.
+
+For datasets larger than memory, --chunk-rows trains the classifier out of
+core instead (see stream_classifier): the dataset is read in blocks of that
+many rows, the scaler is fitted incrementally and each block grows its share
+of the trees. The holdout split is by row hash and is scored block by block.
+There is no cross-validation or cache in this mode.
+
+The bundle is an artifact directory (see artifacts.py) whose manifest
+also records the dataset digests, parameters and scores. Point
+ARTIFACT_DIR at it to serve it. Run from the backend directory:
+
+    python train.py --version 2026.10.18
+    python train.py --grid n_estimators=100,300 max_depth=none,20 --folds 5 --jobs 4
+    python train.py --stages datasets/stages --chunk-rows 500000 --grid max_depth=20
+"""
+import argparse
+import datetime
+import itertools
+import os
+import pickle
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import joblib
+import numpy as np
+import pandas as pd
+from sklearn.cluster import KMeans
+from sklearn.compose import ColumnTransformer
+from sklearn.ensemble import RandomForestClassifier, RandomForestRegressor
+from sklearn.metrics import accuracy_score, r2_score
+from sklearn.model_selection import StratifiedKFold, train_test_split
+from sklearn.pipeline import Pipeline
+from sklearn.preprocessing import LabelEncoder, OneHotEncoder, PowerTransformer, StandardScaler
+
+from artifacts import PICKLES, file_digest, save_artifacts
+from columnar import ColumnarDataset, is_dataset
+from encoding import CATEGORICAL_COLUMNS, compile_encoders, encode_column, fit_encoders
+
+
+HISTORICAL_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'CKD_Historical')
+STAGES_CSV = os.path.join(HISTORICAL_DIR, 'updated_ckd_dataset_with_stages.csv')
+TARGETS_CSV = os.path.join(HISTORICAL_DIR, 'medical_lifestyle_with_targets.csv')
+CLUSTER_CSV = os.path.join(HISTORICAL_DIR, 'updated_medical_lifestyle_dataset.csv')
+# Bump when the cached matrices change meaning
+CACHE_VERSION = 1
+
+# Classifier: every column except these is a feature
+NON_FEATURE_COLUMNS = ['ckd_pred', 'ckd_stage', 'months', 'cluster']
+STAGE_COLUMN = 'ckd_stage'
+# Future-parameters model, as in CKD Historical pred.ipynb
+PARAM_NUMERIC_COLUMNS = [
+    'water_intake', 'serum_creatinine', 'gfr', 'bun', 'serum_calcium', 'ana',
+    'c3_c4', 'hematuria', 'oxalate_levels', 'urine_ph', 'blood_pressure', 'months',
+]
+PARAM_TARGET_COLUMNS = [
+    'Target_Serum_Creatinine', 'Target_GFR', 'Target_BUN', 'Target_Serum_Calcium', 'Target_ANA',
+    'Target_C3_C4', 'Target_Hematuria', 'Target_Oxalate_Levels', 'Target_Urine_pH', 'Target_Blood_Pressure',
+]
+# Clustering, in the order /clustering passes them
+CLUSTER_COLUMNS = ['serum_creatinine', 'gfr', 'bun', 'serum_calcium', 'oxalate_levels', 'urine_ph', 'blood_pressure']
+N_CLUSTERS = 7
+
+DEFAULT_PARAMS = {'n_estimators': 100}
+
+
+def load_stages(path):
+    """(X, y, label_encoders, source sha256) from the stages CSV or its columnar copy (see columnar.py)."""
+    if is_dataset(path):
+        dataset = ColumnarDataset(path)
+        features = [column for column in dataset.columns if column not in NON_FEATURE_COLUMNS]
+        label_encoders = dataset.label_encoders(CATEGORICAL_COLUMNS)
+        return dataset.frame(features), np.asarray(dataset.column(STAGE_COLUMN)), label_encoders, dataset.sha256
+    dataset = pd.read_csv(path)
+    label_encoders = fit_encoders(dataset, CATEGORICAL_COLUMNS)
+    return dataset.drop(columns=NON_FEATURE_COLUMNS), dataset[STAGE_COLUMN], label_encoders, file_digest(path)
+
+
+def classifier_data(path, cache_dir, test_size, seed):
+    """Encoded, split and scaled classifier matrices, from the cache when the dataset is unchanged.
+
+    path is the stages CSV or a columnar dataset directory. Returns
+    (data, cache_hit); data holds X_train, X_test, y_train, y_test, the
+    fitted scaler and label_encoders, and the dataset's sha256.
+    """
+    digest = ColumnarDataset(path).sha256 if is_dataset(path) else file_digest(path)
+    cache_path = None
+    if cache_dir:
+        key = f'{digest[:16]}-{test_size}-{seed}-v{CACHE_VERSION}'
+        cache_path = os.path.join(cache_dir, f'classifier-{key}.joblib')
+        if os.path.exists(cache_path):
+            return joblib.load(cache_path), True
+
+    X, y, label_encoders, digest = load_stages(path)
+    X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=test_size, random_state=seed)
+    scaler = StandardScaler()
+    data = {
+        'X_train': scaler.fit_transform(X_train),
+        'X_test': scaler.transform(X_test),
+        'y_train': np.asarray(y_train),
+        'y_test': np.asarray(y_test),
+        'scaler': scaler,
+        'label_encoders': label_encoders,
+        'sha256': digest,
+    }
+    if cache_path:
+        os.makedirs(cache_dir, exist_ok=True)
+        # Renamed into place so a concurrent run never reads half a file
+        partial = f'{cache_path}.{os.getpid()}.tmp'
+        joblib.dump(data, partial)
+        os.replace(partial, cache_path)
+    return data, False
+
+
+def parse_value(text):
+    if text.lower() == 'none':
+        return None
+    for parse in (int, float):
+        try:
+            return parse(text)
+        except ValueError:
+            pass
+    return text
+
+
+def parse_grid(specs):
+    """['n_estimators=100,300', 'max_depth=none,20'] -> every combination as a params dict."""
+    axes = {}
+    for spec in specs:
+        name, sep, values = spec.partition('=')
+        if not sep or not values:
+            raise ValueError(f'Expected name=value[,value...], got {spec!r}')
+        axes[name] = [parse_value(value) for value in values.split(',')]
+    combinations = [dict(zip(axes, values)) for values in itertools.product(*axes.values())]
+    return [{**DEFAULT_PARAMS, **params} for params in combinations] or [dict(DEFAULT_PARAMS)]
+
+
+# Training matrix of each pool worker, sent once through the initializer instead of with every task
+_worker_data = {}
+
+
+def _init_worker(X, y):
+    _worker_data['X'], _worker_data['y'] = X, y
+
+
+def _fit_fold(params, train_index, test_index, seed):
+    X, y = _worker_data['X'], _worker_data['y']
+    model = RandomForestClassifier(**params, random_state=seed, n_jobs=1)
+    model.fit(X[train_index], y[train_index])
+    return accuracy_score(y[test_index], model.predict(X[test_index]))
+
+
+def cross_validate(grid, X, y, folds, seed, workers):
+    """Mean and per-fold accuracy of every combination; the fits are spread over a process pool."""
+    splits = list(StratifiedKFold(n_splits=folds, shuffle=True, random_state=seed).split(X, y))
+    tasks = [(params, train_index, test_index, seed) for params in grid for train_index, test_index in splits]
+    if workers == 1:
+        _init_worker(X, y)
+        scores = [_fit_fold(*task) for task in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(X, y)) as pool:
+            scores = list(pool.map(_fit_fold, *zip(*tasks)))
+    scores = np.array(scores, dtype=np.float64).reshape(len(grid), folds)
+    results = [
+        {'params': params, 'fold_scores': row.tolist(), 'mean_accuracy': float(row.mean())}
+        for params, row in zip(grid, scores)
+    ]
+    return results
+
+
+def fit_classifier(params, data, jobs, seed):
+    model = RandomForestClassifier(**params, random_state=seed, n_jobs=jobs)
+    model.fit(data['X_train'], data['y_train'])
+    accuracy = accuracy_score(data['y_test'], model.predict(data['X_test']))
+    # Serving predicts a few rows at a time, where a thread pool per call only adds overhead
+    model.n_jobs = None
+    return model, float(accuracy)
+
+
+def grow_forest(model, features, labels, n_trees, jobs):
+    """Add n_trees trees fitted on (features, labels) to a fitted forest."""
+    model.set_params(warm_start=True, n_estimators=model.n_estimators + n_trees, n_jobs=jobs)
+    model.fit(features, labels)
+    model.set_params(warm_start=False, n_jobs=None)
+    return model
+
+
+def stage_encoders(path, chunk_rows):
+    """LabelEncoders of the stages dataset, from a columnar copy's categories or one streaming pass over the CSV."""
+    if is_dataset(path):
+        return ColumnarDataset(path).label_encoders(CATEGORICAL_COLUMNS)
+    categories = {column: set() for column in CATEGORICAL_COLUMNS}
+    for chunk in pd.read_csv(path, usecols=CATEGORICAL_COLUMNS, chunksize=chunk_rows):
+        for column, seen in categories.items():
+            seen.update(chunk[column].unique().tolist())
+    return {column: LabelEncoder().fit(sorted(seen)) for column, seen in categories.items()}
+
+
+def stage_chunks(path, chunk_rows, tables):
+    """Yield (first row index, encoded features, stages) for each chunk_rows block of the stages dataset."""
+    if is_dataset(path):
+        dataset = ColumnarDataset(path)
+        features = [column for column in dataset.columns if column not in NON_FEATURE_COLUMNS]
+        for start in range(0, dataset.rows, chunk_rows):
+            stop = min(start + chunk_rows, dataset.rows)
+            yield start, dataset.matrix(features, start, stop), np.asarray(dataset.column(STAGE_COLUMN, start, stop))
+        return
+    start = 0
+    for chunk in pd.read_csv(path, chunksize=chunk_rows):
+        features = chunk.drop(columns=NON_FEATURE_COLUMNS)
+        for column in CATEGORICAL_COLUMNS:
+            features[column] = encode_column(tables, column, features[column].tolist())
+        yield start, features.to_numpy(dtype=np.float64), chunk[STAGE_COLUMN].to_numpy()
+        start += len(chunk)
+
+
+def holdout_mask(start, n, test_size, seed):
+    """Which of rows [start, start + n) are in the holdout split.
+
+    Decided by a hash of the row index, so the split is the same whatever
+    the chunk size.
+    """
+    index = np.arange(start, start + n, dtype=np.uint64) + np.uint64(seed)
+    # Fibonacci hashing; the multiplication wraps around modulo 2**64
+    hashed = index * np.uint64(0x9E3779B97F4A7C15)
+    return (hashed >> np.uint64(11)).astype(np.float64) / 2.0 ** 53 < test_size
+
+
+def stream_classifier(path, params, chunk_rows, test_size, seed, jobs, reserve_per_class=20):
+    """Train the stage classifier reading chunk_rows rows at a time.
+
+    Three passes over the dataset: the scaler is fitted with partial_fit on
+    the training rows; each chunk then grows its share of the forest's
+    trees with warm_start; finally the holdout rows are scored. A chunk
+    lacking a stage gets reserve_per_class training rows of it kept from
+    the first pass, so every tree knows every class. Memory is bounded by
+    the chunk size; only the forest grows with the number of chunks.
+
+    Returns (model, scaler, label_encoders, summary).
+    """
+    label_encoders = stage_encoders(path, chunk_rows)
+    tables = compile_encoders(label_encoders)
+
+    scaler = StandardScaler()
+    reserve = {}
+    rows = train_rows = 0
+    for start, X, y in stage_chunks(path, chunk_rows, tables):
+        train = ~holdout_mask(start, len(y), test_size, seed)
+        X, y = X[train], y[train]
+        if len(y):
+            scaler.partial_fit(X)
+        for stage in np.unique(y).tolist():
+            kept = reserve.get(stage)
+            if kept is None or len(kept) < reserve_per_class:
+                extra = X[y == stage][:reserve_per_class - (0 if kept is None else len(kept))]
+                reserve[stage] = extra if kept is None else np.vstack([kept, extra])
+        rows += len(train)
+        train_rows += len(y)
+    if not train_rows:
+        raise ValueError(f'{path} has no training rows')
+
+    chunks = -(-rows // chunk_rows)
+    n_estimators = params.get('n_estimators', DEFAULT_PARAMS['n_estimators'])
+    trees_per_chunk = max(1, -(-n_estimators // chunks))
+    model = None
+    reserve_rows = 0
+    for start, X, y in stage_chunks(path, chunk_rows, tables):
+        train = ~holdout_mask(start, len(y), test_size, seed)
+        X, y = X[train], y[train]
+        missing = sorted(set(reserve) - set(y.tolist()))
+        if missing:
+            X = np.vstack([X, *(reserve[stage] for stage in missing)])
+            y = np.concatenate([y, *(np.full(len(reserve[stage]), stage, dtype=y.dtype) for stage in missing)])
+            reserve_rows += sum(len(reserve[stage]) for stage in missing)
+        if model is None:
+            model = RandomForestClassifier(**{**params, 'n_estimators': 0}, random_state=seed)
+        grow_forest(model, scaler.transform(X), y, trees_per_chunk, jobs)
+
+    correct = holdout_rows = 0
+    for start, X, y in stage_chunks(path, chunk_rows, tables):
+        holdout = holdout_mask(start, len(y), test_size, seed)
+        if holdout.any():
+            correct += int((model.predict(scaler.transform(X[holdout])) == y[holdout]).sum())
+            holdout_rows += int(holdout.sum())
+
+    summary = {
+        'chunk_rows': chunk_rows,
+        'chunks': chunks,
+        'trees_per_chunk': trees_per_chunk,
+        'n_estimators': model.n_estimators,
+        'train_rows': train_rows,
+        'holdout_rows': holdout_rows,
+        'reserve_rows': reserve_rows,
+        'holdout_accuracy': correct / holdout_rows if holdout_rows else None,
+    }
+    return model, scaler, label_encoders, summary
+
+
+def fit_param_model(path, jobs, test_size, seed):
+    frame = pd.read_csv(path)
+    X = frame.drop(columns=[column for column in frame.columns if column.startswith('Target_')])
+    y = frame[PARAM_TARGET_COLUMNS]
+    X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=test_size, random_state=seed)
+    model = Pipeline([
+        ('preprocessor', ColumnTransformer(transformers=[
+            ('cat', OneHotEncoder(), CATEGORICAL_COLUMNS),
+            ('num', StandardScaler(), PARAM_NUMERIC_COLUMNS),
+        ])),
+        ('regressor', RandomForestRegressor(n_estimators=100, random_state=seed, n_jobs=jobs)),
+    ])
+    model.fit(X_train, y_train)
+    r2 = r2_score(y_test, model.predict(X_test))
+    model[-1].n_jobs = None
+    return model, float(r2)
+
+
+def fit_cluster_model(path, seed):
+    frame = pd.read_csv(path, usecols=CLUSTER_COLUMNS)[CLUSTER_COLUMNS]
+    model = Pipeline([
+        ('power_transform', PowerTransformer(method='yeo-johnson', standardize=True)),
+        ('scaler', StandardScaler()),
+        ('kmeans', KMeans(n_clusters=N_CLUSTERS, random_state=seed)),
+    ])
+    model.fit(frame.to_numpy(dtype=np.float64))
+    return model, float(model[-1].inertia_)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Train the backend models into a versioned artifact bundle.')
+    parser.add_argument('--version', default=datetime.datetime.now().strftime('%Y%m%d%H%M%S'),
+                        help='version label stored in the manifest (default: a timestamp)')
+    parser.add_argument('--output', help='bundle directory (default: artifacts/<version>)')
+    parser.add_argument('--grid', nargs='*', default=[], metavar='NAME=V1,V2',
+                        help='RandomForestClassifier parameters to search')
+    parser.add_argument('--folds', type=int, default=5, help='cross-validation folds; 0 skips cross-validation')
+    parser.add_argument('--jobs', type=int, default=-1, help='cores for building the final forests')
+    parser.add_argument('--workers', type=int, default=None, help='process pool size (default: CPU count)')
+    parser.add_argument('--stages', default=STAGES_CSV,
+                        help='stages CSV, or its columnar directory from columnar.py (default: the CSV)')
+    parser.add_argument('--chunk-rows', type=int, default=0,
+                        help='train the classifier out of core, this many rows at a time (default: in memory)')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--test-size', type=float, default=0.2)
+    parser.add_argument('--cache-dir', default=os.path.join('.cache', 'train'), help="'' disables the cache")
+    parser.add_argument('--pickles', metavar='DIR', help='also write the legacy .pkl files into DIR')
+    args = parser.parse_args()
+
+    output = args.output or os.path.join('artifacts', args.version)
+    if os.path.exists(os.path.join(output, 'manifest.json')):
+        parser.error(f'{output} already holds a bundle; pick another --version or --output')
+    try:
+        grid = parse_grid(args.grid)
+    except ValueError as e:
+        parser.error(str(e))
+    workers = args.workers or os.cpu_count() or 1
+
+    search = []
+    best = grid[0]
+    if args.chunk_rows:
+        if len(grid) > 1:
+            parser.error('--chunk-rows trains one --grid combination; search on a sample in memory first')
+        start = time.perf_counter()
+        ckd_model, scaler, label_encoders, streaming = stream_classifier(
+            args.stages, best, args.chunk_rows, args.test_size, args.seed, args.jobs,
+        )
+        accuracy = streaming['holdout_accuracy']
+        stages_digest = ColumnarDataset(args.stages).sha256 if is_dataset(args.stages) else file_digest(args.stages)
+        print(f"ckd_model {best}: {streaming['train_rows']} train / {streaming['holdout_rows']} holdout rows in "
+              f"{streaming['chunks']} chunks, {streaming['n_estimators']} trees, holdout accuracy {accuracy:.4f} "
+              f"({time.perf_counter() - start:.1f}s)")
+    else:
+        streaming = None
+        start = time.perf_counter()
+        data, cache_hit = classifier_data(args.stages, args.cache_dir, args.test_size, args.seed)
+        scaler, label_encoders, stages_digest = data['scaler'], data['label_encoders'], data['sha256']
+        print(f"Classifier data: {len(data['X_train'])} train / {len(data['X_test'])} test rows "
+              f"({'cached' if cache_hit else 'encoded'}) in {time.perf_counter() - start:.2f}s")
+
+        if args.folds:
+            start = time.perf_counter()
+            search = cross_validate(grid, data['X_train'], data['y_train'], args.folds, args.seed, min(workers, len(grid) * args.folds))
+            best = max(search, key=lambda result: result['mean_accuracy'])['params']
+            for result in search:
+                print(f"  {result['mean_accuracy']:.4f}  {result['params']}")
+            print(f'Cross-validated {len(grid)} combination(s) x {args.folds} folds in {time.perf_counter() - start:.1f}s')
+
+        start = time.perf_counter()
+        ckd_model, accuracy = fit_classifier(best, data, args.jobs, args.seed)
+        print(f'ckd_model {best}: holdout accuracy {accuracy:.4f} ({time.perf_counter() - start:.1f}s)')
+    start = time.perf_counter()
+    param_model, r2 = fit_param_model(TARGETS_CSV, args.jobs, args.test_size, args.seed)
+    print(f'future_params: holdout R2 {r2:.4f} ({time.perf_counter() - start:.1f}s)')
+    start = time.perf_counter()
+    cluster_model, inertia = fit_cluster_model(CLUSTER_CSV, args.seed)
+    print(f'cluster_model: inertia {inertia:.1f} ({time.perf_counter() - start:.1f}s)')
+
+    models = {
+        'ckd_model': ckd_model,
+        'future_params': param_model,
+        'cluster_model': cluster_model,
+        'scaler': scaler,
+        'label_encoders': label_encoders,
+    }
+    metadata = {
+        'datasets': {
+            os.path.basename(path): digest for path, digest in (
+                (args.stages, stages_digest), (TARGETS_CSV, file_digest(TARGETS_CSV)), (CLUSTER_CSV, file_digest(CLUSTER_CSV)),
+            )
+        },
+        'seed': args.seed,
+        'test_size': args.test_size,
+        'folds': 0 if args.chunk_rows else args.folds,
+        'ckd_model': {'params': best, 'holdout_accuracy': accuracy, 'search': search, 'streaming': streaming},
+        'future_params': {'holdout_r2': r2},
+        'cluster_model': {'n_clusters': N_CLUSTERS, 'inertia': inertia},
+    }
+    save_artifacts(models, output, args.version, metadata=metadata)
+    print(f'Wrote bundle {args.version} to {output}')
+
+    if args.pickles:
+        os.makedirs(args.pickles, exist_ok=True)
+        for name, filename in PICKLES.items():
+            with open(os.path.join(args.pickles, filename), 'wb') as f:
+                pickle.dump(models[name], f)
+        print(f'Wrote {len(PICKLES)} pickles to {args.pickles}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())